@@ -1,34 +1,93 @@
 """Go board representation."""
 
+from array import array
 from itertools import chain
+import random
 
 from gomill.common import *
 
-class _Group(object):
-    """Represent a solidly-connected group.
+numpy = None
 
-    Public attributes:
-      colour
-      points
-      is_surrounded
+# Contents of the points in a Board's flat representation
+EMPTY, BLACK, WHITE, BORDER = 0, 1, 2, 3
 
-    Points are coordinate pairs (row, col).
+_colour_codes = {'b' : BLACK, 'w' : WHITE}
+_colours_by_code = (None, 'b', 'w')
 
-    """
 
-class _Region(object):
-    """Represent an empty region.
+class _Geometry(object):
+    """Precomputed tables for a board size.
 
     Public attributes:
-      points
-      neighbouring_colours
+      side            -- board size
+      stride          -- distance between vertically adjacent points
+      size            -- length of the flat representation
+      offsets         -- tuple of offsets to the four neighbours of a point
+      board_points    -- list of coordinates of all points on the board
+      point_indices   -- list of indices of all points on the board
+      points_by_index -- list index -> coordinates (or None for the border)
+      empty_points    -- bytearray representing an empty board
+      zobrist_keys    -- tuple colour code -> list index -> 64-bit int
+
+    The flat representation is row-major, with a single border column shared
+    between the right-hand edge of one row and the left-hand edge of the next,
+    and a border row at the top and bottom. So every point on the board has
+    four neighbours in the array, and no bounds checking is needed.
 
-    Points are coordinate pairs (row, col).
+    There is one _Geometry for each board size; Boards share them.
+
+    The Zobrist keys are generated from a fixed seed, so position hashes are
+    the same in every run.
 
     """
-    def __init__(self):
-        self.points = set()
-        self.neighbouring_colours = set()
+    def __init__(self, side):
+        self.side = side
+        self.stride = stride = side + 1
+        self.size = (side + 2) * stride + 1
+        self.offsets = (-stride, -1, 1, stride)
+        self.board_points = [(_row, _col) for _row in range(side)
+                             for _col in range(side)]
+        self.point_indices = [self.index(row, col)
+                              for (row, col) in self.board_points]
+        self.points_by_index = [None] * self.size
+        self.empty_points = bytearray([BORDER]) * self.size
+        for point, index in zip(self.board_points, self.point_indices):
+            self.points_by_index[index] = point
+            self.empty_points[index] = EMPTY
+        rng = random.Random(side)
+        def make_keys():
+            keys = [0] * self.size
+            for index in self.point_indices:
+                keys[index] = rng.getrandbits(64)
+            return keys
+        self.zobrist_keys = (None, make_keys(), make_keys())
+
+    def index(self, row, col):
+        """Return the index in the flat representation of a point.
+
+        Doesn't check the coordinates.
+
+        """
+        return (row + 1) * self.stride + col
+
+def _initialise_numpy():
+    global numpy
+    if numpy is not None:
+        return
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+_geometries = {}
+
+def _get_geometry(side):
+    try:
+        return _geometries[side]
+    except KeyError:
+        geometry = _geometries[side] = _Geometry(side)
+        return geometry
+
 
 class Board(object):
     """A legal Go position.
@@ -39,95 +98,268 @@ class Board(object):
       side         -- board size (int >= 2)
       board_points -- list of coordinates of all points on the board
 
+    The board_points list is shared between all Boards of the same size; treat
+    it as read-only.
+
+    The position is stored in a flat bytearray with a sentinel border (see
+    _Geometry). Chains of stones are kept up to date as stones are added and
+    removed, as follows:
+
+      _chain      -- array: point index -> index of its chain's head stone
+                     (0 for an empty point)
+      _next_stone -- array: point index -> index of the next stone in the same
+                     chain (the stones of a chain form a circular list)
+      _liberties  -- array: head index -> number of pseudo-liberties
+      _stones     -- array: head index -> number of stones
+
+    Pseudo-liberties count each (stone, adjacent empty point) pair, so an
+    empty point adjacent to several stones of a chain is counted several
+    times. A chain has no liberties if and only if its pseudo-liberty count is
+    zero.
+
+    The Zobrist hash of the position is kept in _hash.
+
+    If undo logging is enabled, _undo_log is a list with an entry for each
+    play() which hasn't been undone: a tuple
+      (index, colour code, list of indices of removed stones, code of removed
+       stones, previous _is_empty)
+    Otherwise it's None.
+
+    _legal_moves_cache is a dict colour code -> list of the points where that
+    colour may legally play (as returned by legal_moves() with no ko point),
+    or None. It's reset to None whenever the position changes.
+
+    Boards pickle as their size and the to_bytes() representation of the
+    position; the undo log isn't preserved.
+
     """
     def __init__(self, side):
-        self.side = side
         if side < 2:
             raise ValueError
-        self.board_points = [(_row, _col) for _row in range(side)
-                             for _col in range(side)]
-        self.board = []
-        for row in range(side):
-            self.board.append([None] * side)
+        geometry = _get_geometry(side)
+        self.side = side
+        self.board_points = geometry.board_points
+        self._geometry = geometry
+        self._points = geometry.empty_points[:]
+        zeros = array('i', [0]) * geometry.size
+        self._chain = zeros
+        self._next_stone = zeros[:]
+        self._liberties = zeros[:]
+        self._stones = zeros[:]
+        self._hash = 0
         self._is_empty = True
+        self._undo_log = None
+        self._legal_moves_cache = None
 
     def copy(self):
         """Return an independent copy of this Board."""
-        b = Board(self.side)
-        b.board = [self.board[i][:] for i in xrange(self.side)]
+        b = Board.__new__(Board)
+        b.side = self.side
+        b.board_points = self.board_points
+        b._geometry = self._geometry
+        b._points = self._points[:]
+        b._chain = self._chain[:]
+        b._next_stone = self._next_stone[:]
+        b._liberties = self._liberties[:]
+        b._stones = self._stones[:]
+        b._hash = self._hash
         b._is_empty = self._is_empty
+        if self._undo_log is None:
+            b._undo_log = None
+        else:
+            b._undo_log = self._undo_log[:]
+        b._legal_moves_cache = self._legal_moves_cache
         return b
 
-    def _make_group(self, row, col, colour):
-        points = set()
-        is_surrounded = True
-        to_handle = set()
-        to_handle.add((row, col))
-        while to_handle:
-            point = to_handle.pop()
-            points.add(point)
-            r, c = point
-            for neighbour in [(r-1, c), (r+1, c), (r, c-1), (r, c+1)]:
-                (r1, c1) = neighbour
-                if not ((0 <= r1 < self.side) and (0 <= c1 < self.side)):
-                    continue
-                neigh_colour = self.board[r1][c1]
-                if neigh_colour is None:
-                    is_surrounded = False
-                elif neigh_colour == colour:
-                    if neighbour not in points:
-                        to_handle.add(neighbour)
-        group = _Group()
-        group.colour = colour
-        group.points = points
-        group.is_surrounded = is_surrounded
-        return group
-
-    def _make_empty_region(self, row, col):
-        points = set()
-        neighbouring_colours = set()
-        to_handle = set()
-        to_handle.add((row, col))
-        while to_handle:
-            point = to_handle.pop()
-            points.add(point)
-            r, c = point
-            for neighbour in [(r-1, c), (r+1, c), (r, c-1), (r, c+1)]:
-                (r1, c1) = neighbour
-                if not ((0 <= r1 < self.side) and (0 <= c1 < self.side)):
-                    continue
-                neigh_colour = self.board[r1][c1]
-                if neigh_colour is None:
-                    if neighbour not in points:
-                        to_handle.add(neighbour)
-                else:
-                    neighbouring_colours.add(neigh_colour)
-        region = _Region()
-        region.points = points
-        region.neighbouring_colours = neighbouring_colours
-        return region
+    def _index(self, row, col):
+        """Return the index of a point, checking the coordinates.
+
+        Raises IndexError if the coordinates are out of range.
 
-    def _find_surrounded_groups(self):
-        """Find solidly-connected groups with 0 liberties.
+        """
+        if not (0 <= row < self.side and 0 <= col < self.side):
+            raise IndexError
+        return (row + 1) * self._geometry.stride + col
 
-        Returns a list of _Groups.
+    def _chain_stones(self, head):
+        """Return a list of the indices of the stones in a chain."""
+        next_stone = self._next_stone
+        result = [head]
+        index = next_stone[head]
+        while index != head:
+            result.append(index)
+            index = next_stone[index]
+        return result
+
+    def _make_chain(self, index):
+        """Record the chain containing the stone at 'index'.
+
+        Sets the _chain, _next_stone, _liberties, and _stones entries from
+        scratch.
+
+        Returns the chain's head index.
+
+        """
+        points = self._points
+        colour = points[index]
+        offsets = self._geometry.offsets
+        stones = [index]
+        seen = set(stones)
+        liberties = 0
+        i = 0
+        while i < len(stones):
+            stone = stones[i]
+            i += 1
+            for offset in offsets:
+                neighbour = stone + offset
+                neigh_colour = points[neighbour]
+                if neigh_colour == EMPTY:
+                    liberties += 1
+                elif neigh_colour == colour and neighbour not in seen:
+                    seen.add(neighbour)
+                    stones.append(neighbour)
+        chain = self._chain
+        next_stone = self._next_stone
+        for stone, following in zip(stones, stones[1:] + stones[:1]):
+            chain[stone] = index
+            next_stone[stone] = following
+        self._liberties[index] = liberties
+        self._stones[index] = len(stones)
+        return index
+
+    def _rebuild_chains(self):
+        """Recalculate all chains from the board contents.
+
+        Returns a list of the head indices of the chains with no liberties.
 
         """
         surrounded = []
-        handled = set()
-        for (row, col) in self.board_points:
-            colour = self.board[row][col]
-            if colour is None:
-                continue
-            point = (row, col)
-            if point in handled:
+        chain = self._chain
+        points = self._points
+        for index in self._geometry.point_indices:
+            chain[index] = 0
+        for index in self._geometry.point_indices:
+            if points[index] == EMPTY or chain[index] != 0:
                 continue
-            group = self._make_group(row, col, colour)
-            if group.is_surrounded:
-                surrounded.append(group)
-            handled.update(group.points)
+            head = self._make_chain(index)
+            if self._liberties[head] == 0:
+                surrounded.append(head)
         return surrounded
 
+    def _merge_chains(self, head1, head2):
+        """Merge two chains of the same colour.
+
+        Returns the head of the merged chain (which is one of the two
+        originals).
+
+        """
+        stones = self._stones
+        if stones[head1] < stones[head2]:
+            head1, head2 = head2, head1
+        chain = self._chain
+        for stone in self._chain_stones(head2):
+            chain[stone] = head1
+        next_stone = self._next_stone
+        next_stone[head1], next_stone[head2] = \
+            next_stone[head2], next_stone[head1]
+        self._liberties[head1] += self._liberties[head2]
+        stones[head1] += stones[head2]
+        return head1
+
+    def _remove_chain(self, head):
+        """Remove a chain's stones from the board.
+
+        Gives the freed points back as liberties to the neighbouring chains.
+
+        Returns a list of the indices of the removed stones.
+
+        """
+        points = self._points
+        chain = self._chain
+        liberties = self._liberties
+        offsets = self._geometry.offsets
+        keys = self._geometry.zobrist_keys[points[head]]
+        removed = self._chain_stones(head)
+        for stone in removed:
+            points[stone] = EMPTY
+            chain[stone] = 0
+            self._hash ^= keys[stone]
+        for stone in removed:
+            for offset in offsets:
+                neighbour_head = chain[stone + offset]
+                if neighbour_head != 0:
+                    liberties[neighbour_head] += 1
+        return removed
+
+    def _find_removals(self, index, code):
+        """Work out which chains a move at an empty point would remove.
+
+        index -- index of an empty point
+        code  -- colour code of the stone to be placed there
+
+        Returns a pair (heads, is_self_capture)
+
+        heads is a list of the heads of the chains which would be removed.
+        If is_self_capture is true, these are the player's own chains (and
+        the new stone would be removed too); otherwise they're captured
+        opponent chains.
+
+        """
+        points = self._points
+        chain = self._chain
+        liberties = self._liberties
+        # map head -> number of the chain's stones adjacent to the point
+        adjacent = {}
+        has_liberty = False
+        for offset in self._geometry.offsets:
+            neighbour = index + offset
+            neigh_colour = points[neighbour]
+            if neigh_colour == EMPTY:
+                has_liberty = True
+            elif neigh_colour != BORDER:
+                head = chain[neighbour]
+                adjacent[head] = adjacent.get(head, 0) + 1
+        # A chain's pseudo-liberties at the point are the adjacent stones, so
+        # the chain has no other liberties if the two counts are equal.
+        captured = [head for (head, count) in adjacent.iteritems()
+                    if points[head] != code and liberties[head] == count]
+        if captured or has_liberty:
+            return captured, False
+        friends = []
+        for head, count in adjacent.iteritems():
+            if points[head] != code:
+                continue
+            if liberties[head] != count:
+                return [], False
+            friends.append(head)
+        return friends, True
+
+    def _make_empty_region(self, index):
+        """Find the empty region containing the point at 'index'.
+
+        Returns a pair (list of indices, set of neighbouring colour codes)
+
+        """
+        points = self._points
+        offsets = self._geometry.offsets
+        region = [index]
+        seen = set(region)
+        neighbouring_colours = set()
+        i = 0
+        while i < len(region):
+            point = region[i]
+            i += 1
+            for offset in offsets:
+                neighbour = point + offset
+                neigh_colour = points[neighbour]
+                if neigh_colour == EMPTY:
+                    if neighbour not in seen:
+                        seen.add(neighbour)
+                        region.append(neighbour)
+                elif neigh_colour != BORDER:
+                    neighbouring_colours.add(neigh_colour)
+        return region, neighbouring_colours
+
     def is_empty(self):
         """Say whether the board is empty."""
         return self._is_empty
@@ -140,9 +372,7 @@ class Board(object):
         Raises IndexError if the coordinates are out of range.
 
         """
-        if row < 0 or col < 0:
-            raise IndexError
-        return self.board[row][col]
+        return _colours_by_code[self._points[self._index(row, col)]]
 
     def play(self, row, col, colour):
         """Play a move on the board.
@@ -157,33 +387,128 @@ class Board(object):
         Returns the point forbidden by simple ko, or None
 
         """
-        if row < 0 or col < 0:
-            raise IndexError
-        opponent = opponent_of(colour)
-        if self.board[row][col] is not None:
+        index = self._index(row, col)
+        try:
+            code = _colour_codes[colour]
+        except KeyError:
+            raise ValueError
+        points = self._points
+        if points[index] != EMPTY:
             raise ValueError
-        self.board[row][col] = colour
+        chain = self._chain
+        liberties = self._liberties
+        was_empty = self._is_empty
+        self._legal_moves_cache = None
+        points[index] = code
+        self._hash ^= self._geometry.zobrist_keys[code][index]
         self._is_empty = False
-        surrounded = self._find_surrounded_groups()
+        chain[index] = head = index
+        self._next_stone[index] = index
+        self._stones[index] = 1
+        liberties[index] = 0
+        to_capture = []
+        for offset in self._geometry.offsets:
+            neighbour = index + offset
+            neigh_colour = points[neighbour]
+            if neigh_colour == EMPTY:
+                liberties[head] += 1
+            elif neigh_colour != BORDER:
+                neighbour_head = chain[neighbour]
+                liberties[neighbour_head] -= 1
+                if neigh_colour == code:
+                    if neighbour_head != head:
+                        head = self._merge_chains(head, neighbour_head)
+                elif (liberties[neighbour_head] == 0 and
+                      neighbour_head not in to_capture):
+                    to_capture.append(neighbour_head)
         simple_ko_point = None
-        if surrounded:
-            if len(surrounded) == 1:
-                to_capture = surrounded
-                if len(to_capture[0].points) == self.side*self.side:
-                    self._is_empty = True
-            else:
-                to_capture = [group for group in surrounded
-                              if group.colour == opponent]
-                if len(to_capture) == 1 and len(to_capture[0].points) == 1:
-                    self_capture = [group for group in surrounded
-                                    if group.colour == colour]
-                    if len(self_capture[0].points) == 1:
-                        (simple_ko_point,) = to_capture[0].points
-            for group in to_capture:
-                for r, c in group.points:
-                    self.board[r][c] = None
+        removed = []
+        removed_code = EMPTY
+        if to_capture:
+            if (len(to_capture) == 1 and self._stones[to_capture[0]] == 1 and
+                self._stones[head] == 1 and liberties[head] == 0):
+                simple_ko_point = \
+                    self._geometry.points_by_index[to_capture[0]]
+            removed_code = points[to_capture[0]]
+            for captured_head in to_capture:
+                removed += self._remove_chain(captured_head)
+        elif liberties[head] == 0:
+            removed = self._remove_chain(head)
+            removed_code = code
+            if len(removed) == self.side*self.side:
+                self._is_empty = True
+        if self._undo_log is not None:
+            self._undo_log.append(
+                (index, code, removed, removed_code, was_empty))
         return simple_ko_point
 
+    def start_undo_log(self):
+        """Start recording moves, so that they can be undone.
+
+        After this is called, each call to play() records the stone placed
+        and any stones removed, and undo() can be used to take back moves.
+
+        Discards any moves previously recorded.
+
+        """
+        self._undo_log = []
+
+    def undo(self):
+        """Take back the most recent move.
+
+        Restores the position from before the last play() which hasn't
+        already been undone.
+
+        Raises ValueError if start_undo_log() hasn't been called, or there are
+        no more recorded moves. apply_setup() discards the recorded moves.
+
+        The cost doesn't depend on the number of moves played.
+
+        """
+        if not self._undo_log:
+            raise ValueError("nothing to undo")
+        index, code, removed, removed_code, was_empty = self._undo_log.pop()
+        self._legal_moves_cache = None
+        points = self._points
+        chain = self._chain
+        liberties = self._liberties
+        offsets = self._geometry.offsets
+        keys = self._geometry.zobrist_keys
+        if points[index] == code:
+            # Take the stone away and recalculate the chains it was joining.
+            orphans = self._chain_stones(chain[index])
+            orphans.remove(index)
+            points[index] = EMPTY
+            chain[index] = 0
+            self._hash ^= keys[code][index]
+            for stone in orphans:
+                chain[stone] = 0
+            for stone in orphans:
+                if chain[stone] == 0:
+                    self._make_chain(stone)
+            for offset in offsets:
+                neighbour = index + offset
+                neigh_colour = points[neighbour]
+                if neigh_colour != code and neigh_colour != EMPTY and \
+                   neigh_colour != BORDER:
+                    liberties[chain[neighbour]] += 1
+        # Put back the removed stones (for a self-capture this includes the
+        # stone played, which should stay removed).
+        restored = [stone for stone in removed if stone != index]
+        removed_keys = keys[removed_code] if restored else None
+        for stone in restored:
+            points[stone] = removed_code
+            self._hash ^= removed_keys[stone]
+        for stone in restored:
+            for offset in offsets:
+                neighbour_head = chain[stone + offset]
+                if neighbour_head != 0:
+                    liberties[neighbour_head] -= 1
+        for stone in restored:
+            if chain[stone] == 0:
+                self._make_chain(stone)
+        self._is_empty = was_empty
+
     def apply_setup(self, black_points, white_points, empty_points):
         """Add setup stones or removals to the position.
 
@@ -201,26 +526,229 @@ class Board(object):
 
         Raises IndexError if any coordinates are out of range.
 
+        Discards any moves recorded for undo().
+
         """
         for (row, col) in chain(black_points, white_points, empty_points):
-            if row < 0 or col < 0 or row >= self.side or col >= self.side:
-                raise IndexError
+            self._index(row, col)
+        if self._undo_log is not None:
+            self._undo_log = []
+        self._legal_moves_cache = None
+        points = self._points
+        index = self._geometry.index
         for (row, col) in black_points:
-            self.board[row][col] = 'b'
+            points[index(row, col)] = BLACK
         for (row, col) in white_points:
-            self.board[row][col] = 'w'
+            points[index(row, col)] = WHITE
         for (row, col) in empty_points:
-            self.board[row][col] = None
-        captured = self._find_surrounded_groups()
-        for group in captured:
-            for row, col in group.points:
-                self.board[row][col] = None
+            points[index(row, col)] = EMPTY
+        captured = self._rebuild_chains()
+        for head in captured:
+            for stone in self._chain_stones(head):
+                points[stone] = EMPTY
+        if captured:
+            self._rebuild_chains()
+        self._recalculate_summary()
+        return not(captured)
+
+    def _recalculate_summary(self):
+        """Recalculate _hash and _is_empty from the board contents."""
+        points = self._points
+        self._hash = 0
+        keys = self._geometry.zobrist_keys
+        for i in self._geometry.point_indices:
+            code = points[i]
+            if code != EMPTY:
+                self._hash ^= keys[code][i]
         self._is_empty = True
-        for (row, col) in self.board_points:
-            if self.board[row][col] is not None:
+        for i in self._geometry.point_indices:
+            if points[i] != EMPTY:
                 self._is_empty = False
                 break
-        return not(captured)
+
+    def to_bytes(self):
+        """Return a compact representation of the position.
+
+        Returns a string, using two bits per point: see from_bytes().
+
+        Only the position is represented (not the undo log).
+
+        """
+        points = self._points
+        side = self.side
+        stride = self._geometry.stride
+        codes = bytearray()
+        for row in xrange(side):
+            start = (row + 1) * stride
+            codes += points[start:start+side]
+        codes += bytearray(-len(codes) % 4)
+        return str(bytearray(
+            [a | (b << 2) | (c << 4) | (d << 6) for (a, b, c, d)
+             in zip(codes[0::4], codes[1::4], codes[2::4], codes[3::4])]))
+
+    def _load_bytes(self, s):
+        """Set the position from a to_bytes() representation.
+
+        The board must be empty, with no undo log.
+
+        """
+        data = bytearray(s)
+        side = self.side
+        count = side * side
+        if len(data) != (count + 3) // 4:
+            raise ValueError("wrong length for board size")
+        codes = bytearray(len(data) * 4)
+        codes[0::4] = bytearray([byte & 3 for byte in data])
+        codes[1::4] = bytearray([(byte >> 2) & 3 for byte in data])
+        codes[2::4] = bytearray([(byte >> 4) & 3 for byte in data])
+        codes[3::4] = bytearray([byte >> 6 for byte in data])
+        if max(codes) > WHITE or max(codes[count:] or [EMPTY]) != EMPTY:
+            raise ValueError("invalid point value")
+        points = self._points
+        stride = self._geometry.stride
+        for row in xrange(side):
+            start = (row + 1) * stride
+            points[start:start+side] = codes[row*side:(row+1)*side]
+        if self._rebuild_chains():
+            raise ValueError("position has chains with no liberties")
+        self._recalculate_summary()
+
+    @classmethod
+    def from_bytes(cls, side, s):
+        """Instantiate from a to_bytes() representation.
+
+        side -- board size
+        s    -- string
+
+        The representation lists the points in row-major order, starting from
+        the bottom left (row 0, col 0), four to a byte with the first point in
+        the least significant bits. Each point is 0 for empty, 1 for Black, or
+        2 for White. Any unused bits at the end are zero.
+
+        Raises ValueError if the string isn't a valid representation of a
+        legal position of the specified size.
+
+        """
+        board = cls(side)
+        board._load_bytes(s)
+        return board
+
+    def __getstate__(self):
+        return (self.side, self.to_bytes())
+
+    def __setstate__(self, state):
+        side, s = state
+        self.__init__(side)
+        self._load_bytes(s)
+
+    def zobrist_hash(self):
+        """Return a hash of the position.
+
+        Returns a nonnegative int less than 2**64.
+
+        Boards of the same size with the same position always have the same
+        hash (including in different runs). Boards with different positions
+        are very unlikely to.
+
+        This is maintained incrementally, so it's cheap to call.
+
+        """
+        return self._hash
+
+    def hash_after_move(self, row, col, colour):
+        """Return the hash the position would have after a move.
+
+        Returns the value zobrist_hash() would return after play(row, col,
+        colour), without changing the board.
+
+        Raises IndexError if the coordinates are out of range.
+
+        Raises ValueError if the specified point isn't empty.
+
+        """
+        index = self._index(row, col)
+        try:
+            code = _colour_codes[colour]
+        except KeyError:
+            raise ValueError
+        if self._points[index] != EMPTY:
+            raise ValueError
+        keys = self._geometry.zobrist_keys
+        heads, is_self_capture = self._find_removals(index, code)
+        result = self._hash
+        if not is_self_capture:
+            result ^= keys[code][index]
+        for head in heads:
+            head_keys = keys[self._points[head]]
+            for stone in self._chain_stones(head):
+                result ^= head_keys[stone]
+        return result
+
+    def _is_legal_index(self, index, code):
+        points = self._points
+        if points[index] != EMPTY:
+            return False
+        for offset in self._geometry.offsets:
+            if points[index + offset] == EMPTY:
+                return True
+        heads, is_self_capture = self._find_removals(index, code)
+        return not is_self_capture
+
+    def is_legal(self, row, col, colour):
+        """Say whether a move would be legal.
+
+        Returns False if the point is occupied, or if the move would be
+        self-capture; otherwise returns True.
+
+        Doesn't know about any ko rule (see legal_moves()).
+
+        Raises IndexError if the coordinates are out of range.
+
+        Note that play() (and gameplay.Game) permit self-capture; this method
+        and legal_moves() treat it as illegal, which is normally what a move
+        generator wants.
+
+        """
+        index = self._index(row, col)
+        try:
+            code = _colour_codes[colour]
+        except KeyError:
+            raise ValueError
+        return self._is_legal_index(index, code)
+
+    def legal_moves(self, colour, ko_point=None):
+        """List the points where the specified colour may legally play.
+
+        colour   -- 'b' or 'w'
+        ko_point -- (row, col) or None
+
+        Returns a list of points (row, col), in the same order as
+        board_points. See is_legal() for what counts as legal; in addition,
+        ko_point is excluded (so you can pass the simple ko point returned by
+        play()).
+
+        The result is cached until the position next changes, so calling this
+        repeatedly for the same position is cheap.
+
+        """
+        try:
+            code = _colour_codes[colour]
+        except KeyError:
+            raise ValueError
+        cache = self._legal_moves_cache
+        if cache is None:
+            cache = self._legal_moves_cache = {}
+        try:
+            moves = cache[code]
+        except KeyError:
+            is_legal_index = self._is_legal_index
+            moves = [point for (index, point)
+                     in zip(self._geometry.point_indices, self.board_points)
+                     if is_legal_index(index, code)]
+            cache[code] = moves
+        if ko_point is None:
+            return moves[:]
+        return [point for point in moves if point != ko_point]
 
     def list_occupied_points(self):
         """List all nonempty points.
@@ -228,38 +756,362 @@ class Board(object):
         Returns a list of pairs (colour, (row, col))
 
         """
+        points = self._points
+        geometry = self._geometry
         result = []
-        for (row, col) in self.board_points:
-            colour = self.board[row][col]
-            if colour is not None:
-                result.append((colour, (row, col)))
+        for index, point in zip(geometry.point_indices, geometry.board_points):
+            code = points[index]
+            if code != EMPTY:
+                result.append((_colours_by_code[code], point))
         return result
 
-    def area_score(self):
+    def _find_pass_alive(self, code):
+        """Implementation of find_pass_alive().
+
+        Returns a pair (list of indices of pass-alive stones,
+                        list of indices of pass-alive territory)
+
+        """
+        points = self._points
+        chain = self._chain
+        offsets = self._geometry.offsets
+        # Regions are the maximal connected sets of points which don't contain
+        # a stone of the colour we're analysing. For each one we record its
+        # points, the chains bordering it, and the chains it's vital to (the
+        # bordering chains which are adjacent to all its empty points).
+        region_points = []
+        region_chains = []
+        region_vital_to = []
+        region_is_small = []
+        heads = set()
+        seen = set()
+        for index in self._geometry.point_indices:
+            point_code = points[index]
+            if point_code == code:
+                heads.add(chain[index])
+                continue
+            if index in seen:
+                continue
+            region = [index]
+            seen.add(index)
+            bordering = set()
+            vital_to = None
+            is_small = True
+            i = 0
+            while i < len(region):
+                point = region[i]
+                i += 1
+                adjacent = set()
+                for offset in offsets:
+                    neighbour = point + offset
+                    neigh_code = points[neighbour]
+                    if neigh_code == code:
+                        adjacent.add(chain[neighbour])
+                    elif neigh_code != BORDER and neighbour not in seen:
+                        seen.add(neighbour)
+                        region.append(neighbour)
+                bordering |= adjacent
+                if points[point] == EMPTY:
+                    if vital_to is None:
+                        vital_to = adjacent
+                    else:
+                        vital_to &= adjacent
+                    if not adjacent:
+                        is_small = False
+            region_points.append(region)
+            region_chains.append(bordering)
+            region_vital_to.append(vital_to or set())
+            region_is_small.append(is_small)
+
+        alive = heads
+        live_regions = range(len(region_points))
+        while True:
+            live_regions = [r for r in live_regions
+                            if region_chains[r] <= alive]
+            vital_counts = dict.fromkeys(alive, 0)
+            for r in live_regions:
+                for head in region_vital_to[r]:
+                    vital_counts[head] += 1
+            survivors = set(head for head, count in vital_counts.iteritems()
+                            if count >= 2)
+            if survivors == alive:
+                break
+            alive = survivors
+
+        stones = []
+        for head in alive:
+            stones += self._chain_stones(head)
+        territory = []
+        for r in live_regions:
+            if region_is_small[r]:
+                territory += region_points[r]
+        return stones, territory
+
+    def find_pass_alive(self, colour):
+        """Find the pass-alive stones and territory for one colour.
+
+        Returns a pair (list of points, list of points)
+
+        The first list contains the colour's stones which are pass-alive: the
+        opponent can't capture them even if the colour passes every move. This
+        is calculated using Benson's algorithm.
+
+        The second list contains the colour's pass-alive territory: points
+        (empty, or with opponent stones) in regions which are surrounded by
+        pass-alive stones, and in which every empty point is next to one of
+        them. The opponent can never make living stones there, so any
+        opponent stones in the territory are dead.
+
+        Both lists are in unspecified order.
+
+        """
+        stones, territory = self._find_pass_alive(_colour_codes[colour])
+        points_by_index = self._geometry.points_by_index
+        return ([points_by_index[index] for index in stones],
+                [points_by_index[index] for index in territory])
+
+    def area_score(self, remove_dead=False):
         """Calculate the area score of a position.
 
-        Assumes all stones are alive.
+        remove_dead -- bool (default False)
+
+        Normally assumes all stones are alive. If remove_dead is true, first
+        removes any stones in the opponent's pass-alive territory (see
+        find_pass_alive()); other stones are still assumed to be alive.
 
         Returns black score minus white score.
 
         Doesn't take komi into account.
 
         """
-        scores = {'b' : 0, 'w' : 0}
+        if remove_dead:
+            points = self._points
+            dead = []
+            for code in BLACK, WHITE:
+                stones, territory = self._find_pass_alive(code)
+                dead += [index for index in territory
+                         if points[index] != EMPTY]
+            if dead:
+                # The copy's chain tables are left stale, but area_score()
+                # only looks at the points.
+                board = self.copy()
+                for index in dead:
+                    board._points[index] = EMPTY
+                return board.area_score()
+        points = self._points
+        scores = [0, 0, 0]
         handled = set()
-        for (row, col) in self.board_points:
-            colour = self.board[row][col]
-            if colour is not None:
-                scores[colour] += 1
+        for index in self._geometry.point_indices:
+            code = points[index]
+            if code != EMPTY:
+                scores[code] += 1
                 continue
-            point = (row, col)
-            if point in handled:
+            if index in handled:
                 continue
-            region = self._make_empty_region(row, col)
-            region_size = len(region.points)
-            for colour in ('b', 'w'):
-                if colour in region.neighbouring_colours:
-                    scores[colour] += region_size
-            handled.update(region.points)
-        return scores['b'] - scores['w']
+            region, neighbouring_colours = self._make_empty_region(index)
+            for code in neighbouring_colours:
+                scores[code] += len(region)
+            handled.update(region)
+        return scores[BLACK] - scores[WHITE]
+
+
+def _points_array(boards, geometry):
+    """Return the flat representations of boards of a single size.
+
+    Returns a NumPy uint8 array with a row for each board (a copy, so it's
+    safe to modify).
+
+    """
+    return numpy.frombuffer(
+        bytes(bytearray().join(board._points for board in boards)),
+        dtype=numpy.uint8).reshape(len(boards), geometry.size).copy()
+
+def _get_zobrist_array(geometry):
+    """Return the geometry's Zobrist keys as a NumPy array.
+
+    Returns a uint64 array indexed by (point contents, point index), with
+    zeros for EMPTY and BORDER.
+
+    """
+    try:
+        return geometry._zobrist_array
+    except AttributeError:
+        keys = numpy.zeros((4, geometry.size), dtype=numpy.uint64)
+        for code in BLACK, WHITE:
+            keys[code] = geometry.zobrist_keys[code]
+        geometry._zobrist_array = keys
+        return keys
 
+def _boards_from_points_array(points, geometry):
+    """Make Boards from flat representations.
+
+    points -- NumPy uint8 array with a row for each board, as returned by
+              _points_array()
+
+    Returns a list of Boards.
+
+    This sets up the chains for all the boards together using array
+    operations, which is much faster than apply_setup() or from_bytes() when
+    there are many boards.
+
+    """
+    count, size = points.shape
+    flat_points = points.ravel()
+    game_numbers, stone_indices = numpy.nonzero(
+        (points == BLACK) | (points == WHITE))
+    stone_count = len(stone_indices)
+    # Stones are numbered in index order within each game, so the lowest
+    # number in a chain is the head _rebuild_chains() would choose.
+    stone_flat = game_numbers * size + stone_indices
+    numbers = numpy.zeros(count * size, dtype=numpy.intp)
+    numbers[stone_flat] = numpy.arange(stone_count)
+    codes = flat_points[stone_flat]
+    linked = []
+    for offset in 1, geometry.stride:
+        same = numpy.flatnonzero(flat_points[stone_flat + offset] == codes)
+        linked.append((numbers[stone_flat[same]],
+                       numbers[stone_flat[same] + offset]))
+    firsts = numpy.concatenate([first for (first, second) in linked])
+    seconds = numpy.concatenate([second for (first, second) in linked])
+    # Label each stone with the lowest number in its chain, by repeatedly
+    # pointing the higher label of each link at the lower one and then
+    # following labels to their own labels.
+    labels = numpy.arange(stone_count)
+    while True:
+        first_labels = labels[firsts]
+        second_labels = labels[seconds]
+        differ = numpy.flatnonzero(first_labels != second_labels)
+        if not len(differ):
+            break
+        first_labels = first_labels[differ]
+        second_labels = second_labels[differ]
+        labels[numpy.maximum(first_labels, second_labels)] = \
+            numpy.minimum(first_labels, second_labels)
+        while True:
+            new_labels = labels[labels]
+            if numpy.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+    heads = numpy.flatnonzero(labels == numpy.arange(stone_count))
+
+    pseudo_liberties = numpy.zeros(stone_count, dtype=numpy.int32)
+    for offset in geometry.offsets:
+        pseudo_liberties += (flat_points[stone_flat + offset] == EMPTY)
+    chain = numpy.zeros(count * size, dtype=numpy.int32)
+    chain[stone_flat] = stone_indices[labels]
+    liberties = numpy.zeros(count * size, dtype=numpy.int32)
+    liberties[stone_flat[heads]] = numpy.bincount(
+        labels, pseudo_liberties, minlength=stone_count)[heads]
+    stones = numpy.zeros(count * size, dtype=numpy.int32)
+    stones[stone_flat[heads]] = numpy.bincount(
+        labels, minlength=stone_count)[heads]
+
+    # Link each chain's stones into a circular list, in index order
+    order = numpy.argsort(labels, kind='mergesort')
+    sorted_labels = labels[order]
+    following = numpy.empty(stone_count, dtype=numpy.int32)
+    following[:-1] = stone_indices[order[1:]]
+    is_first = numpy.ones(stone_count, dtype=bool)
+    is_first[1:] = (sorted_labels[1:] != sorted_labels[:-1])
+    is_last = numpy.ones(stone_count, dtype=bool)
+    is_last[:-1] = is_first[1:]
+    following[is_last] = stone_indices[order[is_first]]
+    next_stone = numpy.zeros(count * size, dtype=numpy.int32)
+    next_stone[stone_flat[order]] = following
+
+    hashes = numpy.zeros(count, dtype=numpy.uint64)
+    if stone_count:
+        # game_numbers is in order, so each game's stones are together
+        starts = numpy.flatnonzero(numpy.concatenate(
+            ([True], game_numbers[1:] != game_numbers[:-1])))
+        hashes[game_numbers[starts]] = numpy.bitwise_xor.reduceat(
+            _get_zobrist_array(geometry)[codes, stone_indices], starts)
+    stones_per_game = numpy.bincount(game_numbers, minlength=count)
+
+    def to_arrays(a):
+        data = a.tostring()
+        row_bytes = size * a.itemsize
+        result = []
+        for start in xrange(0, count * row_bytes, row_bytes):
+            row = array('i')
+            row.fromstring(data[start : start+row_bytes])
+            result.append(row)
+        return result
+
+    points_data = points.tostring()
+    result = []
+    for i, (board_chain, board_next_stone, board_liberties, board_stones,
+            board_hash, board_stone_count) in enumerate(zip(
+            to_arrays(chain), to_arrays(next_stone), to_arrays(liberties),
+            to_arrays(stones), hashes.tolist(), stones_per_game.tolist())):
+        board = Board.__new__(Board)
+        board.side = geometry.side
+        board.board_points = geometry.board_points
+        board._geometry = geometry
+        board._points = bytearray(points_data[i*size : (i+1)*size])
+        board._chain = board_chain
+        board._next_stone = board_next_stone
+        board._liberties = board_liberties
+        board._stones = board_stones
+        board._hash = board_hash
+        board._is_empty = (board_stone_count == 0)
+        board._undo_log = None
+        board._legal_moves_cache = None
+        result.append(board)
+    return result
+
+def _area_scores_numpy(boards, geometry):
+    """Implementation of area_score_many() for boards of a single size."""
+    stride = geometry.stride
+    points = _points_array(boards, geometry)
+    empty = (points == EMPTY)
+
+    def reach(stones):
+        # Flood-fill from the stones into the empty points, one step per pass
+        reached = stones.copy()
+        while True:
+            grown = reached.copy()
+            grown[:, 1:] |= reached[:, :-1]
+            grown[:, :-1] |= reached[:, 1:]
+            grown[:, stride:] |= reached[:, :-stride]
+            grown[:, :-stride] |= reached[:, stride:]
+            grown &= empty
+            grown |= stones
+            if numpy.array_equal(grown, reached):
+                return reached
+            reached = grown
+
+    black = (points == BLACK)
+    white = (points == WHITE)
+    reaches_black = reach(black)
+    reaches_white = reach(white)
+    black_area = (reaches_black & ~reaches_white).sum(axis=1)
+    white_area = (reaches_white & ~reaches_black).sum(axis=1)
+    return [int(score) for score in black_area - white_area]
+
+def area_score_many(boards):
+    """Calculate the area scores of many positions.
+
+    boards -- sequence of Boards (they needn't all be the same size)
+
+    Returns a list of ints: the area_score() of each board, in order.
+
+    If NumPy is available, this scores all boards of the same size together
+    using array operations, which is much faster than calling area_score() on
+    each board when there are many of them. Otherwise it calls area_score()
+    on each board.
+
+    """
+    _initialise_numpy()
+    if numpy is None:
+        return [board.area_score() for board in boards]
+    indices_by_side = {}
+    for i, board in enumerate(boards):
+        indices_by_side.setdefault(board.side, []).append(i)
+    result = [None] * len(boards)
+    for side, indices in indices_by_side.iteritems():
+        scores = _area_scores_numpy([boards[i] for i in indices],
+                                    _get_geometry(side))
+        for i, score in zip(indices, scores):
+            result[i] = score
+    return result
@@ -429,11 +429,20 @@ class Cem_tuner(Competition):
         job.board_size = self.board_size
         job.komi = self.komi
         job.move_limit = self.move_limit
+        job.ko_rule = self.ko_rule
+        job.adjudication_pass_alive_margin = \
+            self.adjudication_pass_alive_margin
+        job.adjudication_stable_score_moves = \
+            self.adjudication_stable_score_moves
         job.handicap = self.handicap
         job.handicap_is_free = (self.handicap_style == 'free')
         job.use_internal_scorer = (self.scorer == 'internal')
         job.internal_scorer_handicap_compensation = \
             self.internal_scorer_handicap_compensation
+        job.internal_scorer_removes_dead = self.internal_scorer_removes_dead
+        job.gtp_response_timeout = self.gtp_response_timeout
+        job.gtp_game_timeout = self.gtp_game_timeout
+        job.gtp_timeout_forfeits = self.gtp_timeout_forfeits
         job.sgf_event = self.competition_code
         job.sgf_note = ("Candidate parameters: %s" %
                         self.format_optimiser_parameters(
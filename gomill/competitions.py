@@ -34,8 +34,27 @@ class Control_file_token(object):
         return "<%s>" % self.name
 
 
+def interpret_gtp_address(v):
+    """Interpret an engine server address.
+
+    Accepts a string (Unix-domain socket pathname) or a pair (host, port).
+
+    """
+    if isinstance(v, basestring):
+        return interpret_8bit_string(v)
+    try:
+        host, port = v
+    except Exception:
+        raise ValueError("not a string or a pair (host, port)")
+    host = interpret_8bit_string(host)
+    port = interpret_int(port)
+    if not 0 < port < 65536:
+        raise ValueError("invalid port number")
+    return (host, port)
+
 _player_settings = [
-    Setting('command', interpret_shlex_sequence),
+    Setting('command', allow_none(interpret_shlex_sequence), default=None),
+    Setting('gtp_address', allow_none(interpret_gtp_address), default=None),
     Setting('cwd', allow_none(interpret_8bit_string), default=None),
     Setting('environ',
             allow_none(interpret_map_of(
@@ -50,6 +69,7 @@ _player_settings = [
     Setting('startup_gtp_commands', allow_none(interpret_sequence),
             defaultmaker=list),
     Setting('discard_stderr', interpret_bool, default=False),
+    Setting('games_per_process', interpret_positive_int, default=1),
     ]
 
 class Player_config(Quiet_config):
@@ -237,12 +257,28 @@ class Competition(object):
         player = game_jobs.Player()
         player.code = code
 
-        try:
-            player.cmd_args = config['command']
-            if '/' in player.cmd_args[0]:
-                player.cmd_args[0] = self.resolve_pathname(player.cmd_args[0])
-        except Exception, e:
-            raise ControlFileError("'command': %s" % e)
+        if config['command'] is None and config['gtp_address'] is None:
+            raise ControlFileError("'command' not specified")
+        if config['command'] is not None and config['gtp_address'] is not None:
+            raise ControlFileError(
+                "'command' and 'gtp_address' both specified")
+
+        if config['command'] is not None:
+            try:
+                player.cmd_args = config['command']
+                if '/' in player.cmd_args[0]:
+                    player.cmd_args[0] = self.resolve_pathname(
+                        player.cmd_args[0])
+            except Exception, e:
+                raise ControlFileError("'command': %s" % e)
+
+        address = config['gtp_address']
+        if isinstance(address, basestring):
+            try:
+                address = self.resolve_pathname(address)
+            except Exception, e:
+                raise ControlFileError("'gtp_address': %s" % e)
+        player.gtp_address = address
 
         try:
             player.cwd = self.resolve_pathname(config['cwd'])
@@ -284,6 +320,8 @@ class Competition(object):
         if config['discard_stderr']:
             player.discard_stderr = True
 
+        player.games_per_process = config['games_per_process']
+
         return player
 
 
@@ -506,8 +544,20 @@ game_settings = [
     Setting('handicap', allow_none(interpret_int), default=None),
     Setting('handicap_style', interpret_enum('fixed', 'free'), default='fixed'),
     Setting('move_limit', interpret_positive_int, default=1000),
+    Setting('ko_rule', interpret_enum('simple', 'positional', 'situational'),
+            default='simple'),
+    Setting('adjudication_pass_alive_margin',
+            allow_none(interpret_non_negative_float), default=None),
+    Setting('adjudication_stable_score_moves',
+            allow_none(interpret_positive_int), default=None),
     Setting('scorer', interpret_enum('internal', 'players'), default='players'),
     Setting('internal_scorer_handicap_compensation',
             interpret_enum('no', 'full', 'short'), default='full'),
+    Setting('internal_scorer_removes_dead', interpret_bool, default=False),
+    Setting('gtp_response_timeout', allow_none(interpret_positive_float),
+            default=None),
+    Setting('gtp_game_timeout', allow_none(interpret_positive_float),
+            default=None),
+    Setting('gtp_timeout_forfeits', interpret_bool, default=False),
     ]
 
@@ -1,7 +1,12 @@
 """Connection between GTP games and the job manager."""
 
+from __future__ import with_statement
+
 import datetime
 import os
+import stat
+import threading
+import time
 
 from gomill import gtp_controller
 from gomill import gtp_games
@@ -16,8 +21,10 @@ class Player(object):
     required attributes:
       code     -- short string
       cmd_args -- list of strings, as for subprocess.Popen
+                  (or None if gtp_address is set)
 
     optional attributes:
+      gtp_address          -- string or pair (host, port) (default None)
       is_reliable_scorer   -- bool (default True)
       allow_claim          -- bool (default False)
       gtp_aliases          -- map command string -> command string
@@ -25,6 +32,7 @@ class Player(object):
       discard_stderr       -- bool (default False)
       cwd                  -- working directory to change to (default None)
       environ              -- maplike of environment variables (default None)
+      games_per_process    -- int (default 1)
 
     See gtp_controllers.Gtp_controller for an explanation of gtp_aliases.
 
@@ -36,10 +44,21 @@ class Player(object):
     environment variables; use 'environ' to add variables or replace particular
     values.
 
+    If games_per_process is greater than 1, the engine subprocess is kept
+    running after each game and reused for later games run in the same process
+    (see Game_job), until it has played that many games.
+
+    If gtp_address is set, the player is an engine server which is already
+    running, rather than a subprocess; its value is the address to connect to,
+    as for gtp_controller.Socket_gtp_channel. In this case cmd_args, cwd,
+    environ, discard_stderr, and games_per_process are ignored.
+
     Players are suitable for pickling.
 
     """
     def __init__(self):
+        self.cmd_args = None
+        self.gtp_address = None
         self.is_reliable_scorer = True
         self.allow_claim = False
         self.gtp_aliases = {}
@@ -47,6 +66,7 @@ class Player(object):
         self.discard_stderr = False
         self.cwd = None
         self.environ = None
+        self.games_per_process = 1
 
     def make_environ(self):
         """Return environment variables to use with the player's subprocess.
@@ -63,7 +83,11 @@ class Player(object):
         """Return an independent clone of the Player."""
         result = Player()
         result.code = code
-        result.cmd_args = list(self.cmd_args)
+        if self.cmd_args is None:
+            result.cmd_args = None
+        else:
+            result.cmd_args = list(self.cmd_args)
+        result.gtp_address = self.gtp_address
         result.is_reliable_scorer = self.is_reliable_scorer
         result.allow_claim = self.allow_claim
         result.gtp_aliases = dict(self.gtp_aliases)
@@ -74,8 +98,109 @@ class Player(object):
             result.environ = None
         else:
             result.environ = dict(self.environ)
+        result.games_per_process = self.games_per_process
         return result
 
+# Engine subprocesses and connections to engine servers, kept for reuse by
+# later games run in this process.
+_channel_pool = gtp_controller.Gtp_channel_pool()
+
+def _get_socket_pool_key(player):
+    """Return the key used to pool a socket player's connections.
+
+    Connections are only reused for players with the same address and startup
+    commands.
+
+    """
+    return (player.gtp_address,
+            tuple((command, tuple(arguments))
+                  for command, arguments in player.startup_gtp_commands))
+
+def _get_subprocess_pool_key(player, worker_id):
+    """Return the key used to pool a player's engine subprocesses.
+
+    Subprocesses are only reused for the same player code, command line,
+    working directory, and environment, in the same worker.
+
+    """
+    if player.environ is None:
+        environ = None
+    else:
+        environ = tuple(sorted(player.environ.items()))
+    return (player.code, tuple(player.cmd_args), player.cwd, environ,
+            worker_id)
+
+def close_pooled_players():
+    """End the engine subprocesses kept for reuse in this process.
+
+    Also closes connections to engine servers. It's harmless to call this if
+    there are none.
+
+    """
+    _channel_pool.close_all()
+
+# Results of engines' capability and description queries, shared by the games
+# run in this process (see Game_job.engine_cache_pathname).
+_capability_cache = gtp_controller.Engine_capability_cache()
+_capability_cache_pathnames_loaded = set()
+_capability_cache_lock = threading.Lock()
+
+def _load_capability_cache(pathname):
+    """Load the capability cache file, if not already done in this process."""
+    with _capability_cache_lock:
+        if pathname in _capability_cache_pathnames_loaded:
+            return
+        _capability_cache_pathnames_loaded.add(pathname)
+    _capability_cache.load(pathname)
+
+def _file_stamp(pathname):
+    """Return (pathname, mtime, size) for a regular file, or None."""
+    try:
+        st = os.stat(pathname)
+    except EnvironmentError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return (pathname, st.st_mtime, st.st_size)
+
+def _find_executable(player):
+    """Return the pathname of a subprocess player's executable, or None."""
+    name = player.cmd_args[0]
+    if os.path.dirname(name):
+        return os.path.join(player.cwd or os.getcwd(), name)
+    search_path = player.make_environ().get('PATH', os.defpath)
+    for directory in search_path.split(os.pathsep):
+        pathname = os.path.join(directory, name)
+        if os.path.isfile(pathname) and os.access(pathname, os.X_OK):
+            return pathname
+    return None
+
+def _get_capability_cache_key(player):
+    """Return the key used to cache a subprocess player's capabilities.
+
+    The key changes if the player's command line, working directory,
+    environment, or GTP aliases change, or if its executable (or any file
+    named on its command line) is modified.
+
+    Returns None if the executable can't be found; such players' capabilities
+    aren't cached.
+
+    """
+    executable_stamp = _file_stamp(_find_executable(player) or "")
+    if executable_stamp is None:
+        return None
+    stamps = [executable_stamp]
+    for arg in player.cmd_args[1:]:
+        stamp = _file_stamp(os.path.join(player.cwd or "", arg))
+        if stamp is not None:
+            stamps.append(stamp)
+    if player.environ is None:
+        environ = None
+    else:
+        environ = tuple(sorted(player.environ.items()))
+    return (tuple(player.cmd_args), player.cwd, environ,
+            tuple(sorted(player.gtp_aliases.items())), tuple(stamps))
+
 class Game_job_result(object):
     """Information returned after a worker process plays a game.
 
@@ -95,7 +220,7 @@ class Game_job(object):
     """A game to be played in a worker process.
 
     A Game_job is designed to be used a job object for the job manager. That is,
-    its public interface is the run() method.
+    its public interface is the run() method (and optionally prelaunch()).
 
     When the job is run, it plays a GTP game as described by its attributes, and
     optionally writes an SGF file. The job result is a Game_job_result object.
@@ -112,9 +237,17 @@ class Game_job(object):
       game_data           -- arbitrary pickleable data
       handicap            -- int
       handicap_is_free    -- bool (default False)
+      ko_rule             -- 'simple', 'positional', or 'situational'
+                             (default 'simple')
+      adjudication_pass_alive_margin -- int or float
+      adjudication_stable_score_moves -- int
       use_internal_scorer -- bool (default True)
       internal_scorer_handicap_compensation -- 'no' , 'short', or 'full'
                              (default 'no')
+      internal_scorer_removes_dead -- bool (default False)
+      gtp_response_timeout -- float (seconds)
+      gtp_game_timeout    -- float (seconds)
+      gtp_timeout_forfeits -- bool (default False)
       sgf_filename        -- filename for the SGF file
       sgf_dirname         -- directory pathname for the SGF file
       void_sgf_dirname    -- directory pathname for the SGF file for void games
@@ -123,6 +256,7 @@ class Game_job(object):
       sgf_note            -- multiline string to put into SGF root comment
       gtp_log_pathname    -- pathname to use for the GTP log
       stderr_pathname     -- pathname to send players' stderr to
+      engine_cache_pathname -- pathname for the engine capability cache
 
     The game_id will be returned in the job result, so you can tell which game
     you're getting the result for. It also appears in the SGF file as a comment
@@ -131,9 +265,21 @@ class Game_job(object):
     game_data is returned in the job result. It's provided as a convenient way
     to pass a small amount of information from get_job() to process_response().
 
+    The adjudication attributes are passed to Gtp_game.set_adjudication(),
+    along with internal_scorer_handicap_compensation.
+
     If use_internal_scorer is False, the Players' is_reliable_scorer attributes
     are used to determine who scores the game (see errors.rst).
 
+    If gtp_response_timeout is set, a player which takes longer than this to
+    respond to any GTP command times out. If gtp_game_timeout is set, a player
+    which is still being waited for this long after the job started times out.
+    A timeout while the game is being played is a forfeit by that player if
+    gtp_timeout_forfeits is true; otherwise (or if the timeout happens while
+    setting up the game) the game is void. gtp_response_timeout is also used as
+    the time to wait for each player to exit after the game, before
+    terminating it.
+
     If sgf_dirname and sgf_filename are set, an SGF file will be written after
     the game is over.
 
@@ -150,12 +296,46 @@ class Game_job(object):
     calling process. But if a player has discard_stderr=True then its standard
     error is sent to os.devnull instead.
 
+    Connections to players with gtp_address set are kept open after the game,
+    and reused for later games run in the same process; so are engine
+    subprocesses for players with games_per_process greater than 1 (the
+    subprocess's GOMILL_GAME_ID is the id of its first game). Each game still
+    begins with the usual setup commands (including clear_board) and the
+    player's startup_gtp_commands. An engine isn't reused after a void game,
+    a forfeit, or any low-level error communicating with it. Use
+    close_pooled_players() to end any subprocesses kept for reuse.
+
+    The two players' engines are started, and their handshakes run, at the
+    same time (in separate threads).
+
+    If prelaunch() is called before run(), the players' engine subprocesses
+    are started (and sent their startup_gtp_commands) at that point. Reused
+    engines and engine servers are still only taken when the job is run.
+    gtp_game_timeout is measured from the call to run().
+
+    If engine_cache_pathname is set, the results of the engine-description
+    and known_command queries to engine subprocesses are remembered, and used
+    instead of repeating the queries for later games run in the same process
+    with the same player. They are also saved in the specified file after
+    each game, and loaded from it by the first such game in any process. An
+    entry is only used while the player's command line, cwd, environ, and
+    gtp_aliases are unchanged, and its executable (and any files named on its
+    command line) have the same modification time and size. Engine servers
+    (players with gtp_address set) are always queried.
+
+    Resource-usage CPU time isn't reported for reused engines; their CPU time
+    comes from gomill-cpu_time, counting only the time used since the start of
+    the game.
+
     Game_jobs are suitable for pickling.
 
     """
     def __init__(self):
         self.handicap = None
         self.handicap_is_free = False
+        self.ko_rule = 'simple'
+        self.adjudication_pass_alive_margin = None
+        self.adjudication_stable_score_moves = None
         self.sgf_filename = None
         self.sgf_dirname = None
         self.void_sgf_dirname = None
@@ -164,12 +344,42 @@ class Game_job(object):
         self.sgf_note = None
         self.use_internal_scorer = True
         self.internal_scorer_handicap_compensation = 'no'
+        self.internal_scorer_removes_dead = False
+        self.gtp_response_timeout = None
+        self.gtp_game_timeout = None
+        self.gtp_timeout_forfeits = False
         self.game_data = None
         self.gtp_log_pathname = None
         self.stderr_pathname = None
+        self.engine_cache_pathname = None
+        self._prelaunched_setup = None
+        self._prelaunch_error = None
 
     # The code here has to be happy to run in a separate process.
 
+    def prelaunch(self, worker_id=None):
+        """Start the players' engines, ready for a later call to run().
+
+        This method may be called by the job manager (in a different thread)
+        while the worker is still running its previous job.
+
+        worker_id -- int or None (must be the same as is passed to run())
+
+        Raises JobFailed if the game can't be created. Errors communicating
+        with the engines are reported when the job is run.
+
+        """
+        self._worker_id = worker_id
+        self._files_to_close = []
+        self._deadline = None
+        self._prelaunch_error = None
+        setup = self._create_game()
+        try:
+            self._start_players(setup, prelaunching=True)
+        except (GtpChannelError, BadGtpResponse), e:
+            self._prelaunch_error = e
+        self._prelaunched_setup = setup
+
     def run(self, worker_id=None):
         """Run the job.
 
@@ -180,11 +390,15 @@ class Game_job(object):
         Returns a Game_job_result, or raises JobFailed.
 
         """
-        self._worker_id = worker_id
-        self._files_to_close = []
+        if self._prelaunched_setup is None:
+            self._worker_id = worker_id
+            self._files_to_close = []
         try:
             return self._run()
         finally:
+            # Drop the prelaunched game, so the job can still be pickled
+            self._prelaunched_setup = None
+            self._prelaunch_error = None
             # These files are all either flushed after every write, or not
             # written to at all from this process, so there shouldn't be any
             # errors from close().
@@ -194,8 +408,7 @@ class Game_job(object):
                 except EnvironmentError:
                     pass
 
-    def _start_player(self, game_controller, game,
-                      colour, player, gtp_log_file):
+    def _start_subprocess_player(self, game_controller, colour, player):
         if player.discard_stderr:
             stderr_pathname = os.devnull
         else:
@@ -205,50 +418,135 @@ class Game_job(object):
             self._files_to_close.append(stderr)
         else:
             stderr = None
-        if not self.use_internal_scorer and player.is_reliable_scorer:
-            game.allow_scorer(colour)
-        if player.allow_claim:
-            game.set_claim_allowed(colour)
         env = player.make_environ()
         env['GOMILL_GAME_ID'] = self.game_id
         if self._worker_id is not None:
             env['GOMILL_SLOT'] = str(self._worker_id)
+        if player.games_per_process > 1:
+            pool_args = {
+                'pool' : _channel_pool,
+                'pool_key' : _get_subprocess_pool_key(player, self._worker_id),
+                'max_uses' : player.games_per_process,
+                }
+        else:
+            pool_args = {}
+        capabilities = None
+        if self.engine_cache_pathname is not None:
+            key = _get_capability_cache_key(player)
+            if key is not None:
+                self._capability_cache_keys[colour] = key
+                capabilities = _capability_cache.get(key)
         game_controller.set_player_subprocess(
-            colour, player.cmd_args,
-            env=env, cwd=player.cwd, stderr=stderr)
+            colour, player.cmd_args, capabilities=capabilities,
+            env=env, cwd=player.cwd, stderr=stderr,
+            response_timeout=self.gtp_response_timeout,
+            deadline=self._deadline,
+            exit_timeout=self.gtp_response_timeout,
+            **pool_args)
+
+    def _start_player(self, game_controller, game,
+                      colour, player, gtp_log_file):
+        if not self.use_internal_scorer and player.is_reliable_scorer:
+            game.allow_scorer(colour)
+        if player.allow_claim:
+            game.set_claim_allowed(colour)
+        if player.gtp_address is not None:
+            game_controller.set_player_socket(
+                colour, player.gtp_address,
+                pool=_channel_pool,
+                pool_key=_get_socket_pool_key(player),
+                response_timeout=self.gtp_response_timeout,
+                deadline=self._deadline)
+        else:
+            self._start_subprocess_player(game_controller, colour, player)
         controller = game_controller.get_controller(colour)
         controller.set_gtp_aliases(player.gtp_aliases)
         if gtp_log_file is not None:
             controller.channel.enable_logging(
                 gtp_log_file, prefix="%s: " % colour)
-        for command, arguments in player.startup_gtp_commands:
-            game_controller.send_command(colour, command, *arguments)
+        game_controller.send_commands(
+            colour, [(command,) + tuple(arguments)
+                     for command, arguments in player.startup_gtp_commands])
 
-    def _run(self):
-        warnings = []
-        log_entries = []
+    def _start_players(self, setup, prelaunching):
+        """Start the players' engines (concurrently).
+
+        If prelaunching is true, starts only the players which don't use
+        pooled engines; otherwise starts the players which weren't started by
+        prelaunch().
+
+        """
+        game_controller, game, gtp_log_file = setup
+        prelaunched = (self._prelaunched_setup is not None)
+        calls = []
+        for colour, player in (('b', self.player_b), ('w', self.player_w)):
+            uses_pool = (player.gtp_address is not None or
+                         player.games_per_process > 1)
+            if prelaunching and uses_pool:
+                continue
+            if not prelaunching and prelaunched and not uses_pool:
+                # The game timeout runs from the start of run()
+                channel = game_controller.get_controller(colour).channel
+                channel.set_deadline(self._deadline)
+                continue
+            calls.append(
+                lambda colour=colour, player=player: self._start_player(
+                    game_controller, game, colour, player, gtp_log_file))
+        # Launch both engines and run their handshakes at once; if both fail,
+        # black's error is reported.
+        utils.call_concurrently(calls)
+
+    def _create_game(self):
+        """Create the Game_controller and Gtp_game, and open the GTP log.
+
+        Returns a tuple (game_controller, game, gtp_log_file)
+
+        """
+        self._capability_cache_keys = {}
+        if self.engine_cache_pathname is not None:
+            _load_capability_cache(self.engine_cache_pathname)
         try:
             game_controller = gtp_controller.Game_controller(
                 self.player_b.code, self.player_w.code)
             game = gtp_games.Gtp_game(
                 game_controller, self.board_size, self.komi, self.move_limit)
             game.set_game_id(self.game_id)
+            game.set_ko_rule(self.ko_rule)
+            game.set_adjudication(self.adjudication_pass_alive_margin,
+                                  self.adjudication_stable_score_moves,
+                                  self.internal_scorer_handicap_compensation)
         except ValueError, e:
             raise job_manager.JobFailed("error creating game: %s" % e)
         if self.use_internal_scorer:
-            game.use_internal_scorer(self.internal_scorer_handicap_compensation)
+            game.use_internal_scorer(
+                self.internal_scorer_handicap_compensation,
+                self.internal_scorer_removes_dead)
+        game.set_timeout_forfeits(self.gtp_timeout_forfeits)
 
         if self.gtp_log_pathname is not None:
             gtp_log_file = open(self.gtp_log_pathname, "w")
             self._files_to_close.append(gtp_log_file)
         else:
             gtp_log_file = None
+        return game_controller, game, gtp_log_file
+
+    def _run(self):
+        warnings = []
+        log_entries = []
+        if self.gtp_game_timeout is not None:
+            self._deadline = time.time() + self.gtp_game_timeout
+        else:
+            self._deadline = None
+        if self._prelaunched_setup is not None:
+            setup = self._prelaunched_setup
+        else:
+            setup = self._create_game()
+        game_controller, game, gtp_log_file = setup
 
         try:
-            self._start_player(game_controller, game,
-                               'b', self.player_b, gtp_log_file)
-            self._start_player(game_controller, game,
-                               'w', self.player_w, gtp_log_file)
+            if self._prelaunch_error is not None:
+                raise self._prelaunch_error
+            self._start_players(setup, prelaunching=False)
             game.prepare()
             if self.handicap:
                 try:
@@ -257,7 +555,7 @@ class Game_job(object):
                     raise BadGtpResponse("invalid handicap")
             game.run()
         except (GtpChannelError, BadGtpResponse), e:
-            game_controller.close_players()
+            game_controller.close_players(return_to_pools=False)
             msg = "aborting game due to error:\n%s" % e
             self._record_void_game(game_controller, game, msg)
             late_error_messages = game_controller.describe_late_errors()
@@ -266,7 +564,8 @@ class Game_job(object):
             raise job_manager.JobFailed(msg)
         if game.result.is_forfeit:
             warnings.append(game.result.detail)
-        game_controller.close_players()
+        game_controller.close_players(
+            return_to_pools=not game.result.is_forfeit)
         ru_cpu_times = game_controller.get_resource_usage_cpu_times()
         for colour in game.cpu_time_errors:
             del ru_cpu_times[colour]
@@ -274,6 +573,14 @@ class Game_job(object):
         late_error_messages = game_controller.describe_late_errors()
         if late_error_messages:
             log_entries.append(late_error_messages)
+        if self._capability_cache_keys:
+            for colour, key in self._capability_cache_keys.items():
+                _capability_cache.update(
+                    key, game_controller.get_engine_capabilities(colour))
+            try:
+                _capability_cache.save(self.engine_cache_pathname)
+            except EnvironmentError, e:
+                log_entries.append("error writing engine cache:\n%s" % e)
         self._record_game(game_controller, game)
         response = Game_job_result()
         response.game_id = self.game_id
@@ -409,8 +716,9 @@ def check_player(player_check, discard_stderr=False):
 
     player_check -- Player_check object
 
-    This starts an engine subprocess, sends it some GTP commands, and ends the
-    process again.
+    This starts an engine subprocess (or connects to the engine server, if the
+    player has gtp_address set), sends it some GTP commands, and ends the
+    process (or closes the connection) again.
 
     Raises CheckFailed if the player doesn't pass the checks.
 
@@ -418,7 +726,8 @@ def check_player(player_check, discard_stderr=False):
 
     Currently checks:
      - any explicitly specified cwd exists and is a directory
-     - the engine subprocess starts, and replies to GTP commands
+     - the engine subprocess starts (or the engine server accepts a
+       connection), and replies to GTP commands
      - the engine reports protocol version 2 (if it supports protocol_version)
      - the engine accepts any startup_gtp_commands
      - the engine accepts the specified board size and komi
@@ -427,7 +736,8 @@ def check_player(player_check, discard_stderr=False):
 
     """
     player = player_check.player
-    if player.cwd is not None and not os.path.isdir(player.cwd):
+    if (player.gtp_address is None and player.cwd is not None and
+        not os.path.isdir(player.cwd)):
         raise CheckFailed("bad working directory: %s" % player.cwd)
 
     if discard_stderr:
@@ -435,23 +745,31 @@ def check_player(player_check, discard_stderr=False):
     else:
         stderr = None
     try:
-        env = player.make_environ()
-        env['GOMILL_GAME_ID'] = 'startup-check'
-        try:
-            channel = gtp_controller.Subprocess_gtp_channel(
-                player.cmd_args,
-                env=env, cwd=player.cwd, stderr=stderr)
-        except GtpChannelError, e:
-            raise GtpChannelError(
-                "error starting subprocess for %s:\n%s" % (player.code, e))
+        if player.gtp_address is not None:
+            try:
+                channel = gtp_controller.Socket_gtp_channel(player.gtp_address)
+            except GtpChannelError, e:
+                raise GtpChannelError(
+                    "error connecting to %s:\n%s" % (player.code, e))
+        else:
+            env = player.make_environ()
+            env['GOMILL_GAME_ID'] = 'startup-check'
+            try:
+                channel = gtp_controller.Subprocess_gtp_channel(
+                    player.cmd_args,
+                    env=env, cwd=player.cwd, stderr=stderr)
+            except GtpChannelError, e:
+                raise GtpChannelError(
+                    "error starting subprocess for %s:\n%s" % (player.code, e))
         controller = gtp_controller.Gtp_controller(channel, player.code)
         controller.set_gtp_aliases(player.gtp_aliases)
         controller.check_protocol_version()
-        for command, arguments in player.startup_gtp_commands:
-            controller.do_command(command, *arguments)
-        controller.do_command("boardsize", str(player_check.board_size))
-        controller.do_command("clear_board")
-        controller.do_command("komi", str(player_check.komi))
+        controller.do_commands(
+            [(command,) + tuple(arguments)
+             for command, arguments in player.startup_gtp_commands] +
+            [("boardsize", str(player_check.board_size)),
+             ("clear_board",),
+             ("komi", str(player_check.komi))])
         controller.safe_close()
     except (GtpChannelError, BadGtpResponse), e:
         raise CheckFailed(str(e))
@@ -16,6 +16,17 @@ from gomill import sgf
 class GameStateError(StandardError):
     """Error from Game: wrong state for requested action."""
 
+ko_rules = ('simple', 'positional', 'situational')
+
+def check_ko_rule(ko_rule):
+    """Check that a ko rule name is recognised.
+
+    Raises ValueError if it isn't one of the values in ko_rules.
+
+    """
+    if ko_rule not in ko_rules:
+        raise ValueError("unknown ko rule: %s" % ko_rule)
+
 class Game(object):
     """Track the state of a single Go game.
 
@@ -23,7 +34,8 @@ class Game(object):
        board        -- the Board to play on (doesn't have to be empty)
        first_player -- colour (default 'b')
 
-    This enforces a simple ko rule, but no superko rule.
+    By default this enforces a simple ko rule, but no superko rule (see
+    set_ko_rule()).
     It accepts self-capture moves.
     Two consecutive passes end the game.
 
@@ -33,6 +45,7 @@ class Game(object):
       is_over          -- bool
       move_limit       -- int or None
       move_count       -- int
+      ko_rule          -- 'simple', 'positional', or 'situational'
 
     Meaningful before the game is over:
       next_player      -- colour
@@ -43,13 +56,17 @@ class Game(object):
       seen_resignation -- bool
       seen_claim       -- bool
       seen_forfeit     -- bool
+      seen_adjudication -- bool
       hit_move_limit   -- bool
       winner           -- colour or None
       forfeit_reason   -- string or None
+      adjudication_reason -- string or None
 
     When is_over is true, exactly one of the other boolean attributes is true.
     winner is set for seen_resignation, seen_claim, and seen_forfeit, but not
-    for passed_out or hit_move_limit.
+    for passed_out or hit_move_limit. For seen_adjudication, winner is set if
+    the adjudication decided the winner; if it's None the final position
+    should be scored as if the game had been passed out.
 
     move_count is the number of moves already played. Passes are included;
     illegal moves are not.
@@ -59,6 +76,7 @@ class Game(object):
         self.board = board
 
         self.move_limit = None
+        self.ko_rule = 'simple'
         self.next_player = first_player
 
         self.move_count = 0
@@ -70,12 +88,25 @@ class Game(object):
         self.seen_resignation = False
         self.seen_claim = False
         self.seen_forfeit = False
+        self.seen_adjudication = False
         self.hit_move_limit = False
         self.winner = None
         self.forfeit_reason = None
+        self.adjudication_reason = None
 
         self.game_over_callback = None
 
+        # Zobrist hashes of the positions seen so far; for situational superko
+        # we also need to know who was to play.
+        self._seen_positions = set()
+        self._seen_situations = set()
+        self._record_position()
+
+    def _record_position(self):
+        position = self.board.zobrist_hash()
+        self._seen_positions.add(position)
+        self._seen_situations.add((position, self.next_player))
+
     def set_move_limit(self, move_limit):
         """Set or clear the move limit.
 
@@ -86,6 +117,38 @@ class Game(object):
         """
         self.move_limit = move_limit
 
+    def set_ko_rule(self, ko_rule):
+        """Set the ko rule to enforce.
+
+        ko_rule -- 'simple', 'positional', or 'situational'
+
+        If this isn't called, the ko rule is 'simple'.
+
+        'simple' forbids only a move which would recreate the position before
+        the opponent's last move.
+
+        'positional' (positional superko) forbids a move which would recreate
+        any position seen earlier in the game (including the initial
+        position).
+
+        'situational' (situational superko) forbids a move which would recreate
+        an earlier position with the same player to move next.
+
+        The superko rules are applied in addition to the simple ko rule. They
+        are checked using Zobrist hashes (see boards.Board.zobrist_hash()), so
+        the cost per move doesn't depend on the length of the game.
+
+        """
+        check_ko_rule(ko_rule)
+        self.ko_rule = ko_rule
+
+    def _repeats_position(self, position, next_player):
+        if self.ko_rule == 'positional':
+            return position in self._seen_positions
+        elif self.ko_rule == 'situational':
+            return (position, next_player) in self._seen_situations
+        return False
+
     def set_game_over_callback(self, fn):
         """Specify a function to be called when the game is over.
 
@@ -142,6 +205,22 @@ class Game(object):
         self.forfeit_reason = reason
         self._set_over()
 
+    def record_adjudication(self, reason, winner=None):
+        """Record that the game has been ended by adjudication.
+
+        reason -- string: human-readable explanation of the adjudication
+        winner -- colour or None
+
+        If winner is None, the final position is to be scored.
+
+        """
+        if self.is_over:
+            raise GameStateError("game is already over")
+        self.winner = winner
+        self.seen_adjudication = True
+        self.adjudication_reason = reason
+        self._set_over()
+
     def record_move(self, colour, move):
         """Record that a move or pass has been played.
 
@@ -156,7 +235,8 @@ class Game(object):
         ended.
 
         This method causes the game to end if the move is a second consecutive
-        pass, if the move is illegal, or the move limit is reached.
+        pass, if the move is illegal (including being forbidden by the ko
+        rule), or the move limit is reached.
 
         The move limit is considered reached if move_limit is set, move_count
         >= move_limit after the move is played, and the game has not been
@@ -176,6 +256,14 @@ class Game(object):
                 return
             row, col = move
             try:
+                if self.ko_rule != 'simple':
+                    new_position = self.board.hash_after_move(row, col, colour)
+                    if self._repeats_position(new_position,
+                                              opponent_of(colour)):
+                        self.record_forfeit_by(
+                            colour, "attempted move to %s, forbidden by "
+                            "%s superko" % (format_vertex(move), self.ko_rule))
+                        return
                 self.simple_ko_point = self.board.play(row, col, colour)
             except ValueError:
                 self.record_forfeit_by(
@@ -188,6 +276,7 @@ class Game(object):
 
         self.move_count += 1
         self.next_player = opponent_of(colour)
+        self._record_position()
         if self.pass_count == 2:
             self.passed_out = True
             self._set_over()
@@ -277,21 +366,26 @@ class Game_score(object):
             return None
 
     @classmethod
-    def from_position(cls, board, komi, handicap_compensation='no', handicap=0):
+    def from_position(cls, board, komi, handicap_compensation='no', handicap=0,
+                      remove_dead=False):
         """Instantiate based on a board's area score.
 
         board                 -- boards.Board
         komi                  -- int or float
         handicap_compensation -- 'no' (default), 'short', or 'full'.
         handicap              -- int (default 0)
+        remove_dead           -- bool (default False)
 
-        Assumes all stones are alive.
+        Assumes all stones are alive, except that if remove_dead is true,
+        stones in the opponent's pass-alive territory are treated as dead (see
+        boards.Board.area_score()).
 
         See adjust_score() for details of handicap compensation.
 
         """
         winner, margin = adjust_score(
-            board.area_score(), komi, handicap_compensation, handicap)
+            board.area_score(remove_dead), komi, handicap_compensation,
+            handicap)
         return cls(winner, margin)
 
 
@@ -305,16 +399,21 @@ class Result(object):
       losing_colour  -- 'b', 'w', or None
       is_jigo        -- bool
       is_forfeit     -- bool
+      is_adjudicated -- bool
       is_unknown     -- bool
       sgf_result     -- string describing the game's result (for sgf RE)
       detail         -- additional information (string or None)
 
     Winning/losing colour are None for a jigo, unknown result, or void game.
 
+    is_adjudicated is true if the game was stopped early by adjudication (see
+    Game_runner.set_adjudication()); detail then begins with 'adjudicated'.
+
     """
     def __init__(self):
         self.is_jigo = False
         self.is_forfeit = False
+        self.is_adjudicated = False
         self.detail = None
 
     def _set_winning_colour(self, colour):
@@ -328,6 +427,13 @@ class Result(object):
         self.sgf_result = "0"
         self.is_jigo = True
 
+    def _set_adjudicated(self, reason):
+        self.is_adjudicated = True
+        if self.detail is None:
+            self.detail = "adjudicated: %s" % reason
+        else:
+            self.detail = "adjudicated: %s; %s" % (reason, self.detail)
+
     @property
     def losing_colour(self):
         if self.winning_colour is None:
@@ -392,6 +498,8 @@ class Result(object):
             raise ValueError("game is not over")
         if game.passed_out:
             raise ValueError("game is passed out")
+        if game.seen_adjudication and game.winner is None:
+            raise ValueError("adjudicated game needs scoring")
         result = cls()
         result._set_winning_colour(game.winner)
         if game.hit_move_limit:
@@ -406,6 +514,9 @@ class Result(object):
             result.sgf_result += "F"
             result.is_forfeit = True
             result.detail = game.forfeit_reason
+        elif game.seen_adjudication:
+            # Leave SGF result in form 'B+'
+            result._set_adjudicated(game.adjudication_reason)
         else:
             raise AssertionError
         return result
@@ -530,7 +641,8 @@ class Backend(object):
 
         Returns a Game_score
 
-        This is called after end_game().
+        This is called after end_game(). It's also used for games which were
+        stopped by adjudication without deciding the winner.
 
         """
         raise NotImplementedError
@@ -566,6 +678,8 @@ class Game_runner(object):
       runner = Game_runner(...)
       runner.set_move_callback(...) [optional]
       runner.set_result_class(...) [optional]
+      runner.set_ko_rule(...) [optional]
+      runner.set_adjudication(...) [optional]
       runner.prepare()
       runner.set_handicap(...) [optional]
       runner.run()
@@ -574,9 +688,9 @@ class Game_runner(object):
     Public attributes, useful after run() has been called:
       result -- Result, or None
 
-    Game_runner enforces a simple ko rule, but no superko rule. It accepts
-    self-capture moves. Two consecutive passes end the game and trigger
-    scoring.
+    By default Game_runner enforces a simple ko rule, but no superko rule (see
+    set_ko_rule()). It accepts self-capture moves. Two consecutive passes end
+    the game and trigger scoring.
 
     If move_limit is not None, the game ends (with result 'Void') when that
     number of moves (including passes) has been played.
@@ -584,6 +698,8 @@ class Game_runner(object):
     If a player rejects its opponent's move as illegal, we assume it is correct
     and the opponent forfeits the game.
 
+    Games can also be stopped early by adjudication; see set_adjudication().
+
     """
 
     def __init__(self, backend, board_size, komi=0, move_limit=None):
@@ -591,6 +707,10 @@ class Game_runner(object):
         self.board_size = board_size
         self.komi = float(komi)
         self.move_limit = move_limit
+        self.ko_rule = 'simple'
+        self.pass_alive_margin = None
+        self.adjudication_handicap_compensation = 'no'
+        self.stable_score_moves = None
         self.after_move_callback = None
         self.result_class = Result
         self.additional_sgf_props = []
@@ -599,6 +719,8 @@ class Game_runner(object):
         self.final_diagnostics = None
         self.game_score = None
         self.result = None
+        self._stable_score = None
+        self._stable_score_count = 0
         self._state = 0
 
     def set_move_callback(self, fn):
@@ -624,6 +746,59 @@ class Game_runner(object):
         """
         self.after_move_callback = fn
 
+    def set_ko_rule(self, ko_rule):
+        """Specify the ko rule to enforce.
+
+        ko_rule -- 'simple', 'positional', or 'situational'
+
+        See Game.set_ko_rule() for details. If this isn't called, the ko rule
+        is 'simple'.
+
+        Raises ValueError if the ko rule isn't recognised.
+
+        """
+        check_ko_rule(ko_rule)
+        self.ko_rule = ko_rule
+
+    def set_adjudication(self, pass_alive_margin=None,
+                         stable_score_moves=None,
+                         handicap_compensation='no'):
+        """Specify when to stop a game early.
+
+        pass_alive_margin     -- int or float or None (default None)
+        stable_score_moves    -- int or None (default None)
+        handicap_compensation -- 'no' (default), 'short', or 'full'.
+
+        If pass_alive_margin is not None, after each move the runner counts
+        each player's pass-alive stones and territory (see
+        boards.Board.find_pass_alive()). If one player's count would still
+        win by more than pass_alive_margin even if the opponent got every
+        point which isn't pass-alive (applying komi, and handicap_compensation
+        as for adjust_score()), the game is stopped and that player is the
+        winner. The result has no margin (it looks like 'B+').
+
+        If stable_score_moves is not None, the game is stopped when that many
+        consecutive moves (including passes) have left the area score
+        (removing dead stones as boards.Board.area_score() does) unchanged.
+        The final position is then scored in the same way as a passed-out
+        game.
+
+        Either way, the result's is_adjudicated attribute is set.
+
+        If this isn't called, games aren't adjudicated.
+
+        """
+        if pass_alive_margin is not None and pass_alive_margin < 0:
+            raise ValueError("pass_alive_margin must not be negative")
+        if stable_score_moves is not None and stable_score_moves < 1:
+            raise ValueError("stable_score_moves must be positive")
+        if handicap_compensation not in ("full", "short", "no"):
+            raise ValueError("unknown handicap_compensation value: %s" %
+                             handicap_compensation)
+        self.pass_alive_margin = pass_alive_margin
+        self.adjudication_handicap_compensation = handicap_compensation
+        self.stable_score_moves = stable_score_moves
+
     def set_result_class(self, cls):
         """Specify a Result subclass to use.
 
@@ -690,6 +865,7 @@ class Game_runner(object):
             first_player = 'b'
         game = Game(board, first_player)
         game.set_move_limit(self.move_limit)
+        game.set_ko_rule(self.ko_rule)
         game.set_game_over_callback(self.backend.end_game)
         return game
 
@@ -742,10 +918,48 @@ class Game_runner(object):
         if self.after_move_callback:
             self.after_move_callback(colour=colour, move=move, board=game.board)
 
+        if not game.is_over:
+            self._check_adjudication(game)
+
+    def _check_adjudication(self, game):
+        board = game.board
+        if self.pass_alive_margin is not None:
+            counts = {}
+            for colour in "b", "w":
+                stones, territory = board.find_pass_alive(colour)
+                counts[colour] = len(stones) + len(territory)
+            unsettled = board.side * board.side - counts['b'] - counts['w']
+            handicap = len(self.handicap_stones or [])
+            # Each player's worst case is that the opponent gets every point
+            # which isn't pass-alive.
+            for winner, raw_score in [
+                    ('b', counts['b'] - counts['w'] - unsettled),
+                    ('w', counts['b'] - counts['w'] + unsettled)]:
+                leader, lead = adjust_score(
+                    raw_score, self.komi,
+                    self.adjudication_handicap_compensation, handicap)
+                if leader == winner and lead > self.pass_alive_margin:
+                    game.record_adjudication(
+                        "lead of %s in pass-alive area" % format_float(lead),
+                        winner)
+                    return
+        if self.stable_score_moves is not None:
+            score = board.area_score(remove_dead=True)
+            if score == self._stable_score:
+                self._stable_score_count += 1
+            else:
+                self._stable_score = score
+                self._stable_score_count = 0
+            if self._stable_score_count >= self.stable_score_moves:
+                game.record_adjudication(
+                    "score unchanged for %d moves" % self.stable_score_moves)
+
     def _set_result(self, game):
-        if game.passed_out:
+        if game.passed_out or (game.seen_adjudication and game.winner is None):
             self.game_score = self.backend.score_game(game.board)
             self.result = self.result_class.from_game_score(self.game_score)
+            if game.seen_adjudication:
+                self.result._set_adjudicated(game.adjudication_reason)
         else:
             self.result = self.result_class.from_unscored_game(game)
 
@@ -806,7 +1020,8 @@ class Game_runner(object):
 
         Returns the score returned by the call to backend.score_game().
 
-        Returns None if the game was not passed out.
+        Returns None if the game was not scored (that is, if it wasn't passed
+        out or adjudicated without a winner).
 
         """
         return self.game_score
@@ -4,11 +4,19 @@ Based on GTP 'draft version 2' (see <http://www.lysator.liu.se/~gunnar/gtp/>).
 
 """
 
+from __future__ import with_statement
+
+import cPickle as pickle
 import errno
 import os
 import re
+import select
 import signal
+import socket
 import subprocess
+import threading
+import time
+import weakref
 
 from gomill.utils import *
 from gomill.common import *
@@ -17,8 +25,8 @@ from gomill.common import *
 class GtpChannelError(StandardError):
     """Low-level error trying to talk to a GTP engine.
 
-    This is the base class for GtpProtocolError, GtpTransportError,
-    and GtpChannelClosed. It may also be raised directly.
+    This is the base class for GtpProtocolError, GtpTransportError (and its
+    subclass GtpTimeout), and GtpChannelClosed. It may also be raised directly.
 
     """
 
@@ -28,6 +36,9 @@ class GtpProtocolError(GtpChannelError):
 class GtpTransportError(GtpChannelError):
     """An error from the transport underlying the GTP channel."""
 
+class GtpTimeout(GtpTransportError):
+    """A GTP engine didn't respond within the permitted time."""
+
 class GtpChannelClosed(GtpChannelError):
     """The (command or response) channel to a GTP engine has been closed."""
 
@@ -56,6 +67,7 @@ class BadGtpResponse(StandardError):
 
 _gtp_word_characters_re = re.compile(r"\A[\x21-\x7e\x80-\xff]+\Z")
 _remove_response_controls_re = re.compile(r"[\x00-\x08\x0b-\x1f\x7f]")
+_blank_lines_re = re.compile(r"(?:[ \t]*\n)*")
 
 def is_well_formed_gtp_word(s):
     """Check whether 's' is well-formed as a single GTP word.
@@ -69,6 +81,14 @@ def is_well_formed_gtp_word(s):
         return False
     return True
 
+def _check_command_words(command, arguments):
+    """Raise ValueError if a command or argument isn't a well-formed word."""
+    if not is_well_formed_gtp_word(command):
+        raise ValueError("bad command")
+    for argument in arguments:
+        if not is_well_formed_gtp_word(argument):
+            raise ValueError("bad argument")
+
 class Gtp_channel(object):
     """A communication channel to a GTP engine.
 
@@ -92,6 +112,9 @@ class Gtp_channel(object):
         self.resource_usage = None
         self.log_dest = None
         self.log_prefix = None
+        self.transcript = None
+        self._unrecorded_commands = []
+        self._last_response_time = None
 
     def enable_logging(self, log_dest, prefix=""):
         """Log all messages sent and received over the channel.
@@ -103,6 +126,35 @@ class Gtp_channel(object):
         self.log_dest = log_dest
         self.log_prefix = prefix
 
+    def disable_logging(self):
+        """Stop logging messages sent and received over the channel."""
+        self.log_dest = None
+        self.log_prefix = None
+
+    def enable_recording(self, transcript):
+        """Record all commands and responses sent over the channel.
+
+        transcript -- gtp_transcripts.Gtp_transcript (or any object with a
+                      compatible add_exchange() method)
+
+        Each completed command is recorded as its response is read, with the
+        time that passed between sending the command and reading the response.
+        If several commands were sent before their responses were read (as
+        Gtp_controller.do_commands() does), each one is timed from when the
+        previous response was read, so the recorded times don't include
+        waiting for the engine to deal with the earlier commands.
+
+        """
+        self.transcript = transcript
+        self._unrecorded_commands = []
+        self._last_response_time = None
+
+    def disable_recording(self):
+        """Stop recording commands and responses."""
+        self.transcript = None
+        self._unrecorded_commands = []
+        self._last_response_time = None
+
     def _log(self, marker, message):
         """Log a message.
 
@@ -130,19 +182,20 @@ class Gtp_channel(object):
         forbidden in GTP.
 
         """
-        if not is_well_formed_gtp_word(command):
-            raise ValueError("bad command")
-        for argument in arguments:
-            if not is_well_formed_gtp_word(argument):
-                raise ValueError("bad argument")
+        _check_command_words(command, arguments)
         if self.log_dest is not None:
             self._log(">> ", command + ("".join(" " + a for a in arguments)))
         self.send_command_impl(command, arguments)
+        if self.transcript is not None:
+            self._unrecorded_commands.append(
+                (command, list(arguments), time.time()))
 
     def get_response(self):
         """Read a GTP response from the channel.
 
-        Waits indefinitely for the response.
+        Waits indefinitely for the response, unless the channel implementation
+        supports time limits and one has been set (in which case it raises
+        GtpTimeout if the limit is reached).
 
         Returns a pair (is_failure, response)
 
@@ -165,7 +218,26 @@ class Gtp_channel(object):
         success/failure indicator can't be read from the engine's response.
 
         """
-        result = self.get_response_impl()
+        if self.transcript is None:
+            result = self.get_response_impl()
+        else:
+            try:
+                command, arguments, sent_time = \
+                    self._unrecorded_commands.pop(0)
+            except IndexError:
+                command = None
+            result = self.get_response_impl()
+            if command is not None:
+                now = time.time()
+                if self._last_response_time is None:
+                    start_time = sent_time
+                else:
+                    start_time = max(sent_time, self._last_response_time)
+                self._last_response_time = now
+                is_failure, response = result
+                self.transcript.add_exchange(
+                    command, arguments, is_failure, response,
+                    now - start_time)
         if self.log_dest is not None:
             is_error, response = result
             if is_error:
@@ -239,14 +311,32 @@ class Linebased_gtp_channel(Gtp_channel):
     def __init__(self):
         Gtp_channel.__init__(self)
         self.is_first_response = True
+        # Data received but not yet returned, with control characters removed
+        self._response_buffer = ""
+        self._response_data_is_at_eof = False
 
     # Not using command ids; I don't see the need unless we see problems in
-    # practice with engines getting out of sync.
+    # practice with engines getting out of sync. (Gtp_controller.do_commands()
+    # sends several commands before reading the responses, but GTP requires
+    # the engine to respond in order, so ids wouldn't add anything.)
 
     def send_command_impl(self, command, arguments):
         words = [command] + arguments
         self.send_command_line(" ".join(words) + "\n")
 
+    def _read_response_data(self):
+        """Read more data from the channel into the response buffer.
+
+        Discards control characters as it goes, as the GTP spec requires (this
+        doesn't depend on context, so it's safe to do it a chunk at a time).
+
+        """
+        s = self.get_response_data()
+        if s == "":
+            self._response_data_is_at_eof = True
+        else:
+            self._response_buffer += _remove_response_controls_re.sub("", s)
+
     def get_response_impl(self):
         """Obtain response according to GTP protocol.
 
@@ -260,10 +350,11 @@ class Linebased_gtp_channel(Gtp_channel):
         just discard it, but I think it's more useful to reject them here; in
         particular, this lets us detect GMP).
 
+        Data from the channel is accumulated in a buffer, and responses are
+        found by looking for the terminating empty line in the buffer, rather
+        than by processing a line at a time.
+
         """
-        lines = []
-        seen_data = False
-        peeked_byte = None
         if self.is_first_response:
             self.is_first_response = False
             # We read one byte first so that we don't hang if the engine never
@@ -287,48 +378,41 @@ class Linebased_gtp_channel(Gtp_channel):
                     raise GtpProtocolError(
                         "engine isn't speaking GTP: "
                         "first byte is %s" % repr(peeked_byte))
-                if peeked_byte == "\n":
-                    peeked_byte = None
+                self._response_buffer += peeked_byte.replace("\r", "")
+        search_from = 0
         while True:
-            s = self.get_response_line()
-            if peeked_byte:
-                s = peeked_byte + s
-                peeked_byte = None
-            # << All other [than HT, CR, LF] control characters must be
-            # discarded on input >>
-            # << Any occurence of a CR character must be discarded on input >>
-            s = _remove_response_controls_re.sub("", s)
+            buf = self._response_buffer
             # << Empty lines and lines with only whitespace sent by the engine
             #    and occuring outside a response must be ignored by the
             #    controller >>
-            if not seen_data:
-                if s.strip() == "":
-                    if s.endswith("\n"):
-                        continue
-                    else:
-                        break
-                else:
-                    seen_data = True
-            if s == "\n":
+            start = _blank_lines_re.match(buf).end()
+            if buf[start:].lstrip(" \t"):
+                end = buf.find("\n\n", max(start, search_from))
+                if end != -1:
+                    text = buf[start:end+1]
+                    self._response_buffer = buf[end+2:]
+                    break
+                search_from = len(buf) - 1
+            if self._response_data_is_at_eof:
+                text = buf[start:]
+                if not text.lstrip(" \t"):
+                    text = ""
+                self._response_buffer = ""
                 break
-            lines.append(s)
-            if not s.endswith("\n"):
-                break
-        if not lines:
+            self._read_response_data()
+        if not text:
             # Means 'EOF and empty response'
             raise GtpChannelClosed("engine has closed the response channel")
-        first_line = lines[0]
-        # It's certain that first line isn't empty
-        if first_line[0] == "?":
+        # It's certain that the first line isn't empty
+        if text[0] == "?":
             is_error = True
-        elif first_line[0] == "=":
+        elif text[0] == "=":
             is_error = False
         else:
             raise GtpProtocolError(
                 "no success/failure indication from engine: "
-                "first line is `%s`" % first_line.rstrip())
-        lines[0] = first_line[1:].lstrip(" \t")
-        response = "".join(lines).rstrip()
+                "first line is `%s`" % text.split("\n", 1)[0].rstrip())
+        response = text[1:].lstrip(" \t").rstrip()
         response = response.replace("\t", " ")
         return is_error, response
 
@@ -345,6 +429,20 @@ class Linebased_gtp_channel(Gtp_channel):
         """
         raise NotImplementedError
 
+    def get_response_data(self):
+        """Read some text from the channel.
+
+        May raise GtpTransportError
+
+        This blocks until some data is available, or end-of-file is reached (in
+        which case it returns an empty string).
+
+        The default implementation reads a line using get_response_line();
+        subclasses can override this to read larger chunks.
+
+        """
+        return self.get_response_line()
+
     def get_response_line(self):
         """Read a line of text from the channel.
 
@@ -355,6 +453,9 @@ class Linebased_gtp_channel(Gtp_channel):
 
         This blocks until a line is available, or end-of-file is reached.
 
+        Subclasses don't have to implement this if they override
+        get_response_data().
+
         """
         raise NotImplementedError
 
@@ -372,17 +473,145 @@ class Linebased_gtp_channel(Gtp_channel):
         raise NotImplementedError
 
 
+class Descriptor_gtp_channel(Linebased_gtp_channel):
+    """Generic Gtp_channel which reads responses from a file descriptor.
+
+    This provides time limits for responses, using select() on the descriptor.
+
+    Subclasses must set the 'response_fd' attribute, and implement
+    read_response_chunk() and send_command_line().
+
+    """
+    def __init__(self, response_timeout=None, deadline=None):
+        Linebased_gtp_channel.__init__(self)
+        self.response_timeout = response_timeout
+        self.deadline = deadline
+        # We read the response descriptor directly (not through a Python file
+        # object), so that select() tells the truth about whether more data is
+        # available.
+        self._peeked_data = ""
+        self._read_limit = None
+
+    def set_response_timeout(self, timeout):
+        """Limit the time to wait for each response.
+
+        timeout -- float (seconds), or None for no limit
+
+        If an engine takes longer than this to send a complete response,
+        get_response() raises GtpTimeout.
+
+        """
+        self.response_timeout = timeout
+
+    def set_deadline(self, deadline):
+        """Specify a time after which no more responses will be accepted.
+
+        deadline -- float (as returned by time.time()), or None for no limit
+
+        If get_response() is still waiting for a response at this time, it
+        raises GtpTimeout.
+
+        """
+        self.deadline = deadline
+
+    def get_response_impl(self):
+        now = time.time()
+        limits = []
+        if self.response_timeout is not None:
+            limits.append((now + self.response_timeout,
+                           "no response within %s seconds" %
+                           format_float(self.response_timeout)))
+        if self.deadline is not None:
+            limits.append((self.deadline, "deadline passed"))
+        if limits:
+            self._read_limit = min(limits)
+        try:
+            return Linebased_gtp_channel.get_response_impl(self)
+        finally:
+            self._read_limit = None
+
+    def _wait_for_response_data(self):
+        """Wait until the response descriptor is readable.
+
+        Raises GtpTimeout if _read_limit passes first.
+
+        """
+        limit, message = self._read_limit
+        while True:
+            remaining = limit - time.time()
+            if remaining <= 0:
+                raise GtpTimeout(message)
+            try:
+                ready, _, _ = select.select(
+                    [self.response_fd], [], [], remaining)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise GtpTransportError(str(e.args[1]))
+            if ready:
+                return
+
+    def get_response_data(self):
+        if self._peeked_data:
+            s, self._peeked_data = self._peeked_data, ""
+            return s
+        if self._read_limit is not None:
+            self._wait_for_response_data()
+        while True:
+            try:
+                return self.read_response_chunk()
+            except EnvironmentError, e:
+                if e.errno != errno.EINTR:
+                    raise GtpTransportError(str(e))
+
+    def get_response_byte(self):
+        s = self.get_response_data()
+        self._peeked_data = s[1:]
+        return s[:1]
+
+    def is_connection_usable(self):
+        """Check whether the channel can be used for a new command.
+
+        Returns False if the engine has closed its response channel (or has
+        sent data nobody asked for). Doesn't block.
+
+        """
+        if self._peeked_data or self._response_buffer:
+            return False
+        try:
+            ready, _, _ = select.select([self.response_fd], [], [], 0)
+        except select.error:
+            return False
+        return not ready
+
+    # For subclasses to override:
+
+    def read_response_chunk(self):
+        """Read whatever data is available from the response descriptor.
+
+        This blocks until some data is available, or end-of-file is reached (in
+        which case it returns an empty string).
+
+        May propagate EnvironmentError.
+
+        """
+        raise NotImplementedError
+
+
 def permit_sigpipe():
     signal.signal(signal.SIGPIPE, signal.SIG_DFL)
 
-class Subprocess_gtp_channel(Linebased_gtp_channel):
+class Subprocess_gtp_channel(Descriptor_gtp_channel):
     """A GTP channel to a subprocess.
 
     Instantiate with
-      command -- list of strings (as for subprocess.Popen)
-      stderr  -- destination for standard error output (optional)
-      cwd     -- working directory to change to (optional)
-      env     -- new environment (optional)
+      command          -- list of strings (as for subprocess.Popen)
+      stderr           -- destination for standard error output (optional)
+      cwd              -- working directory to change to (optional)
+      env              -- new environment (optional)
+      response_timeout -- see set_response_timeout() (optional)
+      deadline         -- see set_deadline() (optional)
+      exit_timeout     -- see set_exit_timeout() (optional)
     Instantiation will raise GtpChannelError if the process can't be started.
 
     This starts the subprocess and speaks GTP over its standard input and
@@ -396,9 +625,14 @@ class Subprocess_gtp_channel(Linebased_gtp_channel):
 
     Closing the channel waits for the subprocess to exit.
 
+    By default, reading a response waits indefinitely, and so does close(); use
+    the 'response_timeout', 'deadline' and 'exit_timeout' parameters (or the
+    corresponding methods) to impose limits.
+
     """
-    def __init__(self, command, stderr=None, cwd=None, env=None):
-        Linebased_gtp_channel.__init__(self)
+    def __init__(self, command, stderr=None, cwd=None, env=None,
+                 response_timeout=None, deadline=None, exit_timeout=None):
+        Descriptor_gtp_channel.__init__(self, response_timeout, deadline)
         try:
             p = subprocess.Popen(
                 command,
@@ -410,6 +644,20 @@ class Subprocess_gtp_channel(Linebased_gtp_channel):
         self.subprocess = p
         self.command_pipe = p.stdin
         self.response_pipe = p.stdout
+        self.response_fd = p.stdout.fileno()
+        self.exit_timeout = exit_timeout
+
+    def set_exit_timeout(self, timeout):
+        """Limit the time close() waits for the engine to exit.
+
+        timeout -- float (seconds), or None for no limit
+
+        If the engine hasn't exited this long after its pipes are closed,
+        close() sends it SIGTERM; if it still hasn't exited after the same time
+        again, close() sends it SIGKILL.
+
+        """
+        self.exit_timeout = timeout
 
     def send_command_line(self, command):
         try:
@@ -421,23 +669,48 @@ class Subprocess_gtp_channel(Linebased_gtp_channel):
             else:
                 raise GtpTransportError(str(e))
 
-    def get_response_line(self):
-        try:
-            return self.response_pipe.readline()
-        except EnvironmentError, e:
-            raise GtpTransportError(str(e))
+    def read_response_chunk(self):
+        return os.read(self.response_fd, 65536)
 
-    def get_response_byte(self):
-        try:
-            return self.response_pipe.read(1)
-        except EnvironmentError, e:
-            raise GtpTransportError(str(e))
+    def _poll_for_exit(self, timeout):
+        """Wait up to 'timeout' seconds for the subprocess to exit.
+
+        Returns the result from os.wait4(), or None if it's still running.
+
+        """
+        limit = time.time() + timeout
+        delay = 0.001
+        while True:
+            pid, exit_status, rusage = os.wait4(self.subprocess.pid, os.WNOHANG)
+            if pid != 0:
+                return pid, exit_status, rusage
+            remaining = limit - time.time()
+            if remaining <= 0:
+                return None
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.05)
+
+    def _wait_for_exit(self):
+        """Wait for the subprocess to exit, terminating it if necessary.
+
+        Returns the result from os.wait4().
+
+        """
+        if self.exit_timeout is not None:
+            for sig in (signal.SIGTERM, signal.SIGKILL):
+                result = self._poll_for_exit(self.exit_timeout)
+                if result is not None:
+                    return result
+                try:
+                    os.kill(self.subprocess.pid, sig)
+                except EnvironmentError, e:
+                    # Most likely it exited at the last moment
+                    if e.errno != errno.ESRCH:
+                        raise
+        return os.wait4(self.subprocess.pid, 0)
 
     def close(self):
         # Errors from closing pipes or wait4() are unlikely, but possible.
-
-        # Ideally would give up waiting after a while and forcibly terminate the
-        # subprocess.
         errors = []
         try:
             self.command_pipe.close()
@@ -453,7 +726,7 @@ class Subprocess_gtp_channel(Linebased_gtp_channel):
             # sure it isn't still running.
             # Even if there were errors closing the pipes, it's most likely that
             # the subprocesses has exited.
-            pid, exit_status, rusage = os.wait4(self.subprocess.pid, 0)
+            pid, exit_status, rusage = self._wait_for_exit()
             self.exit_status = exit_status
             self.resource_usage = rusage
         except EnvironmentError, e:
@@ -462,6 +735,208 @@ class Subprocess_gtp_channel(Linebased_gtp_channel):
             raise GtpTransportError("\n".join(errors))
 
 
+def describe_gtp_address(address):
+    """Return a description of a Socket_gtp_channel address, for messages."""
+    if isinstance(address, basestring):
+        return address
+    host, port = address
+    return "%s:%s" % (host, port)
+
+class Socket_gtp_channel(Descriptor_gtp_channel):
+    """A GTP channel to an engine server, over a socket.
+
+    Instantiate with
+      address          -- string (Unix-domain socket pathname),
+                          or pair (host, port) for TCP
+      connect_attempts -- int (default 1)
+      retry_interval   -- float (seconds, default 1.0)
+      response_timeout -- see set_response_timeout() (optional)
+      deadline         -- see set_deadline() (optional)
+    Instantiation will raise GtpChannelError if the connection can't be made.
+
+    This connects to an engine server which is already running (see
+    gtp_engine.serve_gtp_sessions() and
+    gtp_engine.serve_concurrent_gtp_sessions() for simple ones), and speaks
+    GTP over the connection.
+
+    If connecting fails, it's tried again (waiting retry_interval seconds
+    between attempts) until connect_attempts attempts have been made. This
+    gives an engine server which is restarting time to come back.
+
+    Closing the channel closes the connection; the engine server is left
+    running.
+
+    """
+    def __init__(self, address, connect_attempts=1, retry_interval=1.0,
+                 response_timeout=None, deadline=None):
+        Descriptor_gtp_channel.__init__(self, response_timeout, deadline)
+        self.address = address
+        self.connect_attempts = connect_attempts
+        self.retry_interval = retry_interval
+        self.socket = None
+        self._connect()
+
+    def _connect(self):
+        attempts_left = max(self.connect_attempts, 1)
+        while True:
+            attempts_left -= 1
+            try:
+                if isinstance(self.address, basestring):
+                    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    try:
+                        sock.connect(self.address)
+                    except EnvironmentError:
+                        sock.close()
+                        raise
+                else:
+                    sock = socket.create_connection(self.address)
+                    sock.setsockopt(
+                        socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except (EnvironmentError, OverflowError, TypeError), e:
+                if attempts_left <= 0:
+                    raise GtpChannelError(
+                        "error connecting to %s:\n%s" %
+                        (describe_gtp_address(self.address), e))
+                time.sleep(self.retry_interval)
+            else:
+                break
+        self.socket = sock
+        self.response_fd = sock.fileno()
+
+    def reconnect(self):
+        """Drop the current connection and connect to the server again.
+
+        Any responses still outstanding on the old connection are discarded.
+        The server will normally treat the new connection as a new GTP session.
+
+        Raises GtpChannelError if the connection can't be made.
+
+        """
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except EnvironmentError:
+                pass
+            self.socket = None
+        self.is_first_response = True
+        self._response_buffer = ""
+        self._response_data_is_at_eof = False
+        self._peeked_data = ""
+        self._connect()
+
+    def is_connection_usable(self):
+        if self.socket is None:
+            return False
+        return Descriptor_gtp_channel.is_connection_usable(self)
+
+    def send_command_line(self, command):
+        try:
+            self.socket.sendall(command)
+        except EnvironmentError, e:
+            if e.errno in (errno.EPIPE, errno.ECONNRESET):
+                raise GtpChannelClosed("engine has closed the connection")
+            else:
+                raise GtpTransportError(str(e))
+
+    def read_response_chunk(self):
+        return self.socket.recv(65536)
+
+    def close(self):
+        if self.socket is None:
+            return
+        try:
+            self.socket.close()
+        except EnvironmentError, e:
+            raise GtpTransportError("error closing connection:\n%s" % e)
+        finally:
+            self.socket = None
+
+
+class Gtp_channel_pool(object):
+    """Pool of idle GTP channels, for reuse by later games.
+
+    Idle channels are grouped by a key describing the engine configuration
+    (for example, the command line and environment). A channel released under
+    one key is only handed out again for the same key.
+
+    The channels must provide is_connection_usable() (Subprocess_gtp_channel
+    and Socket_gtp_channel do).
+
+    It's safe to use a pool from more than one thread.
+
+    """
+    def __init__(self):
+        self._idle_channels = {}
+        # map channel -> number of times it's been released
+        self._use_counts = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _retire(self, channel):
+        self._use_counts.pop(channel, None)
+        Gtp_controller(channel, "pooled engine").safe_close()
+
+    def take_channel(self, key):
+        """Return an idle channel released under 'key'.
+
+        key -- hashable value describing the engine configuration
+
+        Returns None if there are no suitable idle channels.
+
+        Idle channels whose engines have gone away are closed and discarded.
+
+        """
+        while True:
+            with self._lock:
+                channels = self._idle_channels.get(key)
+                if not channels:
+                    return None
+                channel = channels.pop()
+            if channel.is_connection_usable():
+                return channel
+            self._use_counts.pop(channel, None)
+            try:
+                channel.close()
+            except GtpTransportError:
+                pass
+
+    def release_channel(self, key, channel, max_uses=None):
+        """Return a channel to the pool.
+
+        key      -- as for take_channel()
+        channel  -- Gtp_channel
+        max_uses -- int (optional)
+
+        The channel mustn't have any responses outstanding. Logging is turned
+        off.
+
+        If max_uses is specified and the channel has now been released that
+        many times, it's retired instead: this sends 'quit' and closes the
+        channel (ignoring any errors).
+
+        """
+        channel.disable_logging()
+        with self._lock:
+            uses = self._use_counts.get(channel, 0) + 1
+            self._use_counts[channel] = uses
+            if max_uses is None or uses < max_uses:
+                self._idle_channels.setdefault(key, []).append(channel)
+                return
+        self._retire(channel)
+
+    def close_all(self):
+        """Send 'quit' to all idle channels, and close them.
+
+        Errors are ignored.
+
+        """
+        with self._lock:
+            channels = [channel for l in self._idle_channels.itervalues()
+                        for channel in l]
+            self._idle_channels = {}
+        for channel in channels:
+            self._retire(channel)
+
+
 class Gtp_controller(object):
     """Implementation of the controller side of the GTP protocol.
 
@@ -514,8 +989,10 @@ class Gtp_controller(object):
         If the engine returns a failure response, raises BadGtpResponse (use the
         gtp_error_message attribute to retrieve the text of the response).
 
-        This will wait indefinitely for the engine to produce the response.
+        This will wait indefinitely for the engine to produce the response,
+        unless the channel has a time limit (see Subprocess_gtp_channel).
 
+        Raises GtpTimeout if the channel's time limit is reached.
 
         Raises GtpChannelClosed if the engine has apparently closed its
         connection.
@@ -536,6 +1013,34 @@ class Gtp_controller(object):
         BadGtpResponse.gtp_command) will refer to the underlying command, not
         the alias.
 
+        """
+        return self.do_commands([(command,) + arguments])[0]
+
+    def do_commands(self, commands):
+        """Send several commands to the engine and return the responses.
+
+        commands -- list of sequences (command, argument, argument, ...)
+
+        Returns a list of result strings, one for each command, as for
+        do_command().
+
+        This sends all the commands before reading any of the responses, so
+        the batch costs a single round trip to the engine rather than one per
+        command. (GTP requires the engine to respond in order.)
+
+        Errors are reported as for do_command(). If any command gets a failure
+        response, this raises BadGtpResponse describing the first such command;
+        it still reads all the responses first, so the channel stays usable.
+        If a GtpChannelError is raised, its message describes the command
+        which was being sent or whose response was being read.
+
+        Raises ValueError (without sending anything) if any command or argument
+        contains a character forbidden in GTP.
+
+        This is intended for batches of commands with short responses (such as
+        game setup commands): the engine may not read further commands while
+        it's waiting to write a long response.
+
         """
         if self.channel_is_closed:
             raise StandardError("channel is closed")
@@ -546,27 +1051,34 @@ class Gtp_controller(object):
             else:
                 return argument
 
-        fixed_command = fix_argument(command)
-        fixed_arguments = map(fix_argument, arguments)
-        translated_command = self.gtp_aliases.get(fixed_command, fixed_command)
-        is_first_command = self.is_first_command
-        self.is_first_command = False
-
-        def format_command():
-            desc = "%s" % (" ".join([translated_command] + fixed_arguments))
-            if is_first_command:
-                return "first command (%s)" % desc
+        prepared = []
+        for command_and_arguments in commands:
+            fixed_command = fix_argument(command_and_arguments[0])
+            fixed_arguments = map(fix_argument, command_and_arguments[1:])
+            translated_command = self.gtp_aliases.get(
+                fixed_command, fixed_command)
+            _check_command_words(translated_command, fixed_arguments)
+            desc = " ".join([translated_command] + fixed_arguments)
+            if self.is_first_command:
+                desc = "first command (%s)" % desc
             else:
-                return "'%s'" % desc
+                desc = "'%s'" % desc
+            self.is_first_command = False
+            prepared.append((translated_command, fixed_arguments, desc))
 
+        responses = []
         try:
             is_sending = True
-            self.channel.send_command(translated_command, fixed_arguments)
+            for translated_command, fixed_arguments, desc in prepared:
+                self.channel.send_command(translated_command, fixed_arguments)
             is_sending = False
-            is_failure, response = self.channel.get_response()
+            for translated_command, fixed_arguments, desc in prepared:
+                responses.append(self.channel.get_response())
         except GtpChannelError, e:
             self.channel_is_bad = True
-            if isinstance(e, GtpTransportError):
+            if isinstance(e, GtpTimeout):
+                error_label = "timeout"
+            elif isinstance(e, GtpTransportError):
                 error_label = "transport error"
             elif isinstance(e, GtpProtocolError):
                 error_label = "GTP protocol error"
@@ -575,16 +1087,22 @@ class Gtp_controller(object):
             if is_sending:
                 msg = "%s sending %s to %s:\n%s"
             else:
+                desc = prepared[len(responses)][2]
                 msg = "%s reading response to %s from %s:\n%s"
-            e.args = (msg % (error_label, format_command(), self.name, e),)
+            e.args = (msg % (error_label, desc, self.name, e),)
             raise
-        if is_failure:
-            raise BadGtpResponse(
-                "failure response from %s to %s:\n%s" %
-                (format_command(), self.name, response),
-                gtp_command=translated_command, gtp_arguments=fixed_arguments,
-                gtp_error_message=response)
-        return response
+        results = []
+        for i, (is_failure, response) in enumerate(responses):
+            if is_failure:
+                translated_command, fixed_arguments, desc = prepared[i]
+                raise BadGtpResponse(
+                    "failure response from %s to %s:\n%s" %
+                    (desc, self.name, response),
+                    gtp_command=translated_command,
+                    gtp_arguments=fixed_arguments,
+                    gtp_error_message=response)
+            results.append(response)
+        return results
 
     def _known_command(self, command, do_command):
         """Common implementation for known_command and safe_known_command."""
@@ -597,6 +1115,9 @@ class Gtp_controller(object):
         except BadGtpResponse:
             known = False
         else:
+            if response is None:
+                # low-level error from safe_do_command(); don't cache
+                return False
             known = (response == 'true')
         self.known_commands[command] = known
         return known
@@ -740,6 +1261,19 @@ class Gtp_controller(object):
             self.errors_seen.append("error closing %s:\n%s" % (self.name, e))
         self.channel_is_closed = True
 
+    def detach_channel(self):
+        """Stop using the channel, without sending 'quit' or closing it.
+
+        Returns the channel, for reuse elsewhere.
+
+        Afterwards the controller behaves as if the channel had been closed.
+
+        """
+        if self.channel_is_closed:
+            raise StandardError("channel is closed")
+        self.channel_is_closed = True
+        return self.channel
+
     def retrieve_error_messages(self):
         """Return error messages which have been set aside by 'safe' commands.
 
@@ -882,6 +1416,113 @@ class Engine_description(object):
             else:
                 return self.name + ":" + self.clean_version
 
+class Engine_capabilities(object):
+    """Results of capability and description queries to an engine.
+
+    Public attributes:
+      known_commands     -- map command name -> bool
+      engine_description -- Engine_description or None
+
+    known_commands has the same form as Gtp_controller.known_commands.
+
+    Engine_capabilities are suitable for pickling.
+
+    """
+    def __init__(self, known_commands=None, engine_description=None):
+        if known_commands is None:
+            known_commands = {}
+        self.known_commands = known_commands
+        self.engine_description = engine_description
+
+class Engine_capability_cache(object):
+    """Cache of Engine_capabilities, so engines needn't be queried every game.
+
+    Entries are identified by a key, which may be any hashable and pickleable
+    value. It's up to the caller to choose keys which identify an engine
+    precisely enough (eg, including its command line and the modification time
+    of its executable).
+
+    The cache can be saved to a file, and loaded again in a later run.
+
+    Engine_capability_caches are safe to use from multiple threads.
+
+    """
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._saved_data = None
+
+    def get(self, key):
+        """Return the cached Engine_capabilities for the key, or None.
+
+        The result is a copy, which the caller may modify.
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            return Engine_capabilities(dict(entry.known_commands),
+                                       entry.engine_description)
+
+    def update(self, key, capabilities):
+        """Merge an Engine_capabilities into the entry for the key.
+
+        Known-command results are added to any already cached; the engine
+        description replaces any already cached, unless it's None.
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = Engine_capabilities()
+            entry.known_commands.update(capabilities.known_commands)
+            if capabilities.engine_description is not None:
+                entry.engine_description = capabilities.engine_description
+
+    def load(self, pathname):
+        """Add entries from a file written by save().
+
+        Entries already in the cache take precedence.
+
+        Does nothing if the file doesn't exist or can't be read.
+
+        """
+        try:
+            with open(pathname, "rb") as f:
+                entries = pickle.load(f)
+            if not isinstance(entries, dict):
+                return
+        except Exception:
+            return
+        with self._lock:
+            for key, entry in entries.iteritems():
+                self._entries.setdefault(key, entry)
+
+    def save(self, pathname):
+        """Write the cache's contents to a file.
+
+        Does nothing if the contents haven't changed since the last save().
+
+        The file is replaced atomically, so it's safe for several processes to
+        save to the same file (the last one wins).
+
+        Propagates EnvironmentError if there's an error writing the file.
+
+        """
+        with self._lock:
+            data = pickle.dumps(self._entries, protocol=-1)
+            if data == self._saved_data:
+                return
+            new_pathname = "%s.%d.new" % (pathname, os.getpid())
+            f = open(new_pathname, "wb")
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(new_pathname, pathname)
+            self._saved_data = data
+
 class Game_controller(object):
     """Manage a pair of GTP controllers representing game players.
 
@@ -894,10 +1535,13 @@ class Game_controller(object):
 
     Order of operations:
       gc = Game_controller(...)
-      gc.set_player_subprocess('b', ...) or set_player_controller('b', ...)
-      gc.set_player_subprocess('w', ...) or set_player_controller('w', ...)
+      gc.set_player_subprocess('b', ...), set_player_socket('b', ...),
+        or set_player_controller('b', ...)
+      gc.set_player_subprocess('w', ...), set_player_socket('w', ...),
+        or set_player_controller('w', ...)
       Any combination of:
         gc.send_command(...)
+        gc.send_commands(...)
         gc.maybe_send_command(...)
         gc.known_command(...)
         higher-level helpers
@@ -929,15 +1573,21 @@ class Game_controller(object):
         self.late_errors = []
         self.engine_descriptions = {'b' : None, 'w' : None}
         self.in_cautious_mode = False
+        # map colour -> (Gtp_channel_pool, key, max_uses)
+        self.channel_pools = {}
+        # map colour -> float
+        self.gtp_cpu_time_baselines = {}
 
     ## Configuration API
 
     def set_player_controller(self, colour, controller,
-                              check_protocol_version=True):
+                              check_protocol_version=True,
+                              capabilities=None):
         """Specify a player using a Gtp_controller.
 
         controller             -- Gtp_controller
         check_protocol_version -- bool (default True)
+        capabilities           -- Engine_capabilities (optional)
 
         By convention, the controller's name should be 'player <player code>'.
 
@@ -947,23 +1597,54 @@ class Game_controller(object):
         Sets the engine_descriptions entry for the player, using GTP commands
         (see Engine_description).
 
+        If 'capabilities' is specified, its known_commands results are used
+        instead of asking the engine, and if it has an engine description that
+        is used instead of sending the engine-description commands. (The
+        protocol version is still checked.) See get_engine_capabilities().
+
         Propagates GtpChannelError if there's a low-level error checking the
         protocol version or from the engine-description commands.
 
         """
         self.controllers[colour] = controller
+        if capabilities is not None:
+            controller.known_commands.update(capabilities.known_commands)
         if check_protocol_version:
             controller.check_protocol_version()
-        player_code = self.players[colour]
-        self.engine_descriptions[colour] = \
-            Engine_description.from_controller(controller)
+        if (capabilities is not None and
+            capabilities.engine_description is not None):
+            self.engine_descriptions[colour] = capabilities.engine_description
+        else:
+            self.engine_descriptions[colour] = \
+                Engine_description.from_controller(controller)
+
+    def _set_pooled_player(self, colour, channel, pool, pool_key, max_uses,
+                           check_protocol_version, capabilities):
+        self.channel_pools[colour] = (pool, pool_key, max_uses)
+        controller = Gtp_controller(channel, "player %s" % self.players[colour])
+        self.set_player_controller(colour, controller, check_protocol_version,
+                                   capabilities)
+        # The engine may have used CPU time before this game; see
+        # get_gtp_cpu_times().
+        if controller.known_command('gomill-cpu_time'):
+            try:
+                self.gtp_cpu_time_baselines[colour] = float(
+                    controller.do_command('gomill-cpu_time'))
+            except (BadGtpResponse, ValueError):
+                pass
 
     def set_player_subprocess(self, colour, command,
-                              check_protocol_version=True, **kwargs):
+                              check_protocol_version=True,
+                              pool=None, pool_key=None, max_uses=None,
+                              capabilities=None, **kwargs):
         """Specify the a player as a subprocess.
 
         command                -- list of strings (as for subprocess.Popen)
         check_protocol_version -- bool (default True)
+        pool                   -- Gtp_channel_pool (optional)
+        pool_key               -- key to use with the pool (default command)
+        max_uses               -- int (optional; see below)
+        capabilities           -- Engine_capabilities (optional)
 
         Any additional keyword arguments are passed to the
         Subprocess_gtp_channel constructor.
@@ -974,23 +1655,104 @@ class Game_controller(object):
         GTP protocol version <> 2 (raises BadGtpResponse).
 
         Sets the engine_descriptions entry for the player, using GTP commands
-        (see Engine_description).
+        (see Engine_description), or from 'capabilities' (see
+        set_player_controller()).
 
         Propagates GtpChannelError if there's a low-level error creating the
         subprocess, checking the protocol version, or from the
         engine-description commands.
 
+        If 'pool' is specified, an idle subprocess is taken from the pool if
+        there's one with the same key; only the response_timeout, deadline and
+        exit_timeout keyword arguments are used in this case. close_players()
+        returns the subprocess to the pool rather than ending it, unless there
+        was a low-level error communicating with the engine, or the subprocess
+        has now been used for max_uses games.
+
         """
         player_code = self.players[colour]
-        try:
-            channel = Subprocess_gtp_channel(command, **kwargs)
-        except GtpChannelError, e:
-            raise GtpChannelError(
-                "error starting subprocess for player %s:\n%s" %
-                (player_code, e))
+        channel = None
+        if pool is not None:
+            if pool_key is None:
+                pool_key = tuple(command)
+            channel = pool.take_channel(pool_key)
+        if channel is None:
+            try:
+                channel = Subprocess_gtp_channel(command, **kwargs)
+            except GtpChannelError, e:
+                raise GtpChannelError(
+                    "error starting subprocess for player %s:\n%s" %
+                    (player_code, e))
+        else:
+            channel.set_response_timeout(kwargs.get('response_timeout'))
+            channel.set_deadline(kwargs.get('deadline'))
+            channel.set_exit_timeout(kwargs.get('exit_timeout'))
+        if pool is not None:
+            self._set_pooled_player(colour, channel, pool, pool_key, max_uses,
+                                    check_protocol_version, capabilities)
+            return
+        controller = Gtp_controller(channel, "player %s" % player_code)
+        self.set_player_controller(colour, controller, check_protocol_version,
+                                   capabilities)
+
+    def set_player_socket(self, colour, address,
+                          check_protocol_version=True,
+                          pool=None, pool_key=None, max_uses=None,
+                          capabilities=None, **kwargs):
+        """Specify a player as an engine server reached over a socket.
+
+        address                -- as for Socket_gtp_channel
+        check_protocol_version -- bool (default True)
+        pool                   -- Gtp_channel_pool (optional)
+        pool_key               -- key to use with the pool (default address)
+        max_uses               -- int (optional)
+        capabilities           -- Engine_capabilities (optional)
+
+        Any additional keyword arguments are passed to the Socket_gtp_channel
+        constructor.
+
+        If 'pool' is specified, the connection is taken from the pool if
+        possible (only the response_timeout and deadline keyword arguments are
+        used in this case), and close_players() returns it to the pool (without
+        sending 'quit'), as for set_player_subprocess().
+
+        Otherwise behaves as set_player_subprocess().
+
+        """
+        player_code = self.players[colour]
+        channel = None
+        if pool is not None:
+            if pool_key is None:
+                pool_key = address
+            channel = pool.take_channel(pool_key)
+        if channel is None:
+            try:
+                channel = Socket_gtp_channel(address, **kwargs)
+            except GtpChannelError, e:
+                raise GtpChannelError(
+                    "error connecting to player %s:\n%s" % (player_code, e))
+        else:
+            channel.set_response_timeout(kwargs.get('response_timeout'))
+            channel.set_deadline(kwargs.get('deadline'))
+        if pool is not None:
+            self._set_pooled_player(colour, channel, pool, pool_key, max_uses,
+                                    check_protocol_version, capabilities)
+            return
         controller = Gtp_controller(channel, "player %s" % player_code)
-        self.set_player_controller(colour, controller, check_protocol_version)
+        self.set_player_controller(colour, controller, check_protocol_version,
+                                   capabilities)
 
+    def get_engine_capabilities(self, colour):
+        """Return an Engine_capabilities describing what's known of a player.
+
+        This reports the engine description and the results of all
+        known_command queries made so far (including any which were supplied
+        by an Engine_capabilities when the player was set).
+
+        """
+        return Engine_capabilities(
+            dict(self.controllers[colour].known_commands),
+            self.engine_descriptions[colour])
 
     ## Generic GTP controller API
 
@@ -1038,6 +1800,27 @@ class Game_controller(object):
         else:
             return controller.do_command(command, *arguments)
 
+    def send_commands(self, colour, commands):
+        """Send several GTP commands to one of the players.
+
+        colour   -- player to talk to ('b' or 'w')
+        commands -- list of sequences (command, argument, argument, ...)
+
+        Returns a list of response strings.
+
+        This uses Gtp_controller.do_commands(), so the commands are sent
+        before any of the responses are read. In cautious mode the commands
+        are sent one at a time, as for send_command().
+
+        Raises BadGtpResponse if the engine returns a failure response to any
+        of the commands (or in the same circumstances as send_command() in
+        cautious mode).
+
+        """
+        if self.in_cautious_mode:
+            return [self.send_command(colour, *command) for command in commands]
+        return self.controllers[colour].do_commands(commands)
+
     def maybe_send_command(self, colour, command, *arguments):
         """Send the specified GTP command, if supported.
 
@@ -1077,17 +1860,29 @@ class Game_controller(object):
         else:
             return controller.known_command(command)
 
-    def close_players(self):
+    def close_players(self, return_to_pools=True):
         """Close both controllers (if they're open).
 
         Sends "quit"; always communicates cautiously.
 
+        Players whose channels came from a Gtp_channel_pool have their
+        channels returned to the pool instead, unless the channel has been
+        marked bad or return_to_pools is false.
+
         """
         for colour in ("b", "w"):
             controller = self.controllers.get(colour)
             if controller is None:
                 continue
-            controller.safe_close()
+            pool_info = self.channel_pools.get(colour)
+            if (pool_info is not None and return_to_pools and
+                not controller.channel_is_bad and
+                not controller.channel_is_closed):
+                pool, pool_key, max_uses = pool_info
+                pool.release_channel(
+                    pool_key, controller.detach_channel(), max_uses)
+            else:
+                controller.safe_close()
             self.late_errors += controller.retrieve_error_messages()
 
     def describe_late_errors(self):
@@ -1116,6 +1911,9 @@ class Game_controller(object):
         cpu_time is a float, or None if the information isn't available.
 
         CPU time will not be available until the controller has been closed.
+        It isn't available for engines from a Gtp_channel_pool (even if the
+        channel was closed rather than returned to the pool, the figure
+        wouldn't be for this game alone).
 
         It's safe to call this even if one or both of the engines was never
         successfully started.
@@ -1123,6 +1921,8 @@ class Game_controller(object):
         """
         result = {'b' : None, 'w' : None}
         for colour in 'b', 'w':
+            if colour in self.channel_pools:
+                continue
             try:
                 controller = self.controllers[colour]
             except KeyError:
@@ -1151,6 +1951,10 @@ class Game_controller(object):
         response (including a low-level error when in cautious mode), it will
         appear in 'errors'.
 
+        For engines from a Gtp_channel_pool, the figure is the CPU time used
+        since the engine was set up for this game (if gomill-cpu_time didn't
+        work then, the engine appears in 'errors').
+
         """
         result = {}
         errors = set()
@@ -1158,9 +1962,17 @@ class Game_controller(object):
             if self.known_command(colour, 'gomill-cpu_time'):
                 try:
                     s = self.maybe_send_command(colour, 'gomill-cpu_time')
-                    result[colour] = float(s)
+                    cpu_time = float(s)
                 except (ValueError, TypeError):
                     errors.add(colour)
+                    continue
+                if colour in self.channel_pools:
+                    baseline = self.gtp_cpu_time_baselines.get(colour)
+                    if baseline is None:
+                        errors.add(colour)
+                        continue
+                    cpu_time -= baseline
+                result[colour] = cpu_time
         return result, errors
 
 
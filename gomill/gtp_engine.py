@@ -7,11 +7,15 @@ and gnugo 3.7 as 'reference implementation'.
 
 import errno
 import re
+import socket
 import sys
 import os
+import threading
+import time
 
 from gomill.common import *
 from gomill.utils import isinf, isnan
+from gomill import ascii_tables
 from gomill import compact_tracebacks
 
 
@@ -25,6 +29,25 @@ class GtpQuit(Exception):
     """Request to end session from a command handler."""
 
 
+class Cancellation_token(object):
+    """Flag used to ask background work to stop.
+
+    Background work should call is_cancelled() from time to time, and return
+    promptly once it returns True.
+
+    """
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Ask the background work to stop."""
+        self._event.set()
+
+    def is_cancelled(self):
+        """Check whether the background work has been asked to stop."""
+        return self._event.isSet()
+
+
 
 
 ### Handler support
@@ -146,6 +169,99 @@ _remove_response_controls_re = re.compile(r"[\x00-\x08\x0b-\x1f\x7f]")
 _normalise_whitespace_re = re.compile(r"[\x09\x20]+")
 _command_id_re = re.compile(r"^-?[0-9]+")
 
+class Command_timing(object):
+    """Timing statistics for a single GTP command.
+
+    Public attributes:
+      count      -- int (number of times the command was run)
+      total_time -- float (seconds)
+      max_time   -- float (seconds)
+      histogram  -- list of ints
+
+    histogram has one entry for each latency band defined by
+    Command_statistics.histogram_limits, plus one for slower runs.
+
+    """
+    def __init__(self, band_count):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = [0] * band_count
+
+class Command_statistics(object):
+    """Timing statistics for the commands run by a GTP engine.
+
+    Public attributes:
+      timings -- dict command name -> Command_timing
+
+    """
+    # Upper bounds (in seconds) of the latency histogram bands
+    histogram_limits = (0.001, 0.01, 0.1, 1.0, 10.0)
+    histogram_headings = ("<1ms", "<10ms", "<100ms", "<1s", "<10s", ">=10s")
+
+    def __init__(self):
+        self.timings = {}
+
+    def reset(self):
+        """Forget all statistics collected so far."""
+        self.timings = {}
+
+    def record(self, command, elapsed):
+        """Record a run of a command.
+
+        command -- string (command name)
+        elapsed -- float (seconds)
+
+        """
+        timing = self.timings.get(command)
+        if timing is None:
+            timing = Command_timing(len(self.histogram_limits) + 1)
+            self.timings[command] = timing
+        timing.count += 1
+        timing.total_time += elapsed
+        if elapsed > timing.max_time:
+            timing.max_time = elapsed
+        for i, limit in enumerate(self.histogram_limits):
+            if elapsed < limit:
+                break
+        else:
+            i = len(self.histogram_limits)
+        timing.histogram[i] += 1
+
+    def format_report(self):
+        """Return a table describing the statistics.
+
+        Returns a multiline string, with commands listed in decreasing order
+        of total time. Times are in seconds.
+
+        """
+        if not self.timings:
+            return "no commands timed"
+        commands = sorted(self.timings,
+                          key=lambda c: (-self.timings[c].total_time, c))
+        timings = [self.timings[command] for command in commands]
+        t = ascii_tables.Table(row_count=len(commands))
+        t.add_heading("command")
+        i = t.add_column(align='left', right_padding=3)
+        t.set_column_values(i, commands)
+        for heading, fn in [
+            ("calls", lambda timing: timing.count),
+            ("total", lambda timing: "%.3f" % timing.total_time),
+            ("mean", lambda timing: "%.3f" % (timing.total_time/timing.count)),
+            ("max", lambda timing: "%.3f" % timing.max_time),
+            ]:
+            t.add_heading(heading)
+            i = t.add_column(align='right', right_padding=2)
+            t.set_column_values(i, map(fn, timings))
+        t.columns[i].right_padding = 3
+        for band, heading in enumerate(self.histogram_headings):
+            t.add_heading(heading)
+            i = t.add_column(align='right')
+            t.set_column_values(i, [timing.histogram[band]
+                                    for timing in timings])
+        return "\n".join(t.render())
+
+
 def _preprocess_line(s):
     """Clean up an input line and normalise whitespace."""
     s = s.partition("#")[0]
@@ -239,16 +355,125 @@ class Gtp_engine_protocol(object):
     traceback. By default, this is not treated as a fatal error; use
     set_handler_exceptions_fatal() to change this.
 
+    An engine can also have a _ponder handler_, which runs in a background
+    thread between commands (see set_ponder_handler()).
+
+    The engine can collect timing statistics for the commands it runs (see
+    enable_command_statistics()).
+
     """
 
     def __init__(self):
         self.handlers = {}
         self.handler_exceptions_are_fatal = False
+        self.ponder_handler = None
+        self._ponder_thread = None
+        self._ponder_token = None
+        self.command_statistics = None
+        self.statistics_dest = None
 
     def set_handler_exceptions_fatal(self, b=True):
         """Treat exceptions from handlers as fatal errors."""
         self.handler_exceptions_are_fatal = bool(b)
 
+    def enable_command_statistics(self, report_dest=None):
+        """Collect timing statistics for each command.
+
+        report_dest -- writable file-like object (optional)
+
+        Statistics are available from the command_statistics attribute (a
+        Command_statistics object), and from the gomill-stats command (which
+        this adds). 'gomill-stats reset' forgets the statistics collected so
+        far.
+
+        If report_dest is specified, the statistics are written to it when a
+        command (normally 'quit') ends the session.
+
+        Only commands which have a handler are timed. The time taken to stop
+        any ponder handler isn't included.
+
+        """
+        self.command_statistics = Command_statistics()
+        self.statistics_dest = report_dest
+        self.add_command('gomill-stats', self.handle_stats)
+
+    def handle_stats(self, args):
+        if args:
+            if args[0] != "reset":
+                report_bad_arguments()
+            self.command_statistics.reset()
+            return
+        return "\n" + self.command_statistics.format_report()
+
+    def _write_statistics_report(self):
+        try:
+            self.statistics_dest.write(
+                self.command_statistics.format_report() + "\n")
+            self.statistics_dest.flush()
+        except EnvironmentError:
+            pass
+
+    def set_ponder_handler(self, handler):
+        """Specify a handler to do background work between commands.
+
+        handler -- callable taking a Cancellation_token, or None
+
+        After each command which doesn't end the session, the ponder handler is
+        called in a background thread. When the next command arrives, the
+        token is cancelled and the command isn't run until the handler has
+        returned (so the handler doesn't need to worry about command handlers
+        changing state while it runs).
+
+        The handler should check the token frequently. If it raises an
+        exception, the traceback is written to stderr.
+
+        See gtp_states.Gtp_state.ponder() for a ready-made handler.
+
+        """
+        self.stop_pondering()
+        self.ponder_handler = handler
+
+    def _ponder(self, token):
+        try:
+            self.ponder_handler(token)
+        except Exception:
+            try:
+                sys.stderr.write("error from ponder handler:\n%s\n" %
+                                 compact_tracebacks.format_traceback(skip=1))
+            except Exception:
+                pass
+
+    def start_pondering(self):
+        """Run the ponder handler in a background thread.
+
+        Does nothing if there is no ponder handler, or it's already running.
+
+        run_command() calls this automatically.
+
+        """
+        if self.ponder_handler is None or self._ponder_thread is not None:
+            return
+        self._ponder_token = Cancellation_token()
+        self._ponder_thread = threading.Thread(
+            target=self._ponder, args=(self._ponder_token,))
+        self._ponder_thread.daemon = True
+        self._ponder_thread.start()
+
+    def stop_pondering(self):
+        """Cancel the ponder handler and wait for it to return.
+
+        Does nothing if the ponder handler isn't running.
+
+        run_command() calls this automatically.
+
+        """
+        if self._ponder_thread is None:
+            return
+        self._ponder_token.cancel()
+        self._ponder_thread.join()
+        self._ponder_thread = None
+        self._ponder_token = None
+
     def add_command(self, command, handler):
         """Register the handler function for a command."""
         self.handlers[command] = handler
@@ -313,7 +538,15 @@ class Gtp_engine_protocol(object):
         If end_session is true, the engine doesn't want to receive any more
         commands.
 
+        If there is a ponder handler, this stops it before running the
+        command, and restarts it afterwards unless end_session is true.
+
         """
+        self.stop_pondering()
+        if self.command_statistics is not None and command in self.handlers:
+            start_time = time.time()
+        else:
+            start_time = None
         try:
             response = self._do_command(command, args)
         except GtpQuit, e:
@@ -335,6 +568,13 @@ class Gtp_engine_protocol(object):
         else:
             is_error = False
             end_session = False
+        if start_time is not None:
+            self.command_statistics.record(command, time.time() - start_time)
+        if end_session:
+            if self.statistics_dest is not None:
+                self._write_statistics_report()
+        else:
+            self.start_pondering()
         return is_error, _clean_response(response), end_session
 
     def handle_line(self, line):
@@ -426,22 +666,25 @@ class ControllerDisconnected(IOError):
     """The GTP controller went away."""
 
 def _run_gtp_session(engine, read, write):
-    while True:
-        try:
-            line = read()
-        except EOFError:
-            break
-        response, end_session = engine.handle_line(line)
-        if response is not None:
+    try:
+        while True:
             try:
-                write(response)
-            except IOError, e:
-                if e.errno == errno.EPIPE:
-                    raise ControllerDisconnected(*e.args)
-                else:
-                    raise
-        if end_session:
-            break
+                line = read()
+            except EOFError:
+                break
+            response, end_session = engine.handle_line(line)
+            if response is not None:
+                try:
+                    write(response)
+                except IOError, e:
+                    if e.errno == errno.EPIPE:
+                        raise ControllerDisconnected(*e.args)
+                    else:
+                        raise
+            if end_session:
+                break
+    finally:
+        engine.stop_pondering()
 
 def run_gtp_session(engine, src, dst):
     """Run a GTP engine session using 'src' and 'dst' for the controller.
@@ -466,6 +709,164 @@ def run_gtp_session(engine, src, dst):
         dst.flush()
     _run_gtp_session(engine, read, write)
 
+def make_listening_socket(address, backlog=5):
+    """Create a socket for an engine server to accept connections on.
+
+    address -- string (Unix-domain socket pathname), or pair (host, port)
+
+    Use port 0 to have the system choose a free port (socket.getsockname()
+    tells you which).
+
+    Returns a listening socket object. Propagates socket.error.
+
+    A Unix-domain socket pathname mustn't already exist.
+
+    """
+    if isinstance(address, basestring):
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        listener.bind(address)
+        listener.listen(backlog)
+    except:
+        listener.close()
+        raise
+    return listener
+
+def serve_gtp_sessions(engine, listener, max_sessions=None):
+    """Run GTP engine sessions for connections made to a listening socket.
+
+    engine       -- Gtp_engine_protocol object
+    listener     -- listening socket object (eg, from make_listening_socket())
+    max_sessions -- int (optional)
+
+    This accepts one connection at a time (later connections wait until the
+    current session ends), and runs a GTP session on it using
+    run_gtp_session(). Every session uses the same engine object, so any
+    expensive startup work is done only once.
+
+    A session ends when the controller sends 'quit' or closes the connection;
+    this then waits for the next connection.
+
+    Returns after max_sessions sessions, if that's specified. Otherwise runs
+    until accepting a connection fails (eg, because the listening socket has
+    been shut down), and propagates the socket.error.
+
+    See serve_concurrent_gtp_sessions() for a server which can run more than
+    one session at once.
+
+    """
+    sessions_run = 0
+    while max_sessions is None or sessions_run < max_sessions:
+        connection = _accept_connection(listener)
+        _run_connection_session(engine, connection)
+        sessions_run += 1
+
+def _accept_connection(listener):
+    """Accept a connection, retrying if interrupted by a signal."""
+    while True:
+        try:
+            connection, _ = listener.accept()
+        except socket.error, e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        return connection
+
+def _run_connection_session(engine, connection):
+    """Run a GTP session on an accepted connection, then close it."""
+    src = connection.makefile("rb")
+    dst = connection.makefile("wb")
+    try:
+        run_gtp_session(engine, src, dst)
+    except EnvironmentError:
+        # Controller went away
+        pass
+    finally:
+        for f in (src, dst, connection):
+            try:
+                f.close()
+            except EnvironmentError:
+                pass
+
+def serve_concurrent_gtp_sessions(engine_factory, listener, max_sessions=None):
+    """Run concurrent GTP engine sessions for connections to a listening socket.
+
+    engine_factory -- callable returning a Gtp_engine_protocol object, or an
+                      object with an 'engine' attribute and a close() method
+    listener       -- listening socket object
+    max_sessions   -- int (optional)
+
+    This is like serve_gtp_sessions(), except that each connection is served
+    by its own thread, using a new engine from engine_factory (so each
+    session has its own state; for example, its own gtp_states.Gtp_state).
+    Sessions don't wait for each other.
+
+    The engine factory is called from the session's thread. If it raises an
+    exception, the connection is closed without running a session, and the
+    traceback is written to stderr.
+
+    If the engine factory returns an object with an 'engine' attribute (for
+    example, a gtp_proxy.Gtp_proxy), the session uses that engine, and the
+    object's close() method is called from the session's thread when the
+    session ends, however it ends (including when the controller
+    disconnects). If close() raises an exception, the traceback is written to
+    stderr.
+
+    Returns after max_sessions connections have been accepted and their
+    sessions have ended, if max_sessions is specified. Otherwise runs until
+    accepting a connection fails, and propagates the socket.error (any
+    sessions in progress continue to run, in daemon threads).
+
+    As the sessions share a Python interpreter, this is suitable for
+    lightweight engines; an engine which spends most of its time in Python
+    code won't get more than one core's worth of CPU time in total.
+
+    """
+    def report_error(message):
+        try:
+            sys.stderr.write("%s:\n%s\n" % (
+                message, compact_tracebacks.format_traceback(skip=1)))
+        except Exception:
+            pass
+
+    def run_session(connection):
+        try:
+            engine = engine_factory()
+        except Exception:
+            report_error("error creating engine")
+            try:
+                connection.close()
+            except EnvironmentError:
+                pass
+            return
+        if isinstance(engine, Gtp_engine_protocol):
+            session = None
+        else:
+            session = engine
+            engine = session.engine
+        try:
+            _run_connection_session(engine, connection)
+        finally:
+            if session is not None:
+                try:
+                    session.close()
+                except Exception:
+                    report_error("error closing session")
+
+    threads = []
+    while max_sessions is None or len(threads) < max_sessions:
+        connection = _accept_connection(listener)
+        thread = threading.Thread(target=run_session, args=(connection,))
+        thread.daemon = True
+        thread.start()
+        if max_sessions is not None:
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
+
 def make_readline_completer(engine):
     """Return a readline completer function for the specified engine."""
     commands = engine.list_commands()
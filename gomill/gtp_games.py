@@ -3,8 +3,9 @@
 from gomill.utils import *
 from gomill.common import *
 from gomill import gameplay
+from gomill import utils
 from gomill import gtp_controller
-from gomill.gtp_controller import BadGtpResponse
+from gomill.gtp_controller import BadGtpResponse, GtpTimeout
 
 class Game_result(gameplay.Result):
     """Description of a game result.
@@ -62,9 +63,13 @@ class Game_result(gameplay.Result):
             self.is_forfeit,
             self.game_id,
             self.cpu_times,
+            self.is_adjudicated,
             )
 
     def __setstate__(self, state):
+        # Gomill 0.8.1 and earlier didn't record adjudication
+        if len(state) == 8:
+            state += (False,)
         (self.player_b,
          self.player_w,
          self.winning_colour,
@@ -73,6 +78,7 @@ class Game_result(gameplay.Result):
          self.is_forfeit,
          self.game_id,
          cpu_times,
+         self.is_adjudicated,
          ) = state
         # In gomill 0.7 and earlier, cpu_time could be '?'; treat this as None
         for colour, cpu_time in cpu_times.items():
@@ -187,6 +193,8 @@ class _Gtp_backend(gameplay.Backend):
         self.allowed_scorers = []
         self.internal_scorer = False
         self.handicap_compensation = "no"
+        self.remove_dead = False
+        self.timeout_forfeits = False
         self.handicap = None
 
     def start_new_game(self, board_size, komi):
@@ -194,10 +202,15 @@ class _Gtp_backend(gameplay.Backend):
         assert board_size == self.board_size
         assert komi == self.komi
         self.gc.set_cautious_mode(False)
-        for colour in "b", "w":
-            self.gc.send_command(colour, "boardsize", str(board_size))
-            self.gc.send_command(colour, "clear_board")
-            self.gc.send_command(colour, "komi", str(komi))
+        commands = [
+            ("boardsize", str(board_size)),
+            ("clear_board",),
+            ("komi", str(komi)),
+            ]
+        # Let both engines set up at once (clear_board may be slow)
+        utils.call_concurrently([
+            lambda colour=colour: self.gc.send_commands(colour, commands)
+            for colour in ("b", "w")])
 
     def end_game(self):
         self.gc.set_cautious_mode(True)
@@ -248,6 +261,10 @@ class _Gtp_backend(gameplay.Backend):
             raw_move = self.gc.send_command(colour, *genmove_command)
         except BadGtpResponse, e:
             return 'forfeit', str(e)
+        except GtpTimeout, e:
+            if not self.timeout_forfeits:
+                raise
+            return 'forfeit', str(e)
         move_s = raw_move.lower()
         if move_s == "resign":
             return 'resign', None
@@ -278,6 +295,10 @@ class _Gtp_backend(gameplay.Backend):
                 # If the game is over, this could be a channel error reported
                 # by cautious mode; that's fine (see test_pass_and_exit())
                 return 'error', str(e)
+        except GtpTimeout, e:
+            if not self.timeout_forfeits:
+                raise
+            return 'error', str(e)
         return 'accept', None
 
     def _score_game_gtp(self):
@@ -328,7 +349,8 @@ class _Gtp_backend(gameplay.Backend):
     def score_game(self, board):
         if self.internal_scorer:
             game_score = Gtp_game_score.from_position(
-                board, self.komi, self.handicap_compensation, self.handicap)
+                board, self.komi, self.handicap_compensation, self.handicap,
+                self.remove_dead)
         else:
             game_score = self._score_game_gtp()
         return game_score
@@ -347,6 +369,8 @@ class Gtp_game(object):
       game = Gtp_game(...)
       Any combination of:
         game.set_game_id(...)
+        game.set_ko_rule(...)
+        game.set_adjudication(...)
         game.use_internal_scorer() or game.allow_scorer(...)
         game.set_claim_allowed(...)
         game.set_move_callback(...)
@@ -406,13 +430,44 @@ class Gtp_game(object):
         """
         self.game_id = str(game_id)
 
-    def use_internal_scorer(self, handicap_compensation='no'):
+    def set_ko_rule(self, ko_rule):
+        """Specify the ko rule to enforce.
+
+        ko_rule -- 'simple', 'positional', or 'situational'
+
+        See gameplay.Game.set_ko_rule() for details. If you don't call this,
+        only a simple ko rule is enforced.
+
+        """
+        self.game_runner.set_ko_rule(ko_rule)
+
+    def set_adjudication(self, pass_alive_margin=None,
+                         stable_score_moves=None,
+                         handicap_compensation='no'):
+        """Specify when to stop a game early.
+
+        pass_alive_margin     -- int or float or None (default None)
+        stable_score_moves    -- int or None (default None)
+        handicap_compensation -- 'no' (default), 'short', or 'full'.
+
+        See gameplay.Game_runner.set_adjudication() for details. If you don't
+        call this, games aren't adjudicated.
+
+        """
+        self.game_runner.set_adjudication(pass_alive_margin, stable_score_moves,
+                                          handicap_compensation)
+
+    def use_internal_scorer(self, handicap_compensation='no',
+                            remove_dead=False):
         """Set the scoring method to internal.
 
         handicap_compensation -- 'no' (default), 'short', or 'full'.
+        remove_dead           -- bool (default False)
 
-        The internal scorer uses area score, assuming all stones alive.
-        See gameplay.score_game() for details.
+        The internal scorer uses area score, assuming all stones alive. If
+        remove_dead is true, stones which are provably dead (because they're
+        in the opponent's pass-alive territory) are removed first.
+        See gameplay.Game_score.from_position() for details.
 
         """
         self.backend.internal_scorer = True
@@ -420,6 +475,7 @@ class Gtp_game(object):
             raise ValueError("bad handicap_compensation value: %s" %
                              handicap_compensation)
         self.backend.handicap_compensation = handicap_compensation
+        self.backend.remove_dead = remove_dead
 
     def allow_scorer(self, colour):
         """Allow the specified player to score the game.
@@ -440,6 +496,16 @@ class Gtp_game(object):
         """
         self.backend.claim_allowed[colour] = bool(b)
 
+    def set_timeout_forfeits(self, b=True):
+        """Specify whether a player who times out forfeits the game.
+
+        If this is set, GtpTimeout from a player while the game is being played
+        (see Subprocess_gtp_channel.set_response_timeout()) causes that player
+        to forfeit, rather than being propagated from run().
+
+        """
+        self.backend.timeout_forfeits = bool(b)
+
     def set_move_callback(self, fn):
         """Specify a callback function to be called after every move.
 
@@ -454,6 +520,9 @@ class Gtp_game(object):
     def prepare(self):
         """Initialise the engines' GTP game state (board size, contents, komi).
 
+        The two engines are initialised at the same time (the commands to one
+        of them are sent from a separate thread).
+
         Propagates BadGtpResponse if an engine returns a failure response to
         any of the initialisation commands.
 
@@ -492,7 +561,8 @@ class Gtp_game(object):
         response, the game will be forfeited).
 
         Propagates GtpChannelError if there is trouble communicating with an
-        engine before the result has been determined. Afterwards, sets errors
+        engine before the result has been determined (except for GtpTimeout
+        if set_timeout_forfeits() has been called). Afterwards, sets errors
         aside; retrieve them with game_controller.describe_late_errors().
 
         Propagates any exceptions from any after-move callback.
@@ -535,7 +605,8 @@ class Gtp_game(object):
 
         Returns a Gtp_game_score.
 
-        Returns None if the game was not passed out.
+        Returns None if the game was not scored (that is, if it wasn't passed
+        out or adjudicated without a winner).
 
         """
         return self.game_runner.get_game_score()
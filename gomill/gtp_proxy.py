@@ -5,6 +5,14 @@ on to another engine (the _back end_).
 
 """
 
+from __future__ import with_statement
+
+import cPickle as pickle
+import hashlib
+import os
+import threading
+from collections import deque
+
 from gomill import gtp_controller
 from gomill import gtp_engine
 from gomill.gtp_controller import (
@@ -23,6 +31,293 @@ class BackEndError(StandardError):
         StandardError.__init__(self, args)
         self.cause = cause
 
+class State_tracker(object):
+    """Track the game state of a GTP engine from the commands it is sent.
+
+    This looks at the successful responses to the standard commands which
+    change an engine's state (boardsize, clear_board, komi, play, genmove,
+    undo, the handicap commands, and the time commands), and maintains a key
+    identifying the state they produce, and a list of commands which would
+    reproduce it.
+
+    Commands such as loadsgf, whose effect can't be followed, put the tracker
+    into an unknown state, in which the board size and komi are unknown too.
+    The state is known again once boardsize and komi have both been sent.
+
+    Public attributes (treat as read-only):
+      board_size -- string, or None if not yet set or unknown
+      komi       -- string, or None if not yet set or unknown
+
+    """
+    untrackable_commands = frozenset(['loadsgf'])
+
+    def __init__(self, untrackable_commands=()):
+        self.untrackable_commands = \
+            self.untrackable_commands.union(untrackable_commands)
+        self.board_size = None
+        self.komi = None
+        # These say whether an untrackable command has been run since the
+        # last boardsize or komi
+        self._board_size_lost = False
+        self._komi_lost = False
+        # map setting name -> (command, args), for the commands which set
+        # state that clear_board doesn't reset (other than boardsize)
+        self._settings = {}
+        self._reset_moves()
+
+    def _reset_moves(self):
+        # Hash of the setup and moves since clear_board, after each one
+        self._move_hashes = [""]
+        # Commands to reproduce the setup and moves since clear_board
+        self._move_commands = []
+        self._moves_known = True
+
+    def _add_event(self, event, command, args):
+        self._move_hashes.append(
+            hashlib.sha1(self._move_hashes[-1] + "\n" + event).hexdigest())
+        self._move_commands.append((command, args))
+
+    def is_known(self):
+        """Say whether the tracker knows the current state."""
+        return (self._moves_known and not self._board_size_lost and
+                not self._komi_lost)
+
+    def add_untrackable_commands(self, commands):
+        """Add to the commands which put the tracker in an unknown state.
+
+        commands -- iterable of command names
+
+        """
+        self.untrackable_commands = self.untrackable_commands.union(commands)
+
+    def get_state_key(self):
+        """Return a key identifying the current state.
+
+        Returns a hashable value, or None if the state isn't known.
+
+        The key is a tuple of strings, so it can safely be pickled.
+
+        """
+        if not self.is_known():
+            return None
+        return (self.board_size, self.komi, self._move_hashes[-1])
+
+    def get_replay_state(self):
+        """Return a description of the current state.
+
+        Returns a tuple (board_size, settings, move commands), or None if the
+        state isn't known.
+
+        board_size    -- string, or None
+        settings      -- dict setting name -> pair (command, args)
+        move commands -- list of pairs (command, args)
+
+        Sending the board_size (if any) to an engine, then the settings in any
+        order, then clear_board and the move commands, reproduces the state.
+
+        The caller may keep the returned value; later changes to the tracker
+        don't affect it.
+
+        """
+        if not self.is_known():
+            return None
+        return (self.board_size, self._settings.copy(),
+                self._move_commands[:])
+
+    def get_reset_state(self):
+        """Return the state which clear_board would produce.
+
+        Returns a tuple as for get_replay_state(), with no move commands.
+
+        This is available even if the current state isn't known (but then the
+        board size may be None, and the settings may not include komi, when
+        the engine has some other value).
+
+        """
+        return (self.board_size, self._settings.copy(), [])
+
+    def note_response(self, command, args, response):
+        """Update the state following a successful command.
+
+        command  -- string
+        args     -- list of strings
+        response -- string
+
+        """
+        if command == 'boardsize':
+            self.board_size = args[0] if args else None
+            self._board_size_lost = False
+            self._reset_moves()
+        elif command == 'clear_board':
+            self._reset_moves()
+        elif command == 'komi':
+            try:
+                self.komi = repr(float(args[0]))
+            except (IndexError, ValueError):
+                self._forget_komi()
+            else:
+                self._komi_lost = False
+                self._settings['komi'] = (command, list(args))
+        elif command == 'time_settings':
+            self._settings['time_settings'] = (command, list(args))
+        elif command == 'time_left':
+            if args:
+                self._settings['time_left ' + args[0][:1].lower()] = \
+                    (command, list(args))
+        elif command == 'play':
+            if len(args) < 2:
+                self._moves_known = False
+            else:
+                colour, vertex = args[0][:1].lower(), args[1].upper()
+                self._add_event("play %s %s" % (colour, vertex),
+                                'play', [colour, vertex])
+        elif command in ('genmove', 'gomill-genmove_ex'):
+            move = response.strip().upper()
+            if not args:
+                return
+            if move in ('RESIGN', 'CLAIM'):
+                return
+            colour = args[0][:1].lower()
+            self._add_event("play %s %s" % (colour, move),
+                            'play', [colour, move])
+        elif command == 'undo':
+            if len(self._move_hashes) > 1:
+                self._move_hashes.pop()
+                self._move_commands.pop()
+            else:
+                self._moves_known = False
+        elif command == 'fixed_handicap':
+            vertices = response.upper().split()
+            self._add_event("setup %s" % " ".join(vertices),
+                            command, list(args))
+        elif command == 'place_free_handicap':
+            vertices = response.upper().split()
+            self._add_event("setup %s" % " ".join(vertices),
+                            'set_free_handicap', vertices)
+        elif command == 'set_free_handicap':
+            vertices = [a.upper() for a in args]
+            self._add_event("setup %s" % " ".join(vertices),
+                            command, vertices)
+        elif command in self.untrackable_commands:
+            self._moves_known = False
+            self.board_size = None
+            self._board_size_lost = True
+            self._forget_komi()
+
+    def _forget_komi(self):
+        self.komi = None
+        self._komi_lost = True
+        self._settings.pop('komi', None)
+
+
+class Response_cache(object):
+    """Least-recently-used cache of GTP responses.
+
+    Instantiate with the maximum number of entries to keep.
+
+    Keys and responses must be picklable.
+
+    Public attributes (treat as read-only):
+      hits   -- int
+      misses -- int
+
+    """
+    # Compact the access log when it's this many times bigger than the cache
+    _log_slack = 4
+
+    def __init__(self, max_entries):
+        if max_entries < 1:
+            raise ValueError("max_entries must be positive")
+        self.max_entries = max_entries
+        # map key -> (response, access stamp)
+        self._entries = {}
+        # (key, access stamp) pairs, oldest first; entries whose stamp doesn't
+        # match _entries are stale
+        self._access_log = deque()
+        self._next_stamp = 0
+        self._is_changed = False
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _touch(self, key, response):
+        stamp = self._next_stamp
+        self._next_stamp += 1
+        self._entries[key] = (response, stamp)
+        self._access_log.append((key, stamp))
+        if len(self._access_log) > self._log_slack * self.max_entries:
+            self._access_log = deque(
+                (key, stamp) for (key, stamp) in self._access_log
+                if self._entries.get(key, (None, None))[1] == stamp)
+
+    def get(self, key):
+        """Return the cached response for 'key', or None."""
+        try:
+            response, _ = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touch(key, response)
+        return response
+
+    def put(self, key, response):
+        """Add a response to the cache, evicting the oldest if necessary."""
+        self._touch(key, response)
+        self._is_changed = True
+        while len(self._entries) > self.max_entries:
+            old_key, old_stamp = self._access_log.popleft()
+            if self._entries.get(old_key, (None, None))[1] == old_stamp:
+                del self._entries[old_key]
+
+    def _get_items(self):
+        """Return a list of (key, response) pairs, oldest first."""
+        return [(key, self._entries[key][0])
+                for (key, stamp) in self._access_log
+                if self._entries.get(key, (None, None))[1] == stamp]
+
+    def load(self, pathname):
+        """Add entries from a file written by save().
+
+        Entries already in the cache are considered more recent than the
+        loaded ones.
+
+        Silently does nothing if the file doesn't exist or can't be read.
+
+        """
+        try:
+            with open(pathname, "rb") as f:
+                items = pickle.load(f)
+            items = list(items)
+        except Exception:
+            return
+        current_items = self._get_items()
+        self._entries = {}
+        self._access_log = deque()
+        for key, response in items[-self.max_entries:] + current_items:
+            self.put(key, response)
+        self._is_changed = bool(current_items)
+
+    def save(self, pathname):
+        """Write the cache to a file.
+
+        Does nothing if nothing has been added since the cache was created or
+        loaded.
+
+        Propagates EnvironmentError.
+
+        """
+        if not self._is_changed:
+            return
+        temp_pathname = "%s.%d.new" % (pathname, os.getpid())
+        with open(temp_pathname, "wb") as f:
+            pickle.dump(self._get_items(), f, protocol=-1)
+        os.rename(temp_pathname, pathname)
+        self._is_changed = False
+
+
 class Gtp_proxy(object):
     """Manager for a GTP proxy engine.
 
@@ -63,10 +358,17 @@ class Gtp_proxy(object):
     If you want to hide one of the underlying commands, or don't want one of the
     additional commands, just use engine.remove_command().
 
+    See enable_response_cache() for caching responses to deterministic
+    commands.
+
     """
     def __init__(self):
         self.controller = None
         self.engine = None
+        self.response_cache = None
+        self.response_cache_pathname = None
+        self.cached_commands = frozenset()
+        self.state_tracker = None
 
     def _back_end_is_set(self):
         return self.controller is not None
@@ -126,6 +428,61 @@ class Gtp_proxy(object):
         controller = gtp_controller.Gtp_controller(channel, "back end")
         self.set_back_end_controller(controller)
 
+    def enable_response_cache(self, commands, max_entries=10000,
+                              pathname=None, untrackable_commands=()):
+        """Cache the back end's responses to deterministic commands.
+
+        commands             -- iterable of command names
+        max_entries          -- int
+        pathname             -- string (optional)
+        untrackable_commands -- iterable of command names (optional)
+
+        'commands' are the commands whose responses should be cached. They
+        must not change the back end's state, and their response must depend
+        only on the game state (for example reg_genmove, final_score, or an
+        engine-specific evaluation command).
+
+        Responses are keyed by the game state (as maintained by a
+        State_tracker watching the commands passed to the back end), the
+        command, and its arguments. Only success responses are cached. While
+        the game state is unknown (eg, after loadsgf), nothing is cached.
+
+        'untrackable_commands' are engine-specific commands which change the
+        game state in a way a State_tracker can't follow.
+
+        The cache keeps at most max_entries responses, discarding the least
+        recently used.
+
+        If 'pathname' is specified, any entries saved there by an earlier run
+        are loaded now, and close() saves the cache there. It's only
+        appropriate to share a file between runs with the same back end and
+        back end configuration.
+
+        """
+        self.response_cache = Response_cache(max_entries)
+        self.response_cache_pathname = pathname
+        self.cached_commands = frozenset(commands)
+        if self.state_tracker is None:
+            self.state_tracker = State_tracker(untrackable_commands)
+        else:
+            self.state_tracker.add_untrackable_commands(untrackable_commands)
+        if pathname is not None:
+            self.response_cache.load(pathname)
+
+    def save_response_cache(self):
+        """Write the response cache to its file.
+
+        Does nothing if no pathname was given to enable_response_cache(), or
+        if nothing new has been cached.
+
+        close() calls this automatically.
+
+        Propagates EnvironmentError.
+
+        """
+        if self.response_cache_pathname is not None:
+            self.response_cache.save(self.response_cache_pathname)
+
     def close(self):
         """Close the channel to the back end.
 
@@ -143,10 +500,16 @@ class Gtp_proxy(object):
         Errors (including failure responses to 'quit') are reported by raising
         BackEndError.
 
+        If there is a response cache with a pathname, this saves it; errors
+        doing so are propagated as EnvironmentError.
+
         """
         if self.controller is None:
             return
-        self.controller.safe_close()
+        try:
+            self.controller.safe_close()
+        finally:
+            self.save_response_cache()
         late_errors = self.controller.retrieve_error_messages()
         if late_errors:
             raise BackEndError("\n".join(late_errors))
@@ -187,13 +550,35 @@ class Gtp_proxy(object):
         Low-level (ie, transport or protocol) errors are reported by raising
         BackEndError.
 
+        If there is a response cache (see enable_response_cache()), a cached
+        response may be returned without sending the command.
+
         """
         if not self._back_end_is_set():
             raise StandardError("back end isn't set")
+        cache_key = None
+        if command in self.cached_commands:
+            state_key = self.state_tracker.get_state_key()
+            if state_key is not None:
+                cache_key = (state_key, command, tuple(args))
+                response = self.response_cache.get(cache_key)
+                if response is not None:
+                    return response
+        response = self._run_back_end_command(command, args)
+        if cache_key is not None:
+            self.response_cache.put(cache_key, response)
+        return response
+
+    def _run_back_end_command(self, command, args):
+        # Send a command to the back end and update the state tracker.
+        # Raises BadGtpResponse or BackEndError, as for pass_command().
         try:
-            return self.controller.do_command(command, *args)
+            response = self.controller.do_command(command, *args)
         except GtpChannelError, e:
             raise BackEndError(str(e), cause=e)
+        if self.state_tracker is not None:
+            self.state_tracker.note_response(command, args, response)
+        return response
 
     def handle_command(self, command, args):
         """Run a command on the back end, from inside a GTP handler.
@@ -260,3 +645,424 @@ class Gtp_proxy(object):
         except IndexError:
             gtp_engine.report_bad_arguments()
         return self.handle_command(command, args[1:])
+
+
+class _Back_end(object):
+    """A back end in a Back_end_pool.
+
+    Public attributes:
+      controller    -- Gtp_controller
+      replay_state  -- as for State_tracker.get_replay_state() (None if the
+                       back end's state isn't known)
+      is_busy       -- bool
+      commands_run  -- int
+
+    """
+    def __init__(self, controller):
+        self.controller = controller
+        self.replay_state = None
+        self.is_busy = False
+        self.commands_run = 0
+
+    def is_usable(self):
+        return not (self.controller.channel_is_bad or
+                    self.controller.channel_is_closed)
+
+    def get_sync_score(self, target):
+        """Say how little work is needed to sync this back end to 'target'.
+
+        Higher scores are better.
+
+        """
+        if self.replay_state is None or target is None:
+            return (False, -1)
+        if self.replay_state == target:
+            return (True, 0)
+        board_size, settings, moves = self.replay_state
+        if board_size != target[0]:
+            return (False, -1)
+        common = 0
+        for move, target_move in zip(moves, target[2]):
+            if move != target_move:
+                break
+            common += 1
+        return (False, common)
+
+
+class Back_end_pool(object):
+    """A pool of interchangeable back end engines.
+
+    The back ends should be identical engines, run with identical options.
+
+    A Load_balancing_gtp_proxy (or several of them, running sessions in
+    different threads) sends each command to whichever back end is free,
+    replaying the game so far to that back end first if necessary.
+
+    Public attributes (treat as read-only):
+      back_end_commands -- list of strings, from the first back end's
+                           list_commands (None until a back end is added)
+
+    Instances are safe to share between threads.
+
+    """
+    def __init__(self):
+        self.back_ends = []
+        self.back_end_commands = None
+        self._known_commands = {}
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.back_ends)
+
+    def add_back_end_controller(self, controller):
+        """Add a back end to the pool, using a Gtp_controller.
+
+        controller -- Gtp_controller
+
+        Raises BackEndError if it can't communicate with the back end.
+
+        """
+        try:
+            commands = controller.list_commands()
+        except (GtpChannelError, BadGtpResponse), e:
+            raise BackEndError(str(e), cause=e)
+        with self._condition:
+            if self.back_end_commands is None:
+                self.back_end_commands = commands
+            self.back_ends.append(_Back_end(controller))
+            self._condition.notify()
+
+    def add_back_end_subprocess(self, command, **kwargs):
+        """Add a back end to the pool, as a subprocess.
+
+        command -- list of strings (as for subprocess.Popen)
+
+        Additional keyword arguments are passed to the Subprocess_gtp_channel
+        constructor.
+
+        Raises BackEndError if it can't communicate with the back end.
+
+        """
+        try:
+            channel = gtp_controller.Subprocess_gtp_channel(command, **kwargs)
+        except GtpChannelError, e:
+            # Probably means exec failure
+            raise BackEndError("can't launch back end command\n%s" % e, cause=e)
+        controller = gtp_controller.Gtp_controller(
+            channel, "back end %d" % (len(self.back_ends) + 1))
+        self.add_back_end_controller(controller)
+
+    def acquire(self, target=None):
+        """Reserve a back end for the caller's exclusive use.
+
+        target -- game state, as for State_tracker.get_replay_state()
+
+        Returns a _Back_end.
+
+        Chooses an idle back end, preferring one which already has (or is
+        nearest to) the 'target' state, then the one which has run fewest
+        commands. Waits if all the back ends are busy.
+
+        Raises BackEndError if there are no usable back ends.
+
+        """
+        with self._condition:
+            while True:
+                usable = [back_end for back_end in self.back_ends
+                          if back_end.is_usable()]
+                if not usable:
+                    raise BackEndError("no usable back ends")
+                idle = [back_end for back_end in usable
+                        if not back_end.is_busy]
+                if idle:
+                    break
+                self._condition.wait()
+            back_end = max(idle, key=lambda back_end: (
+                back_end.get_sync_score(target), -back_end.commands_run))
+            back_end.is_busy = True
+            return back_end
+
+    def release(self, back_end):
+        """Return a back end reserved using acquire()."""
+        with self._condition:
+            back_end.is_busy = False
+            self._condition.notify()
+
+    def sync(self, back_end, target, reset_command=None):
+        """Bring a reserved back end to the specified game state.
+
+        back_end      -- _Back_end from acquire()
+        target        -- game state, as for State_tracker.get_replay_state()
+        reset_command -- 'boardsize', 'clear_board', or None
+
+        If reset_command is specified, the caller is about to send that
+        command, so the moves aren't replayed: this brings the settings up to
+        date and, before clear_board, sends boardsize if the back end's board
+        size may differ from the target's. The back end's state is left
+        unknown.
+
+        If the back end already has the same board size and has played the
+        start of the same game, this sends only the commands needed to bring
+        it up to date (using 'undo' to take back moves where possible).
+        Otherwise it sends boardsize (if the target has one), the settings,
+        clear_board, and the moves.
+
+        Raises BackEndError if the back end rejects any of the commands, or
+        there is a low-level error.
+
+        """
+        if back_end.replay_state == target:
+            return
+        board_size, settings, moves = target
+        current = back_end.replay_state
+        if reset_command is not None:
+            commands = []
+            if current is None:
+                current_size, current_settings = None, {}
+            else:
+                current_size, current_settings = current[:2]
+            if (reset_command == 'clear_board' and board_size is not None and
+                current_size != board_size):
+                commands.append(('boardsize', [board_size]))
+            commands += [settings[name] for name in sorted(settings)
+                         if current_settings.get(name) != settings[name]]
+            target = None
+        elif current is None or (board_size is not None and
+                               current[0] != board_size):
+            commands = []
+            if board_size is not None:
+                commands.append(('boardsize', [board_size]))
+            commands += [settings[name] for name in sorted(settings)]
+            commands.append(('clear_board', []))
+            commands += moves
+        else:
+            current_settings, current_moves = current[1:]
+            commands = [settings[name] for name in sorted(settings)
+                        if current_settings.get(name) != settings[name]]
+            common = 0
+            for move, target_move in zip(current_moves, moves):
+                if move != target_move:
+                    break
+                common += 1
+            to_take_back = current_moves[common:]
+            if to_take_back:
+                if (all(command == 'play' for (command, _) in to_take_back)
+                    and self.known_command('undo', back_end)):
+                    commands += [('undo', [])] * len(to_take_back)
+                else:
+                    commands.append(('clear_board', []))
+                    common = 0
+            commands += moves[common:]
+        back_end.replay_state = None
+        for command, args in commands:
+            try:
+                back_end.controller.do_command(command, *args)
+            except BadGtpResponse, e:
+                raise BackEndError(
+                    "error bringing back end up to date:\n%s" % e, cause=e)
+            except GtpChannelError, e:
+                raise BackEndError(str(e), cause=e)
+            back_end.commands_run += 1
+        back_end.replay_state = target
+
+    def known_command(self, command, back_end=None):
+        """Say whether the back ends support the specified command.
+
+        back_end -- _Back_end reserved by the caller (optional)
+
+        This uses known_command, not list_commands. It caches the results.
+
+        If the caller already has a back end reserved, it must pass it as
+        'back_end'.
+
+        Low-level (ie, transport or protocol) errors are reported by raising
+        BackEndError.
+
+        """
+        with self._condition:
+            try:
+                return self._known_commands[command]
+            except KeyError:
+                pass
+        if back_end is None:
+            to_use = self.acquire()
+        else:
+            to_use = back_end
+        try:
+            try:
+                result = to_use.controller.known_command(command)
+            except GtpChannelError, e:
+                raise BackEndError(str(e), cause=e)
+        finally:
+            if back_end is None:
+                self.release(to_use)
+        with self._condition:
+            self._known_commands[command] = result
+        return result
+
+    def close(self):
+        """Close the channels to all the back ends.
+
+        Don't call this while any sessions are using the pool.
+
+        Errors (including failure responses to 'quit') are reported by raising
+        BackEndError, after all the back ends have been closed.
+
+        """
+        late_errors = []
+        for back_end in self.back_ends:
+            back_end.controller.safe_close()
+            late_errors += back_end.controller.retrieve_error_messages()
+        if late_errors:
+            raise BackEndError("\n".join(late_errors))
+
+
+class Load_balancing_gtp_proxy(Gtp_proxy):
+    """Manager for a GTP proxy engine with a pool of back ends.
+
+    Public attributes:
+      engine          -- Gtp_engine_protocol
+      back_end_pool   -- Back_end_pool
+      state_tracker   -- State_tracker
+
+    This is a Gtp_proxy which sends each command to whichever back end in a
+    Back_end_pool is free, rather than to a single back end. The pool may be
+    shared between several proxies, each running its own GTP session (for
+    example, proxies returned by the engine factory passed to
+    gtp_engine.serve_concurrent_gtp_sessions(), which calls close() when
+    each session ends).
+
+    The proxy tracks the session's game state (see State_tracker). Before
+    sending a command to a back end, it replays whatever commands are needed to
+    give that back end the same state. While the state is unknown (eg, after
+    loadsgf, until boardsize and komi have been sent), the session keeps using
+    the same back end (close() releases it); if that back end fails, commands
+    other than boardsize and clear_board are rejected with BackEndError.
+
+    The back ends' state isn't reset between sessions, so sessions should set
+    the board size and komi, as controllers normally do.
+
+    The default 'quit' handler ends the session without sending 'quit' to the
+    back ends; close the pool itself when all the sessions have finished.
+
+    Sample use:
+      pool = gtp_proxy.Back_end_pool()
+      for i in range(4):
+          pool.add_back_end_subprocess([<command>, <arg>, ...])
+      proxy = gtp_proxy.Load_balancing_gtp_proxy()
+      proxy.set_back_end_pool(pool)
+      try:
+          proxy.run()
+      finally:
+          pool.close()
+
+    """
+    def __init__(self):
+        Gtp_proxy.__init__(self)
+        self.back_end_pool = None
+        self._pinned_back_end = None
+
+    def _back_end_is_set(self):
+        return self.back_end_pool is not None
+
+    def set_back_end_pool(self, pool, untrackable_commands=()):
+        """Specify the pool of back ends.
+
+        pool                 -- Back_end_pool
+        untrackable_commands -- iterable of command names (optional)
+
+        The pool must already contain at least one back end.
+
+        'untrackable_commands' are engine-specific commands which change the
+        game state in a way a State_tracker can't follow; after one of these,
+        the session keeps using the same back end until boardsize and komi
+        have both been sent.
+
+        """
+        if self._back_end_is_set():
+            raise StandardError("back end already set")
+        if not pool.back_ends:
+            raise ValueError("back end pool is empty")
+        self.back_end_pool = pool
+        self.back_end_commands = pool.back_end_commands
+        if self.state_tracker is None:
+            self.state_tracker = State_tracker(untrackable_commands)
+        else:
+            self.state_tracker.add_untrackable_commands(untrackable_commands)
+        self._make_engine()
+
+    def _run_back_end_command(self, command, args):
+        pool = self.back_end_pool
+        back_end = self._pinned_back_end
+        if back_end is None:
+            if command in ('boardsize', 'clear_board'):
+                reset_command = command
+                target = self.state_tracker.get_reset_state()
+            else:
+                reset_command = None
+                target = self.state_tracker.get_replay_state()
+                if target is None:
+                    # The back end this session was keeping has gone away
+                    raise BackEndError(
+                        "game state lost with its back end; "
+                        "send boardsize or clear_board")
+            back_end = pool.acquire(target)
+        try:
+            if self._pinned_back_end is None:
+                pool.sync(back_end, target, reset_command)
+            try:
+                response = back_end.controller.do_command(command, *args)
+            except GtpChannelError, e:
+                raise BackEndError(str(e), cause=e)
+            finally:
+                back_end.commands_run += 1
+            self.state_tracker.note_response(command, args, response)
+            back_end.replay_state = self.state_tracker.get_replay_state()
+        finally:
+            if self.state_tracker.is_known() or not back_end.is_usable():
+                self._pinned_back_end = None
+                pool.release(back_end)
+            else:
+                self._pinned_back_end = back_end
+        return response
+
+    def release_back_end(self):
+        """Release any back end the session is keeping.
+
+        close() calls this automatically.
+
+        """
+        if self._pinned_back_end is not None:
+            # The session only keeps a back end whose state isn't known
+            self._pinned_back_end.replay_state = None
+            self.back_end_pool.release(self._pinned_back_end)
+            self._pinned_back_end = None
+
+    def close(self):
+        """Release any back end this session is using.
+
+        This doesn't close the back ends (use Back_end_pool.close()).
+
+        If there is a response cache with a pathname, this saves it; errors
+        doing so are propagated as EnvironmentError.
+
+        """
+        if self.back_end_pool is None:
+            return
+        try:
+            self.release_back_end()
+        finally:
+            self.save_response_cache()
+
+    def back_end_has_command(self, command):
+        if not self._back_end_is_set():
+            raise StandardError("back end isn't set")
+        return self.back_end_pool.known_command(command,
+                                                self._pinned_back_end)
+
+    def expect_back_end_exit(self):
+        raise StandardError("load-balancing proxy can't expect back end exit")
+
+    def handle_quit(self, args):
+        self.release_back_end()
+        raise GtpQuit
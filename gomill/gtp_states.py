@@ -53,12 +53,14 @@ class Game_state(object):
       komi                      -- float
       history_base              -- boards.Board
       move_history              -- list of History_move objects
+      position_hashes           -- list of ints
       ko_point                  -- (row, col) or None
       handicap                  -- int >= 2 or None
       for_regression            -- bool
       time_settings             -- tuple (m, b, s), or None
       time_remaining            -- int (seconds), or None
       canadian_stones_remaining -- int or None
+      ponder_result             -- arbitrary value, or None
 
     'board' represents the current board position.
 
@@ -72,10 +74,17 @@ class Game_state(object):
     The get_last_move() and get_last_move_and_cookie() functions below are
     provided to help interpret move history.
 
+    position_hashes has one more entry than move_history: position_hashes[i]
+    is the Zobrist hash (see boards.Board.zobrist_hash()) of the position after
+    the first i moves in move_history. So the first entry is the hash of
+    history_base and the last is the hash of 'board'.
+
 
     ko_point is the point forbidden by the simple ko rule. This is provided for
     convenience for engines which don't want to deduce it from the move history.
-    To handle superko properly, engines will have to use the move history.
+    To handle superko properly, engines will have to use the move history; they
+    can check whether a move would repeat an earlier position by comparing
+    board.hash_after_move() with the entries in position_hashes.
 
 
     'handicap' is provided in case the engine wants to modify its behaviour in
@@ -103,6 +112,13 @@ class Game_state(object):
     possible for time_remaining to be available but not time_settings (if the
     controller doesn't send time_settings).
 
+
+    ponder_result is the value returned by the ponderer (see
+    Gtp_state.set_ponderer()), if the engine pondered while the opponent was
+    choosing the move which led to this position. It's None otherwise. When
+    the ponderer itself is called, ponder_result is the value it returned
+    when it was last interrupted in the same position (or None).
+
     """
 
 class Move_generator_result(object):
@@ -163,6 +179,11 @@ class Gtp_state(object):
     If the move generator returns an occupied point, Gtp_state will report a GTP
     error. Gtp_state does not enforce any ko rule. It permits self-captures.
 
+    The board keeps an undo log (see boards.Board.undo()), so 'undo' doesn't
+    need to replay the game.
+
+    Gtp_state can also support pondering: see set_ponderer().
+
     """
 
     def __init__(self, move_generator, acceptable_sizes=None):
@@ -173,6 +194,7 @@ class Gtp_state(object):
             'w' : (None, None),
             }
         self.move_generator = move_generator
+        self.ponderer = None
         if acceptable_sizes is None:
             self.acceptable_sizes = set((19,))
             self.board_size = 19
@@ -183,6 +205,7 @@ class Gtp_state(object):
 
     def reset(self):
         self.board = boards.Board(self.board_size)
+        self.board.start_undo_log()
         # None, or a small integer
         self.handicap = None
         self.simple_ko_point = None
@@ -191,6 +214,76 @@ class Gtp_state(object):
         self.history_base = boards.Board(self.board_size)
         # list of History_move objects
         self.move_history = []
+        # Zobrist hashes of history_base and the position after each move
+        self.position_hashes = [self.history_base.zobrist_hash()]
+        # (simple_ko_point, simple_ko_player) from before each move
+        self.ko_history = []
+        # (colour to play, len(move_history), position hash) after our last
+        # genmove, or None
+        self._ponder_position = None
+        # Value from the ponderer for _ponder_position, or None
+        self._ponder_result = None
+
+    def set_ponderer(self, ponderer):
+        """Specify a function to think during the opponent's turn.
+
+        ponderer -- function, or None
+
+        The ponderer is called (by ponder()) while the engine is waiting for
+        the opponent to reply to a move it generated. It is passed arguments
+        (game_state, colour to play, cancellation token), where the colour is
+        the opponent's. It must not modify data passed in the game_state.
+
+        It should check the token (see gtp_engine.Cancellation_token)
+        frequently, and once it's cancelled return a value describing the work
+        it has done (typically, a dict mapping the opponent's possible moves to
+        information for the move generator). If the next genmove follows a
+        single move by the opponent from the pondered position, this value is
+        passed to the move generator as game_state.ponder_result.
+
+        """
+        self.ponderer = ponderer
+        self._ponder_result = None
+
+    def ponder(self, token):
+        """Ponder handler for gtp_engine.Gtp_engine_protocol.
+
+        Use this with the engine's set_ponder_handler().
+
+        Calls the ponderer (see set_ponderer()) if the last move was generated
+        by this engine and nothing has changed since; otherwise returns at
+        once.
+
+        """
+        if self.ponderer is None or self._ponder_position is None:
+            return
+        colour, move_count, position_hash = self._ponder_position
+        if (len(self.move_history) != move_count or
+            self.position_hashes[-1] != position_hash):
+            return
+        game_state = self._make_game_state(colour)
+        game_state.ponder_result = self._ponder_result
+        self._ponder_result = self.ponderer(game_state, colour, token)
+
+    def _take_ponder_result(self, colour):
+        """Return the ponder result which applies to a genmove for 'colour'.
+
+        Forgets the ponder result.
+
+        """
+        ponder_position = self._ponder_position
+        ponder_result = self._ponder_result
+        self._ponder_position = None
+        self._ponder_result = None
+        if ponder_position is None:
+            return None
+        opponent, move_count, position_hash = ponder_position
+        if (opponent == opponent_of(colour) and
+            len(self.move_history) == move_count + 1 and
+            self.move_history[-1].colour == opponent and
+            self.position_hashes[move_count] == position_hash):
+            return ponder_result
+        return None
 
     def set_history_base(self, board):
         """Change the history base to a new position.
@@ -202,6 +295,8 @@ class Gtp_state(object):
         """
         self.history_base = board
         self.move_history = []
+        self.position_hashes = [board.zobrist_hash()]
+        self.ko_history = []
 
     def reset_to_moves(self, history_moves):
         """Reset to history base and play the specified moves.
@@ -215,19 +310,27 @@ class Gtp_state(object):
 
         """
         self.board = self.history_base.copy()
+        self.board.start_undo_log()
         simple_ko_point = None
         simple_ko_player = None
+        position_hashes = [self.board.zobrist_hash()]
+        ko_history = []
         for history_move in history_moves:
+            ko_history.append((simple_ko_point, simple_ko_player))
             if history_move.is_pass():
-                self.simple_ko_point = None
+                simple_ko_point = None
+                position_hashes.append(position_hashes[-1])
                 continue
             row, col = history_move.move
             # Propagates ValueError if the move is bad
             simple_ko_point = self.board.play(row, col, history_move.colour)
             simple_ko_player = opponent_of(history_move.colour)
+            position_hashes.append(self.board.zobrist_hash())
         self.simple_ko_point = simple_ko_point
         self.simple_ko_player = simple_ko_player
         self.move_history = history_moves
+        self.position_hashes = position_hashes
+        self.ko_history = ko_history
 
     def set_komi(self, f):
         max_komi = 625.0
@@ -346,9 +449,12 @@ class Gtp_state(object):
             gtp_engine.report_bad_arguments()
         colour = gtp_engine.interpret_colour(colour_s)
         move = gtp_engine.interpret_vertex(vertex_s, self.board_size)
+        previous_ko = (self.simple_ko_point, self.simple_ko_player)
         if move is None:
             self.simple_ko_point = None
             self.move_history.append(History_move(colour, None))
+            self.position_hashes.append(self.position_hashes[-1])
+            self.ko_history.append(previous_ko)
             return
         row, col = move
         try:
@@ -357,21 +463,20 @@ class Gtp_state(object):
         except ValueError:
             raise GtpError("illegal move")
         self.move_history.append(History_move(colour, move))
+        self.ko_history.append(previous_ko)
+        self.position_hashes.append(self.board.zobrist_hash())
 
     def handle_showboard(self, args):
         return "\n%s\n" % ascii_boards.render_board(self.board)
 
-    def _handle_genmove(self, args, for_regression=False, allow_claim=False):
-        """Common implementation for genmove commands."""
-        try:
-            colour = gtp_engine.interpret_colour(args[0])
-        except IndexError:
-            gtp_engine.report_bad_arguments()
+    def _make_game_state(self, colour, for_regression=False):
+        """Return a Game_state for the specified colour to play."""
         game_state = Game_state()
         game_state.size = self.board_size
         game_state.board = self.board
         game_state.history_base = self.history_base
         game_state.move_history = self.move_history
+        game_state.position_hashes = self.position_hashes
         game_state.komi = self.komi
         game_state.for_regression = for_regression
         if self.simple_ko_point is not None and self.simple_ko_player == colour:
@@ -382,15 +487,35 @@ class Gtp_state(object):
         game_state.time_settings = self.time_settings
         game_state.time_remaining, game_state.canadian_stones_remaining = \
             self.time_status[colour]
+        game_state.ponder_result = None
+        return game_state
+
+    def _handle_genmove(self, args, for_regression=False, allow_claim=False):
+        """Common implementation for genmove commands."""
+        try:
+            colour = gtp_engine.interpret_colour(args[0])
+        except IndexError:
+            gtp_engine.report_bad_arguments()
+        game_state = self._make_game_state(colour, for_regression)
+        if for_regression:
+            ponder_result = None
+        else:
+            ponder_result = self._take_ponder_result(colour)
+        game_state.ponder_result = ponder_result
         generated = self.move_generator(game_state, colour)
         if allow_claim and generated.claim:
             return 'claim'
         if generated.resign:
             return 'resign'
+        previous_ko = (self.simple_ko_point, self.simple_ko_player)
         if generated.pass_move:
             if not for_regression:
+                self.simple_ko_point = None
                 self.move_history.append(History_move(
                     colour, None, generated.comments, generated.cookie))
+                self.position_hashes.append(self.position_hashes[-1])
+                self.ko_history.append(previous_ko)
+                self._set_ponder_position(colour)
             return 'pass'
         row, col = generated.move
         vertex = format_vertex((row, col))
@@ -403,8 +528,17 @@ class Gtp_state(object):
             self.move_history.append(
                 History_move(colour, generated.move,
                              generated.comments, generated.cookie))
+            self.position_hashes.append(self.board.zobrist_hash())
+            self.ko_history.append(previous_ko)
+            self._set_ponder_position(colour)
         return vertex
 
+    def _set_ponder_position(self, colour):
+        """Record that the engine has just played a move for 'colour'."""
+        self._ponder_position = (opponent_of(colour), len(self.move_history),
+                                 self.position_hashes[-1])
+        self._ponder_result = None
+
     def handle_genmove(self, args):
         return self._handle_genmove(args)
 
@@ -423,10 +557,11 @@ class Gtp_state(object):
     def handle_undo(self, args):
         if not self.move_history:
             raise GtpError("cannot undo")
-        try:
-            self.reset_to_moves(self.move_history[:-1])
-        except ValueError:
-            raise GtpError("corrupt history")
+        history_move = self.move_history.pop()
+        self.position_hashes.pop()
+        self.simple_ko_point, self.simple_ko_player = self.ko_history.pop()
+        if not history_move.is_pass():
+            self.board.undo()
 
     def _load_file(self, pathname):
         """Read the specified file and return its contents as a string.
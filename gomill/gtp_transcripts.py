@@ -0,0 +1,280 @@
+"""Recording and replaying GTP sessions.
+
+A transcript is the sequence of commands sent to a GTP engine, together with
+the engine's responses and how long each response took to arrive.
+
+Use Gtp_channel.enable_recording() to record a transcript, and
+Replay_gtp_channel or make_replay_engine() to play it back.
+
+"""
+
+import time
+
+from gomill import gtp_engine
+from gomill.gtp_controller import (
+    Gtp_channel, GtpChannelError, GtpChannelClosed)
+from gomill.gtp_engine import GtpError, GtpFatalError, GtpQuit
+
+
+class Gtp_transcript(object):
+    """A recorded GTP session.
+
+    Public attributes:
+      exchanges -- list of tuples
+                   (command, arguments, is_failure, response, elapsed)
+
+    command    -- string
+    arguments  -- list of strings
+    is_failure -- bool
+    response   -- string, as returned by Gtp_channel.get_response()
+    elapsed    -- float (seconds between sending the command and reading the
+                  response)
+
+    The text format (see serialise()) has a pair of lines for each exchange:
+      >> <command> [args] ...
+      << <elapsed> = <response>
+    using '?' instead of '=' for failure responses. Any further lines of a
+    multi-line response follow, each prefixed with '.. '.
+
+    """
+    def __init__(self):
+        self.exchanges = []
+
+    def add_exchange(self, command, arguments, is_failure, response, elapsed):
+        """Add an exchange to the end of the transcript."""
+        self.exchanges.append(
+            (command, list(arguments), bool(is_failure), response, elapsed))
+
+    def get_total_elapsed(self):
+        """Return the total of the recorded response times, in seconds."""
+        return sum(exchange[4] for exchange in self.exchanges)
+
+    def serialise(self):
+        """Return the transcript in text format.
+
+        Returns an 8-bit string.
+
+        """
+        lines = []
+        for command, arguments, is_failure, response, elapsed in \
+                self.exchanges:
+            lines.append(">> " + " ".join([command] + arguments))
+            response_lines = response.split("\n")
+            lines.append(("<< %.6f %s %s" % (
+                elapsed, "?" if is_failure else "=", response_lines[0])
+                          ).rstrip())
+            for line in response_lines[1:]:
+                lines.append(".. " + line)
+        return "".join(line + "\n" for line in lines)
+
+    @classmethod
+    def from_string(cls, s):
+        """Read a transcript in text format.
+
+        s -- 8-bit string
+
+        Blank lines, and lines beginning with '#', are ignored.
+
+        Raises ValueError if the text isn't a well-formed transcript.
+
+        """
+        result = cls()
+        command = None
+        for line_number, line in enumerate(s.split("\n")):
+            line = line.rstrip("\r")
+            try:
+                if line.strip() == "" or line.startswith("#"):
+                    continue
+                marker = line[:3]
+                if marker == ">> ":
+                    if command is not None:
+                        raise ValueError("missing response")
+                    words = line[3:].split()
+                    if not words:
+                        raise ValueError("missing command")
+                    command, arguments = words[0], words[1:]
+                elif marker == "<< ":
+                    if command is None:
+                        raise ValueError("response without command")
+                    fields = line[3:].split(" ", 2)
+                    if len(fields) < 2:
+                        raise ValueError("ill-formed response line")
+                    try:
+                        elapsed = float(fields[0])
+                    except ValueError:
+                        raise ValueError("bad time")
+                    if not elapsed >= 0:
+                        raise ValueError("bad time")
+                    if fields[1] not in ("=", "?"):
+                        raise ValueError("bad response indicator")
+                    if len(fields) == 3:
+                        response = fields[2]
+                    else:
+                        response = ""
+                    result.add_exchange(command, arguments, fields[1] == "?",
+                                        response, elapsed)
+                    command = None
+                elif marker == ".. " or line == "..":
+                    if command is not None or not result.exchanges:
+                        raise ValueError("continuation without response")
+                    (command_, arguments, is_failure,
+                     response, elapsed) = result.exchanges[-1]
+                    result.exchanges[-1] = (
+                        command_, arguments, is_failure,
+                        response + "\n" + line[3:], elapsed)
+                else:
+                    raise ValueError("unexpected line")
+            except ValueError, e:
+                raise ValueError("line %d: %s" % (line_number+1, e))
+        if command is not None:
+            raise ValueError("missing response at end of transcript")
+        return result
+
+
+class TranscriptMismatch(StandardError):
+    """A command didn't match the next exchange in a transcript."""
+
+class Transcript_player(object):
+    """Serve the exchanges from a transcript in order.
+
+    Instantiate with a Gtp_transcript.
+
+    Public attributes (treat as read-only):
+      transcript -- Gtp_transcript
+      position   -- index of the next exchange to be served
+
+    """
+    def __init__(self, transcript):
+        self.transcript = transcript
+        self.position = 0
+
+    def is_exhausted(self):
+        """Check whether all the exchanges have been served."""
+        return self.position >= len(self.transcript.exchanges)
+
+    def next_exchange(self, command, arguments):
+        """Return the next exchange, which must be for the specified command.
+
+        command   -- string
+        arguments -- list of strings
+
+        Returns a tuple (is_failure, response, elapsed)
+
+        Raises TranscriptMismatch if the command or its arguments differ from
+        the recorded ones, or if the transcript is exhausted.
+
+        """
+        if self.is_exhausted():
+            raise TranscriptMismatch("end of transcript")
+        (expected_command, expected_arguments,
+         is_failure, response, elapsed) = \
+            self.transcript.exchanges[self.position]
+        if (command != expected_command or
+            list(arguments) != expected_arguments):
+            raise TranscriptMismatch(
+                "exchange %d: expected '%s', received '%s'" % (
+                self.position + 1,
+                " ".join([expected_command] + expected_arguments),
+                " ".join([command] + list(arguments))))
+        self.position += 1
+        return is_failure, response, elapsed
+
+
+class Replay_gtp_channel(Gtp_channel):
+    """A GTP channel which replays the responses from a transcript.
+
+    Instantiate with
+      transcript -- Gtp_transcript
+      speed      -- float (optional)
+
+    The commands sent must be the same as those in the transcript, in the same
+    order; if they aren't, send_command() raises GtpChannelError.
+
+    If speed is None, responses are available immediately. Otherwise each
+    response is delayed until (recorded time / speed) has passed since its
+    command was sent (so 1.0 replays at the recorded speed).
+
+    Once the last exchange has been replayed, the channel behaves as if the
+    engine had closed it.
+
+    Public attributes:
+      player -- Transcript_player
+
+    """
+    def __init__(self, transcript, speed=None):
+        Gtp_channel.__init__(self)
+        if speed is not None and speed <= 0:
+            raise ValueError("speed must be positive")
+        self.player = Transcript_player(transcript)
+        self.speed = speed
+        self.outstanding_responses = []
+
+    def send_command_impl(self, command, arguments):
+        if self.player.is_exhausted():
+            raise GtpChannelClosed("engine has ended the session")
+        try:
+            is_failure, response, elapsed = \
+                self.player.next_exchange(command, arguments)
+        except TranscriptMismatch, e:
+            raise GtpChannelError("transcript mismatch: %s" % e)
+        if self.speed is None:
+            due = None
+        else:
+            due = time.time() + elapsed / self.speed
+        self.outstanding_responses.append((is_failure, response, due))
+
+    def get_response_impl(self):
+        try:
+            is_failure, response, due = self.outstanding_responses.pop(0)
+        except IndexError:
+            if self.player.is_exhausted():
+                raise GtpChannelClosed("engine has ended the session")
+            raise GtpChannelError("no outstanding commands")
+        if due is not None:
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        return is_failure, response
+
+
+def make_replay_engine(transcript, speed=None):
+    """Return a GTP engine which replays the responses from a transcript.
+
+    transcript -- Gtp_transcript
+    speed      -- float (optional)
+
+    Returns a Gtp_engine_protocol.
+
+    The engine has a handler for each command which appears in the transcript.
+    Commands must arrive in the recorded order; any other command is a fatal
+    error. The engine ends the session after replaying 'quit', or the last
+    exchange in the transcript.
+
+    If speed is None, responses are sent immediately. Otherwise each response
+    is delayed by (recorded time / speed).
+
+    """
+    if speed is not None and speed <= 0:
+        raise ValueError("speed must be positive")
+    player = Transcript_player(transcript)
+    def make_handler(command):
+        def handler(args):
+            try:
+                is_failure, response, elapsed = \
+                    player.next_exchange(command, args)
+            except TranscriptMismatch, e:
+                raise GtpFatalError("transcript mismatch: %s" % e)
+            if speed is not None:
+                time.sleep(elapsed / speed)
+            if command == "quit" or player.is_exhausted():
+                if is_failure:
+                    raise GtpFatalError(response)
+                raise GtpQuit(response)
+            if is_failure:
+                raise GtpError(response)
+            return response
+        return handler
+    engine = gtp_engine.Gtp_engine_protocol()
+    for command in set(exchange[0] for exchange in transcript.exchanges):
+        engine.add_command(command, make_handler(command))
+    return engine
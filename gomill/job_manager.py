@@ -1,6 +1,8 @@
 """Job system supporting multiprocessing."""
 
 import sys
+import threading
+import Queue
 
 from gomill import compact_tracebacks
 
@@ -33,26 +35,93 @@ class Worker_finish_signal(object):
     pass
 worker_finish_signal = Worker_finish_signal()
 
-def worker_run_jobs(job_queue, response_queue, worker_id):
+def _run_job(job, worker_id):
+    """Run a job, returning its response or a JobError."""
+    try:
+        return job.run(worker_id)
+    except JobFailed, e:
+        response = JobError(job, str(e))
+        sys.exc_clear()
+        del e
+    except Exception:
+        response = JobError(
+            job, compact_tracebacks.format_traceback(skip=1))
+        sys.exc_clear()
+    return response
+
+def _prelaunch_job(job, worker_id):
+    """Call a job's prelaunch() method, if it has one.
+
+    Returns None, or a JobError if prelaunch() raised an exception.
+
+    """
+    prelaunch = getattr(job, 'prelaunch', None)
+    if prelaunch is None:
+        return None
+    try:
+        prelaunch(worker_id)
+    except JobFailed, e:
+        response = JobError(job, str(e))
+        sys.exc_clear()
+        del e
+        return response
+    except Exception:
+        response = JobError(
+            job, compact_tracebacks.format_traceback(skip=1))
+        sys.exc_clear()
+        return response
+    return None
+
+class Job_prelauncher(threading.Thread):
+    """Thread which fetches a worker's next job and prelaunches it.
+
+    get_job -- callable returning the job (or a Worker_finish_signal)
+
+    After join(), 'job' is the job and 'error' is None or a JobError from
+    prelaunch().
+
+    """
+    def __init__(self, get_job, worker_id):
+        threading.Thread.__init__(self)
+        # So that an interrupted worker doesn't wait for its next job
+        self.daemon = True
+        self.get_job = get_job
+        self.worker_id = worker_id
+        self.job = None
+        self.error = None
+
+    def run(self):
+        self.job = self.get_job()
+        if not isinstance(self.job, Worker_finish_signal):
+            self.error = _prelaunch_job(self.job, self.worker_id)
+
+def _run_worker_jobs(job_queue, response_queue, worker_id, prelaunch):
+    """Run jobs from the job queue until told to finish.
+
+    If prelaunch is true, the next job is taken from the queue while each job
+    is running, and its prelaunch() method is called in a separate thread.
+
+    """
+    job = job_queue.get()
+    while not isinstance(job, Worker_finish_signal):
+        if prelaunch:
+            prelauncher = Job_prelauncher(job_queue.get, worker_id)
+            prelauncher.start()
+        response_queue.put(_run_job(job, worker_id))
+        if prelaunch:
+            prelauncher.join()
+            job = prelauncher.job
+            if prelauncher.error is not None:
+                response_queue.put(prelauncher.error)
+                job = job_queue.get()
+        else:
+            job = job_queue.get()
+
+def worker_run_jobs(job_queue, response_queue, worker_id, prelaunch=False):
     try:
         #pid = os.getpid()
         #sys.stderr.write("worker %d starting\n" % pid)
-        while True:
-            job = job_queue.get()
-            #sys.stderr.write("worker %d: %s\n" % (pid, repr(job)))
-            if isinstance(job, Worker_finish_signal):
-                break
-            try:
-                response = job.run(worker_id)
-            except JobFailed, e:
-                response = JobError(job, str(e))
-                sys.exc_clear()
-                del e
-            except Exception:
-                response = JobError(
-                    job, compact_tracebacks.format_traceback(skip=1))
-                sys.exc_clear()
-            response_queue.put(response)
+        _run_worker_jobs(job_queue, response_queue, worker_id, prelaunch)
         #sys.stderr.write("worker %d finishing\n" % pid)
         response_queue.cancel_join_thread()
     # Unfortunately, there will be places in the child that this doesn't cover.
@@ -60,6 +129,9 @@ def worker_run_jobs(job_queue, response_queue, worker_id):
     except KeyboardInterrupt:
         sys.exit(3)
 
+def thread_run_jobs(job_queue, response_queue, worker_id, prelaunch=False):
+    _run_worker_jobs(job_queue, response_queue, worker_id, prelaunch)
+
 class Job_manager(object):
     def __init__(self):
         self.passed_exceptions = []
@@ -67,32 +139,31 @@ class Job_manager(object):
     def pass_exception(self, cls):
         self.passed_exceptions.append(cls)
 
-class Multiprocessing_job_manager(Job_manager):
-    def __init__(self, number_of_workers):
+class Worker_job_manager(Job_manager):
+    """Common implementation for job managers with a pool of workers.
+
+    Subclasses must implement start_workers(), which sets job_queue,
+    response_queue, and workers (a list of objects with a join() method).
+
+    If prelaunch is true, each worker is given its next job while the current
+    one is running (see run_jobs()).
+
+    """
+    def __init__(self, number_of_workers, prelaunch=False):
         Job_manager.__init__(self)
-        _initialise_multiprocessing()
-        if multiprocessing is None:
-            raise StandardError("multiprocessing not available")
         if not 1 <= number_of_workers < 1024:
             raise ValueError
         self.number_of_workers = number_of_workers
-
-    def start_workers(self):
-        self.job_queue = multiprocessing.Queue()
-        self.response_queue = multiprocessing.Queue()
-        self.workers = []
-        for i in range(self.number_of_workers):
-            worker = multiprocessing.Process(
-                target=worker_run_jobs,
-                args=(self.job_queue, self.response_queue, i))
-            self.workers.append(worker)
-        for worker in self.workers:
-            worker.start()
+        self.prelaunch = prelaunch
 
     def run_jobs(self, job_source):
+        if self.prelaunch:
+            max_active_jobs = 2 * self.number_of_workers
+        else:
+            max_active_jobs = self.number_of_workers
         active_jobs = 0
         while True:
-            if active_jobs < self.number_of_workers:
+            if active_jobs < max_active_jobs:
                 try:
                     job = job_source.get_job()
                 except Exception, e:
@@ -143,23 +214,108 @@ class Multiprocessing_job_manager(Job_manager):
         self.job_queue = None
         self.response_queue = None
 
+class Multiprocessing_job_manager(Worker_job_manager):
+    def __init__(self, number_of_workers, prelaunch=False):
+        _initialise_multiprocessing()
+        if multiprocessing is None:
+            raise StandardError("multiprocessing not available")
+        Worker_job_manager.__init__(self, number_of_workers, prelaunch)
+
+    def start_workers(self):
+        self.job_queue = multiprocessing.Queue()
+        self.response_queue = multiprocessing.Queue()
+        self.workers = []
+        for i in range(self.number_of_workers):
+            worker = multiprocessing.Process(
+                target=worker_run_jobs,
+                args=(self.job_queue, self.response_queue, i,
+                      self.prelaunch))
+            self.workers.append(worker)
+        for worker in self.workers:
+            worker.start()
+
+class Threaded_job_manager(Worker_job_manager):
+    """Job manager which runs jobs in threads within this process.
+
+    This suits jobs which spend most of their time waiting for I/O (for
+    example, games between lightweight GTP engines, whose channels block in
+    readline() without holding the interpreter lock). It avoids the memory
+    and startup cost of a process for each worker.
+
+    Jobs' run() methods must be safe to call concurrently.
+
+    """
+    def start_workers(self):
+        self.job_queue = Queue.Queue()
+        self.response_queue = Queue.Queue()
+        self.workers = []
+        for i in range(self.number_of_workers):
+            worker = threading.Thread(
+                target=thread_run_jobs,
+                args=(self.job_queue, self.response_queue, i,
+                      self.prelaunch))
+            # So that an interrupted run doesn't wait for games in progress
+            worker.daemon = True
+            self.workers.append(worker)
+        for worker in self.workers:
+            worker.start()
+
 class In_process_job_manager(Job_manager):
+    """Job manager which runs jobs one at a time in this process.
+
+    If prelaunch is true, the next job is taken from the job source while each
+    job is running, and its prelaunch() method is called in a separate thread.
+
+    """
+    def __init__(self, prelaunch=False):
+        Job_manager.__init__(self)
+        self.prelaunch = prelaunch
+
     def start_workers(self):
         pass
 
+    def _get_job(self, job_source):
+        try:
+            return job_source.get_job()
+        except Exception, e:
+            for cls in self.passed_exceptions:
+                if isinstance(e, cls):
+                    raise
+            raise JobSourceError(
+                "error from get_job()\n%s" %
+                compact_tracebacks.format_traceback(skip=1))
+
+    def _process_error_response(self, job_source, job, msg):
+        try:
+            job_source.process_error_response(job, msg)
+        except Exception, e:
+            for cls in self.passed_exceptions:
+                if isinstance(e, cls):
+                    raise
+            raise JobSourceError(
+                "error from process_error_response()\n%s" %
+                compact_tracebacks.format_traceback(skip=1))
+
     def run_jobs(self, job_source):
+        prelauncher = None
         while True:
-            try:
-                job = job_source.get_job()
-            except Exception, e:
-                for cls in self.passed_exceptions:
-                    if isinstance(e, cls):
-                        raise
-                raise JobSourceError(
-                    "error from get_job()\n%s" %
-                    compact_tracebacks.format_traceback(skip=1))
-            if job is NoJobAvailable:
-                break
+            if prelauncher is not None:
+                prelauncher.join()
+                job = prelauncher.job
+                error = prelauncher.error
+                prelauncher = None
+                if error is not None:
+                    self._process_error_response(job_source, job, error.msg)
+                    continue
+            else:
+                job = self._get_job(job_source)
+                if job is NoJobAvailable:
+                    break
+            if self.prelaunch:
+                next_job = self._get_job(job_source)
+                if next_job is not NoJobAvailable:
+                    prelauncher = Job_prelauncher(lambda: next_job, None)
+                    prelauncher.start()
             try:
                 response = job.run(None)
             except Exception, e:
@@ -167,15 +323,7 @@ class In_process_job_manager(Job_manager):
                     msg = str(e)
                 else:
                     msg = compact_tracebacks.format_traceback(skip=1)
-                try:
-                    job_source.process_error_response(job, msg)
-                except Exception, e:
-                    for cls in self.passed_exceptions:
-                        if isinstance(e, cls):
-                            raise
-                    raise JobSourceError(
-                        "error from process_error_response()\n%s" %
-                        compact_tracebacks.format_traceback(skip=1))
+                self._process_error_response(job_source, job, msg)
             else:
                 try:
                     job_source.process_response(response)
@@ -191,17 +339,36 @@ class In_process_job_manager(Job_manager):
         pass
 
 def run_jobs(job_source, max_workers=None, allow_mp=True,
-             passed_exceptions=None):
-    if allow_mp:
-        _initialise_multiprocessing()
-        if multiprocessing is None:
-            allow_mp = False
-    if allow_mp:
+             passed_exceptions=None, use_threads=False, prelaunch=False):
+    """Run jobs from a job source until it runs out.
+
+    If use_threads is true, runs max_workers jobs at once in threads (rather
+    than in worker processes); in this case max_workers must be specified.
+
+    If prelaunch is true, each worker takes its next job from the job source
+    while its current job is running, and calls the new job's prelaunch()
+    method (if it has one) with its worker id, in a separate thread. The job's
+    run() method is called when the current job has finished. This lets a job
+    do slow preparation (such as starting engines) in advance. If prelaunch()
+    raises an exception (normally JobFailed), the job isn't run and the
+    exception is reported as an error response.
+
+    """
+    if use_threads:
         if max_workers is None:
-            max_workers = multiprocessing.cpu_count()
-        job_manager = Multiprocessing_job_manager(max_workers)
+            raise ValueError("use_threads requires max_workers")
+        job_manager = Threaded_job_manager(max_workers, prelaunch)
     else:
-        job_manager = In_process_job_manager()
+        if allow_mp:
+            _initialise_multiprocessing()
+            if multiprocessing is None:
+                allow_mp = False
+        if allow_mp:
+            if max_workers is None:
+                max_workers = multiprocessing.cpu_count()
+            job_manager = Multiprocessing_job_manager(max_workers, prelaunch)
+        else:
+            job_manager = In_process_job_manager(prelaunch)
     if passed_exceptions:
         for cls in passed_exceptions:
             job_manager.pass_exception(cls)
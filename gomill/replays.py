@@ -0,0 +1,306 @@
+"""Replay many games at once.
+
+This is intended for processing large collections of game records (for
+example, the output of sgf_moves.get_setup_and_moves() for each file in a
+corpus).
+
+If NumPy is available and there are many games of the same board size, those
+games are advanced in lockstep using array operations; otherwise each game is
+replayed on a boards.Board.
+
+"""
+
+from gomill import boards
+from gomill.boards import EMPTY, BLACK, WHITE
+from gomill.common import opponent_of
+
+_colour_codes = {'b' : BLACK, 'w' : WHITE}
+
+# Entries in the moves array which aren't point indices
+_PASS, _NO_MOVE = -1, -2
+
+# Fewest games of a single size for which the array implementation is used
+# (with fewer games, the fixed cost of the array operations outweighs the
+# saving)
+_MIN_BATCH_SIZE = 500
+
+
+class Replay_result(object):
+    """Result of replaying a single game.
+
+    Public attributes:
+      board        -- boards.Board
+      is_legal     -- bool
+      moves_played -- int
+      captures     -- dict colour -> int
+
+    'board' is the position at the end of the game. If the game contained an
+    illegal move, is_legal is False and 'board' is the position immediately
+    before the first illegal move.
+
+    moves_played is the number of moves (including passes) which were played
+    to reach 'board'.
+
+    captures gives the number of stones each player has captured. Stones
+    removed by self-capture count as captured by the opponent.
+
+    """
+    def __init__(self, board, is_legal, moves_played, captures):
+        self.board = board
+        self.is_legal = is_legal
+        self.moves_played = moves_played
+        self.captures = captures
+
+    def __repr__(self):
+        return "<Replay_result: legal=%s moves=%d captures=%s>" % (
+            self.is_legal, self.moves_played, self.captures)
+
+
+def _replay_game(board, plays):
+    """Pure-Python implementation of replay_games() for a single game."""
+    board = board.copy()
+    # The undo log tells us which stones each move removed
+    board.start_undo_log()
+    undo_log = board._undo_log
+    captures = {'b' : 0, 'w' : 0}
+    ko_point = None
+    ko_player = None
+    moves_played = 0
+    result = None
+    for colour, move in plays:
+        if move is None:
+            ko_point = None
+            moves_played += 1
+            continue
+        if move == ko_point and colour == ko_player:
+            result = Replay_result(board, False, moves_played, captures)
+            break
+        try:
+            ko_point = board.play(move[0], move[1], colour)
+        except ValueError:
+            result = Replay_result(board, False, moves_played, captures)
+            break
+        ko_player = opponent_of(colour)
+        moves_played += 1
+        index, code, removed, removed_code, was_empty = undo_log.pop()
+        if removed:
+            if removed_code == code:
+                captures[ko_player] += len(removed)
+            else:
+                captures[colour] += len(removed)
+    if result is None:
+        result = Replay_result(board, True, moves_played, captures)
+    board._undo_log = None
+    return result
+
+
+def _dilate(mask, stride):
+    """Extend a boolean array of flat board representations to neighbours."""
+    result = mask.copy()
+    result[:, 1:] |= mask[:, :-1]
+    result[:, :-1] |= mask[:, 1:]
+    result[:, stride:] |= mask[:, :-stride]
+    result[:, :-stride] |= mask[:, stride:]
+    return result
+
+def _remove_dead_chains(points, games, indices, codes, stride, offsets):
+    """Remove chains which have no liberties.
+
+    points  -- array of flat board representations
+    games   -- array of row numbers in 'points' (no duplicates)
+    indices -- array of point indices, one for each game
+    codes   -- array of colour codes, one for each game
+
+    For each game, looks at the chain of the specified colour which includes
+    the specified point, and removes it if it has no liberties.
+
+    Returns an array giving the number of stones removed from each game.
+
+    """
+    numpy = boards.numpy
+    result = numpy.zeros(len(games), dtype=numpy.int32)
+    # A chain with a liberty next to the specified point can't be dead, which
+    # rules out most cases without a flood fill.
+    has_liberty = numpy.zeros(len(games), dtype=bool)
+    for offset in offsets:
+        has_liberty |= (points[games, indices + offset] == EMPTY)
+    candidates = numpy.flatnonzero(~has_liberty)
+    if not len(candidates):
+        return result
+    candidate_games = games[candidates]
+    candidate_points = points[candidate_games]
+    same = (candidate_points == codes[candidates][:, None])
+    chains = numpy.zeros(same.shape, dtype=bool)
+    chains[numpy.arange(len(candidates)), indices[candidates]] = True
+    # The chains only grow, so they've stopped when their size stops changing
+    size = numpy.count_nonzero(chains)
+    while True:
+        chains = _dilate(chains, stride)
+        chains &= same
+        new_size = numpy.count_nonzero(chains)
+        if new_size == size:
+            break
+        size = new_size
+    dead = ~(_dilate(chains, stride) &
+             (candidate_points == EMPTY)).any(axis=1)
+    if not dead.any():
+        return result
+    dead_chains = chains[dead]
+    rows, cols = numpy.nonzero(dead_chains)
+    points[candidate_games[dead][rows], cols] = EMPTY
+    result[candidates[dead]] = dead_chains.sum(axis=1)
+    return result
+
+def _replay_games_numpy(side, games):
+    """Implementation of replay_games() for games of a single board size."""
+    numpy = boards.numpy
+    geometry = boards._get_geometry(side)
+    stride = geometry.stride
+    offsets = geometry.offsets
+
+    count = len(games)
+    points = boards._points_array([board for (board, plays) in games],
+                                  geometry)
+    lengths = numpy.array([len(plays) for (board, plays) in games],
+                          dtype=numpy.int32)
+    move_count = int(lengths.max()) if count else 0
+    moves = numpy.empty((count, move_count), dtype=numpy.int32)
+    moves[:] = _NO_MOVE
+    colours = numpy.zeros((count, move_count), dtype=numpy.uint8)
+    # Each play is encoded as (point index << 2) | colour code, using index 0
+    # (which is on the border) for a pass.
+    encodings = {}
+    for colour, code in _colour_codes.iteritems():
+        encodings[colour, None] = code
+        for point in geometry.board_points:
+            encodings[colour, point] = (geometry.index(*point) << 2) | code
+    all_plays = [play for (board, plays) in games for play in plays]
+    try:
+        encoded = numpy.array([encodings[play] for play in all_plays],
+                              dtype=numpy.int32)
+    except KeyError:
+        for colour, move in all_plays:
+            if move is not None and (colour, move) not in encodings:
+                row, col = move
+                if not (0 <= row < side and 0 <= col < side):
+                    raise IndexError
+        raise ValueError("invalid colour")
+    game_numbers = numpy.repeat(numpy.arange(count), lengths)
+    move_numbers = (numpy.arange(len(all_plays)) -
+                    (numpy.cumsum(lengths) - lengths)[game_numbers])
+    played_indices = encoded >> 2
+    moves[game_numbers, move_numbers] = numpy.where(
+        played_indices == 0, _PASS, played_indices)
+    colours[game_numbers, move_numbers] = encoded & 3
+
+    is_legal = numpy.ones(count, dtype=bool)
+    moves_played = numpy.zeros(count, dtype=numpy.int32)
+    # Index 0 is always on the border, so it can stand for 'no ko point'
+    ko_points = numpy.zeros(count, dtype=numpy.int32)
+    ko_players = numpy.zeros(count, dtype=numpy.uint8)
+    captures = numpy.zeros((count, 3), dtype=numpy.int32)
+
+    for move_number in xrange(move_count):
+        move_indices = moves[:, move_number]
+        passing = is_legal & (move_indices == _PASS)
+        ko_points[passing] = 0
+        moves_played[passing] += 1
+        playing = numpy.flatnonzero(is_legal & (move_indices >= 0))
+        if not len(playing):
+            continue
+        played = move_indices[playing]
+        codes = colours[playing, move_number]
+        illegal = ((points[playing, played] != EMPTY) |
+                   ((played == ko_points[playing]) &
+                    (codes == ko_players[playing])))
+        if illegal.any():
+            is_legal[playing[illegal]] = False
+            playing = playing[~illegal]
+            played = played[~illegal]
+            codes = codes[~illegal]
+        points[playing, played] = codes
+        moves_played[playing] += 1
+        opponent_codes = 3 - codes
+
+        captured = numpy.zeros(len(playing), dtype=numpy.int32)
+        last_captured = numpy.zeros(len(playing), dtype=numpy.int32)
+        for offset in offsets:
+            neighbours = played + offset
+            hit = numpy.flatnonzero(points[playing, neighbours] ==
+                                    opponent_codes)
+            if not len(hit):
+                continue
+            removed = _remove_dead_chains(
+                points, playing[hit], neighbours[hit], opponent_codes[hit],
+                stride, offsets)
+            captured[hit] += removed
+            last_captured[hit[removed > 0]] = neighbours[hit[removed > 0]]
+        self_captured = _remove_dead_chains(
+            points, playing, played, codes, stride, offsets)
+        captures[playing, codes] += captured
+        captures[playing, opponent_codes] += self_captured
+
+        # Simple ko: a single stone captured a single stone, and was left with
+        # only one liberty.
+        has_friend = numpy.zeros(len(playing), dtype=bool)
+        liberties = numpy.zeros(len(playing), dtype=numpy.int32)
+        for offset in offsets:
+            neighbour_codes = points[playing, played + offset]
+            has_friend |= (neighbour_codes == codes)
+            liberties += (neighbour_codes == EMPTY)
+        is_ko = (captured == 1) & ~has_friend & (liberties == 1)
+        ko_points[playing] = numpy.where(is_ko, last_captured, 0)
+        ko_players[playing] = opponent_codes
+
+    return [
+        Replay_result(board, bool(legal), int(played),
+                      {'b' : int(black_captures), 'w' : int(white_captures)})
+        for (board, legal, played, black_captures, white_captures)
+        in zip(boards._boards_from_points_array(points, geometry),
+               is_legal, moves_played,
+               captures[:, BLACK], captures[:, WHITE])]
+
+def replay_games(games):
+    """Replay many games.
+
+    games -- sequence of pairs (board, plays)
+      board -- boards.Board giving the initial position
+      plays -- list of pairs (colour, move)
+               moves are (row, col), or None for a pass.
+
+    (This is the format returned by sgf_moves.get_setup_and_moves().)
+
+    Returns a list of Replay_result objects, one for each game, in order.
+
+    The games needn't all be the same size. The boards passed in aren't
+    modified.
+
+    A move is illegal if it's to an occupied point, or if it's forbidden by the
+    simple ko rule. Self-capture is permitted. No superko rule is applied.
+    Replaying a game stops at its first illegal move.
+
+    Raises IndexError if any move is off the board.
+
+    If NumPy is available and there are at least a few hundred games of a
+    board size, those games are replayed together, one move at a time, using
+    array operations. For a few thousand 19x19 games this takes less than half
+    as long as playing each game's moves on a Board.
+
+    """
+    boards._initialise_numpy()
+    if boards.numpy is None:
+        return [_replay_game(board, plays) for (board, plays) in games]
+    games_by_side = {}
+    for game_number, (board, plays) in enumerate(games):
+        games_by_side.setdefault(board.side, []).append(game_number)
+    results = [None] * len(games)
+    for side, game_numbers in games_by_side.iteritems():
+        side_games = [games[game_number] for game_number in game_numbers]
+        if len(side_games) < _MIN_BATCH_SIZE:
+            side_results = [_replay_game(board, plays)
+                            for (board, plays) in side_games]
+        else:
+            side_results = _replay_games_numpy(side, side_games)
+        for game_number, result in zip(game_numbers, side_results):
+            results[game_number] = result
+    return results
@@ -27,7 +27,10 @@ def do_run(ringmaster, options):
     else:
         ringmaster.set_clean_status()
     if options.parallel is not None:
-        ringmaster.set_parallel_worker_count(options.parallel)
+        ringmaster.set_parallel_worker_count(options.parallel,
+                                             use_threads=options.threads)
+    if options.prelaunch:
+        ringmaster.enable_prelaunch()
     ringmaster.run(options.max_games)
     ringmaster.report()
 
@@ -76,6 +79,10 @@ def run(argv, ringmaster_class):
                       help="maximum number of games to play in this run")
     parser.add_option("--parallel", "-j", type="int",
                       help="number of worker processes")
+    parser.add_option("--threads", action="store_true",
+                      help="run parallel games in threads, not processes")
+    parser.add_option("--prelaunch", action="store_true",
+                      help="start each game's engines during the previous game")
     parser.add_option("--quiet", "-q", action="store_true",
                       help="be silent except for warnings and errors")
     parser.add_option("--log-gtp", action="store_true",
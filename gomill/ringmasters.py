@@ -84,6 +84,8 @@ class Ringmaster(object):
         """
         self.display_mode = 'clearing'
         self.worker_count = None
+        self.use_worker_threads = False
+        self.prelaunch_engines = False
         self.max_games_this_run = None
         self.presenter = None
         self.terminal_reader = None
@@ -97,7 +99,7 @@ class Ringmaster(object):
         self.base_directory, control_filename = os.path.split(control_pathname)
         self.competition_code, ext = os.path.splitext(control_filename)
         if ext in (".log", ".status", ".cmd", ".hist",
-                   ".report", ".games", ".void", ".gtplogs"):
+                   ".report", ".games", ".void", ".gtplogs", ".engines"):
             raise RingmasterError("forbidden control file extension: %s" % ext)
         stem = os.path.join(self.base_directory, self.competition_code)
         self.log_pathname = stem + ".log"
@@ -108,6 +110,7 @@ class Ringmaster(object):
         self.sgf_dir_pathname = stem + ".games"
         self.void_dir_pathname = stem + ".void"
         self.gtplog_dir_pathname = stem + ".gtplogs"
+        self.engine_cache_pathname = stem + ".engines"
 
         self.status_is_loaded = False
         try:
@@ -307,6 +310,7 @@ class Ringmaster(object):
     ringmaster_settings = [
         Setting('record_games', interpret_bool, True),
         Setting('stderr_to_log', interpret_bool, True),
+        Setting('cache_engine_capabilities', interpret_bool, False),
         ]
 
     def _initialise_from_control_file(self, config):
@@ -325,8 +329,21 @@ class Ringmaster(object):
     def enable_gtp_logging(self, b=True):
         self.write_gtp_logs = b
 
-    def set_parallel_worker_count(self, n):
+    def enable_prelaunch(self, b=True):
+        """Start each game's engines while the previous game is being played.
+
+        """
+        self.prelaunch_engines = b
+
+    def set_parallel_worker_count(self, n, use_threads=False):
+        """Play n games at once.
+
+        If use_threads is true, the games are run in threads within the
+        ringmaster process, rather than in worker processes.
+
+        """
         self.worker_count = n
+        self.use_worker_threads = use_threads
 
     def log(self, s):
         print >>self.logfile, s
@@ -570,6 +587,8 @@ class Ringmaster(object):
                     self.gtplog_dir_pathname, "%s.log" % job.game_id)
         if self.stderr_to_log:
             job.stderr_pathname = self.log_pathname
+        if self.cache_engine_capabilities:
+            job.engine_cache_pathname = self.engine_cache_pathname
 
     def get_job(self):
         """Job supply function for the job manager."""
@@ -694,13 +713,20 @@ class Ringmaster(object):
         allow_mp = (self.worker_count is not None)
         self.log("run started at %s with max_games %s" % (now(), max_games))
         if allow_mp:
-            self.log("using %d worker processes" % self.worker_count)
+            if self.use_worker_threads:
+                self.log("using %d worker threads" % self.worker_count)
+            else:
+                self.log("using %d worker processes" % self.worker_count)
+        if self.prelaunch_engines:
+            self.log("prelaunching engines")
         self.max_games_this_run = max_games
         self._update_display()
         try:
             job_manager.run_jobs(
                 job_source=self,
                 allow_mp=allow_mp, max_workers=self.worker_count,
+                use_threads=(allow_mp and self.use_worker_threads),
+                prelaunch=self.prelaunch_engines,
                 passed_exceptions=[RingmasterError, CompetitionError,
                                    RingmasterInternalError])
         except KeyboardInterrupt:
@@ -720,6 +746,10 @@ class Ringmaster(object):
             self.log(compact_tracebacks.format_traceback())
             log_games_in_progress()
             raise
+        finally:
+            # Engines kept for reuse by games run in this process (worker
+            # processes' engines see end-of-file when the worker exits).
+            game_jobs.close_pooled_players()
         self.log("run finished at %s" % now())
         self._close_files()
 
@@ -735,6 +765,7 @@ class Ringmaster(object):
             self.command_pathname,
             self.history_pathname,
             self.report_pathname,
+            self.engine_cache_pathname,
             ]:
             if os.path.exists(pathname):
                 try:
@@ -7,6 +7,7 @@ __all__ = ['Setting', 'allow_none', 'load_settings',
            'Config_proxy', 'Quiet_config',
            'interpret_any', 'interpret_bool',
            'interpret_int', 'interpret_positive_int', 'interpret_float',
+           'interpret_non_negative_float', 'interpret_positive_float',
            'interpret_8bit_string', 'interpret_identifier',
            'interpret_as_utf8', 'interpret_as_utf8_stripped',
            'interpret_colour', 'interpret_enum', 'interpret_callable',
@@ -44,6 +45,18 @@ def interpret_float(f):
         return float(f)
     raise ValueError("invalid float")
 
+def interpret_non_negative_float(f):
+    f = interpret_float(f)
+    if f < 0:
+        raise ValueError("must not be negative")
+    return f
+
+def interpret_positive_float(f):
+    f = interpret_float(f)
+    if f <= 0:
+        raise ValueError("must be positive")
+    return f
+
 def interpret_8bit_string(s):
     if isinstance(s, str):
         result = s
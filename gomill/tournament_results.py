@@ -20,6 +20,7 @@ class Matchup_description(object):
       handicap        -- int or None
       handicap_style  -- 'fixed' or 'free'
       move_limit      -- int
+      ko_rule         -- 'simple', 'positional', or 'situational'
       scorer          -- 'internal' or 'players'
       number_of_games -- int or None
 
@@ -226,11 +226,20 @@ class Tournament(Competition):
         job.board_size = matchup.board_size
         job.komi = matchup.komi
         job.move_limit = matchup.move_limit
+        job.ko_rule = matchup.ko_rule
+        job.adjudication_pass_alive_margin = \
+            matchup.adjudication_pass_alive_margin
+        job.adjudication_stable_score_moves = \
+            matchup.adjudication_stable_score_moves
         job.handicap = matchup.handicap
         job.handicap_is_free = (matchup.handicap_style == 'free')
         job.use_internal_scorer = (matchup.scorer == 'internal')
         job.internal_scorer_handicap_compensation = \
             matchup.internal_scorer_handicap_compensation
+        job.internal_scorer_removes_dead = matchup.internal_scorer_removes_dead
+        job.gtp_response_timeout = matchup.gtp_response_timeout
+        job.gtp_game_timeout = matchup.gtp_game_timeout
+        job.gtp_timeout_forfeits = matchup.gtp_timeout_forfeits
         job.sgf_event = matchup.event_description
         return job
 
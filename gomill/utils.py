@@ -9,6 +9,8 @@ This is for generic utilities; see common for Go-specific utility functions.
 from __future__ import division
 import errno
 import os
+import sys
+import threading
 
 __all__ = ["format_float", "format_percent", "sanitise_utf8", "isinf", "isnan"]
 
@@ -75,6 +77,41 @@ def ensure_dir(pathname):
         if e.errno != errno.EEXIST:
             raise
 
+def call_concurrently(fns):
+    """Call several functions at once, each in its own thread.
+
+    fns -- list of callables taking no arguments
+
+    Returns a list of the functions' return values.
+
+    Waits for all the functions to return. If any of them raised an exception,
+    re-raises the exception from the first (in list order) which did.
+
+    The last function is called in the current thread.
+
+    """
+    results = [None] * len(fns)
+    exc_infos = [None] * len(fns)
+    def call(i):
+        try:
+            results[i] = fns[i]()
+        except Exception:
+            exc_infos[i] = sys.exc_info()
+    threads = []
+    for i in range(len(fns) - 1):
+        thread = threading.Thread(target=call, args=(i,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    if fns:
+        call(len(fns) - 1)
+    for thread in threads:
+        thread.join()
+    for exc_info in exc_infos:
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+    return results
+
 try:
     from math import isinf, isnan
 except ImportError:
@@ -149,7 +149,6 @@ setup(name='gomill',
           "Operating System :: POSIX",
           "Operating System :: MacOS :: MacOS X",
           "Programming Language :: Python :: 2",
-          "Programming Language :: Python :: 2.5",
           "Programming Language :: Python :: 2.6",
           "Programming Language :: Python :: 2.7",
           "Programming Language :: Python",
@@ -7,6 +7,9 @@ ascii_boards facilities.
 
 from __future__ import with_statement
 
+import cPickle as pickle
+import random
+
 from gomill.common import format_vertex, move_from_vertex
 from gomill import ascii_boards
 from gomill import boards
@@ -151,6 +154,61 @@ def test_copy(tc):
     b1.play(2, 1, 'b')
     tc.assertEqual(b1, b2)
 
+def test_to_bytes(tc):
+    b = boards.Board(3)
+    tc.assertEqual(b.to_bytes(), "\x00\x00\x00")
+    b.play(0, 0, 'b')
+    b.play(0, 1, 'w')
+    b.play(2, 2, 'w')
+    tc.assertEqual(b.to_bytes(), "\x09\x00\x02")
+    b2 = boards.Board.from_bytes(3, "\x09\x00\x02")
+    tc.assertEqual(b2, b)
+    tc.assertEqual(b2.zobrist_hash(), b.zobrist_hash())
+    tc.assertIs(b2.is_empty(), False)
+    tc.assertIs(boards.Board.from_bytes(3, "\x00\x00\x00").is_empty(), True)
+    tc.assertEqual(len(boards.Board(19).to_bytes()), 91)
+
+def test_from_bytes_errors(tc):
+    tc.assertRaisesRegexp(ValueError, "wrong length",
+                          boards.Board.from_bytes, 3, "\x00\x00")
+    tc.assertRaisesRegexp(ValueError, "invalid point value",
+                          boards.Board.from_bytes, 3, "\x03\x00\x00")
+    tc.assertRaisesRegexp(ValueError, "invalid point value",
+                          boards.Board.from_bytes, 3, "\x00\x00\x04")
+    # Black at (0, 0), surrounded by White
+    tc.assertRaisesRegexp(ValueError, "no liberties",
+                          boards.Board.from_bytes, 3, "\x89\x00\x00")
+
+def test_pickle(tc):
+    rnd = random.Random(8642)
+    for side in (2, 5, 9, 19):
+        b = boards.Board(side)
+        for point in rnd.sample(b.board_points,
+                                rnd.randrange(len(b.board_points))):
+            if b.get(*point) is None:
+                b.play(point[0], point[1], rnd.choice('bw'))
+        b.start_undo_log()
+        for protocol in (0, 2):
+            b2 = pickle.loads(pickle.dumps(b, protocol))
+            tc.assertEqual(b2, b)
+            tc.assertEqual(b2.side, side)
+            tc.assertIs(b2.board_points, b.board_points)
+            tc.assertEqual(b2.zobrist_hash(), b.zobrist_hash())
+            tc.assertIs(b2.is_empty(), b.is_empty())
+            tc.assertEqual(b2.legal_moves('b'), b.legal_moves('b'))
+            tc.assertEqual(b2.area_score(), b.area_score())
+            tc.assertRaises(ValueError, b2.undo)
+        tc.assertEqual(boards.Board.from_bytes(side, b.to_bytes()), b)
+        # Chains should be rebuilt correctly, so playing on gives the same
+        # position as on the original.
+        b2 = pickle.loads(pickle.dumps(b))
+        for row, col in rnd.sample(b.board_points, len(b.board_points) // 2):
+            colour = rnd.choice('bw')
+            if b.get(row, col) is None:
+                b.play(row, col, colour)
+                b2.play(row, col, colour)
+        tc.assertEqual(b2, b)
+
 def test_full_board_selfcapture(tc):
     b = boards.Board(9)
     tc.assertTrue(b.is_empty())
@@ -161,6 +219,328 @@ def test_full_board_selfcapture(tc):
     tc.assertEqual(b, boards.Board(9))
     tc.assertIs(b.is_empty(), True)
 
+def test_play_matches_fresh_setup(tc):
+    # Check that the chain and liberty information maintained by play() agrees
+    # with the information calculated from scratch by apply_setup().
+    rnd = random.Random(1234)
+    b = boards.Board(7)
+    for i in xrange(600):
+        fresh = boards.Board(7)
+        occupied = b.list_occupied_points()
+        tc.assertIs(fresh.apply_setup(
+            [point for (colour, point) in occupied if colour == 'b'],
+            [point for (colour, point) in occupied if colour == 'w'],
+            []), True)
+        empty = [point for point in b.board_points if b.get(*point) is None]
+        row, col = rnd.choice(empty)
+        colour = rnd.choice('bw')
+        tc.assertEqual(b.zobrist_hash(), fresh.zobrist_hash())
+        expected_hash = b.hash_after_move(row, col, colour)
+        tc.assertEqual(b.play(row, col, colour),
+                       fresh.play(row, col, colour))
+        tc.assertEqual(b, fresh)
+        tc.assertEqual(b.area_score(), fresh.area_score())
+        tc.assertEqual(b.zobrist_hash(), expected_hash)
+
+def test_undo(tc):
+    b = boards.Board(9)
+    tc.assertRaisesRegexp(ValueError, "nothing to undo", b.undo)
+    b.start_undo_log()
+    tc.assertRaisesRegexp(ValueError, "nothing to undo", b.undo)
+    b.play(2, 3, 'b')
+    b.play(3, 4, 'w')
+    b2 = b.copy()
+    b.undo()
+    tc.assertEqual(b.list_occupied_points(), [('b', (2, 3))])
+    b.undo()
+    tc.assertIs(b.is_empty(), True)
+    tc.assertEqual(b.zobrist_hash(), 0)
+    tc.assertRaisesRegexp(ValueError, "nothing to undo", b.undo)
+    b2.undo()
+    tc.assertEqual(b2.list_occupied_points(), [('b', (2, 3))])
+    b2.apply_setup([(5, 5)], [], [])
+    tc.assertRaisesRegexp(ValueError, "nothing to undo", b2.undo)
+
+def test_undo_matches_replay(tc):
+    # Check that undo() restores the position and the chain and liberty
+    # information, by comparing with a board built by replaying the moves.
+    rnd = random.Random(5678)
+    b = boards.Board(7)
+    b.start_undo_log()
+    moves = []
+    for i in xrange(800):
+        if moves and rnd.random() < 0.3:
+            b.undo()
+            moves.pop()
+        else:
+            empty = [point for point in b.board_points
+                     if b.get(*point) is None]
+            row, col = rnd.choice(empty)
+            colour = rnd.choice('bw')
+            b.play(row, col, colour)
+            moves.append((row, col, colour))
+        fresh = boards.Board(7)
+        for row, col, colour in moves:
+            fresh.play(row, col, colour)
+        tc.assertEqual(b, fresh)
+        tc.assertEqual(b.zobrist_hash(), fresh.zobrist_hash())
+        tc.assertEqual(b.is_empty(), fresh.is_empty())
+        empty = [point for point in b.board_points if b.get(*point) is None]
+        if empty:
+            row, col = rnd.choice(empty)
+            colour = rnd.choice('bw')
+            b2 = b.copy()
+            tc.assertEqual(b2.play(row, col, colour),
+                           fresh.play(row, col, colour))
+            tc.assertEqual(b2, fresh)
+
+def test_legal_moves(tc):
+    b = ascii_boards.interpret_diagram("""\
+5  .  #  .  #  .
+4  #  #  o  o  o
+3  .  o  .  o  .
+2  o  .  o  o  #
+1  .  o  #  .  o
+   A  B  C  D  E
+""", 5)
+    tc.assertEqual(b.legal_moves('b'),
+                   [(0, 3), (2, 0), (4, 0), (4, 2), (4, 4)])
+    tc.assertEqual(b.legal_moves('w'),
+                   [(0, 0), (0, 3), (1, 1), (2, 0), (2, 2), (2, 4),
+                    (4, 2), (4, 4)])
+    tc.assertEqual(b.legal_moves('b', ko_point=(4, 0)),
+                   [(0, 3), (2, 0), (4, 2), (4, 4)])
+    tc.assertIs(b.is_legal(0, 3, 'b'), True)
+    tc.assertIs(b.is_legal(2, 4, 'b'), False)
+    tc.assertIs(b.is_legal(2, 4, 'w'), True)
+    tc.assertIs(b.is_legal(4, 1, 'w'), False)
+    tc.assertRaises(IndexError, b.is_legal, 5, 0, 'b')
+    tc.assertRaises(ValueError, b.is_legal, 0, 0, None)
+    tc.assertRaises(ValueError, b.legal_moves, None)
+    moves = b.legal_moves('b')
+    moves.append('nonsense')
+    tc.assertNotIn('nonsense', b.legal_moves('b'))
+    b.play(4, 4, 'b')
+    tc.assertEqual(b.legal_moves('b'), [(0, 3), (2, 0), (4, 0), (4, 2)])
+    tc.assertEqual(b.legal_moves('w'),
+                   [(0, 0), (0, 3), (1, 1), (2, 0), (2, 2), (2, 4), (4, 2)])
+
+def test_legal_moves_match_play(tc):
+    # Check legal_moves() against actually playing each move, including
+    # after undo() and apply_setup().
+    rnd = random.Random(9753)
+    b = boards.Board(5)
+    b.start_undo_log()
+    for i in xrange(300):
+        for colour in 'bw':
+            expected = []
+            for row, col in b.board_points:
+                if b.get(row, col) is not None:
+                    continue
+                b2 = b.copy()
+                b2.play(row, col, colour)
+                if b2.get(row, col) is not None:
+                    expected.append((row, col))
+            tc.assertEqual(b.legal_moves(colour), expected)
+        r = rnd.random()
+        if r < 0.2:
+            try:
+                b.undo()
+            except ValueError:
+                pass
+        elif r < 0.25:
+            b.apply_setup([], [], rnd.sample(b.board_points, 3))
+        else:
+            colour = rnd.choice('bw')
+            moves = b.legal_moves(colour)
+            if moves:
+                row, col = rnd.choice(moves)
+                b.play(row, col, colour)
+
+def test_zobrist_hash(tc):
+    b1 = boards.Board(9)
+    b2 = boards.Board(9)
+    tc.assertEqual(b1.zobrist_hash(), 0)
+    b1.play(2, 3, 'b')
+    b1.play(3, 4, 'w')
+    b2.play(3, 4, 'w')
+    tc.assertNotEqual(b1.zobrist_hash(), b2.zobrist_hash())
+    b2.play(2, 3, 'b')
+    tc.assertEqual(b1.zobrist_hash(), b2.zobrist_hash())
+    tc.assertEqual(b1.copy().zobrist_hash(), b1.zobrist_hash())
+    b3 = boards.Board(9)
+    b3.apply_setup([(2, 3)], [(3, 4)], [])
+    tc.assertEqual(b3.zobrist_hash(), b1.zobrist_hash())
+    b3.apply_setup([], [], [(2, 3), (3, 4)])
+    tc.assertEqual(b3.zobrist_hash(), 0)
+    b4 = boards.Board(9)
+    b4.play(2, 3, 'w')
+    tc.assertNotEqual(b4.zobrist_hash(), b1.zobrist_hash())
+    tc.assertRaises(ValueError, b1.hash_after_move, 2, 3, 'w')
+    tc.assertRaises(ValueError, b1.hash_after_move, 5, 5, None)
+    tc.assertRaises(IndexError, b1.hash_after_move, 9, 5, 'b')
+
+def test_hash_after_move_captures(tc):
+    b = ascii_boards.interpret_diagram("""\
+9  .  .  .  .  .  .  .  .  .
+8  .  .  .  .  .  .  .  .  .
+7  .  .  .  .  .  .  .  .  .
+6  .  .  .  .  .  .  .  .  .
+5  .  .  .  .  .  .  .  .  .
+4  .  .  .  .  .  .  .  .  .
+3  #  #  .  .  #  o  .  .  .
+2  o  #  .  #  o  .  o  .  .
+1  .  o  #  .  #  o  .  .  .
+   A  B  C  D  E  F  G  H  J
+""", 9)
+    for vertex, colour in [("A1", 'b'), ("A1", 'w'), ("D1", 'w'),
+                           ("F2", 'b'), ("F2", 'w'), ("E3", 'w')]:
+        row, col = move_from_vertex(vertex, 9)
+        if b.get(row, col) is not None:
+            continue
+        b2 = b.copy()
+        expected = b2.hash_after_move(row, col, colour)
+        b2.play(row, col, colour)
+        tc.assertEqual(b2.zobrist_hash(), expected, vertex)
+        tc.assertEqual(b, b.copy())
+
+def _make_area_score_test_boards():
+    result = [ascii_boards.interpret_diagram(diagram, 9)
+              for (code, diagram, score) in board_test_data.score_tests]
+    rnd = random.Random(4321)
+    for side in (2, 5, 9, 19):
+        for i in xrange(10):
+            b = boards.Board(side)
+            for point in rnd.sample(b.board_points,
+                                    rnd.randrange(len(b.board_points))):
+                if b.get(*point) is None:
+                    b.play(point[0], point[1], rnd.choice('bw'))
+            result.append(b)
+    rnd.shuffle(result)
+    return result
+
+def test_area_score_many(tc):
+    bb = _make_area_score_test_boards()
+    tc.assertEqual(boards.area_score_many(bb),
+                   [b.area_score() for b in bb])
+    tc.assertEqual(boards.area_score_many([]), [])
+
+def test_area_score_many_without_numpy(tc):
+    bb = _make_area_score_test_boards()
+    saved = boards._initialise_numpy, boards.numpy
+    boards._initialise_numpy = lambda: None
+    boards.numpy = None
+    try:
+        tc.assertEqual(boards.area_score_many(bb),
+                       [b.area_score() for b in bb])
+    finally:
+        boards._initialise_numpy, boards.numpy = saved
+
+def test_boards_from_points_array(tc):
+    # Check that boards made using array operations have the same chain and
+    # liberty information as the originals.
+    boards._initialise_numpy()
+    if boards.numpy is None:
+        tc.skipTest("NumPy not available")
+    rnd = random.Random(2468)
+    bb = [b for b in _make_area_score_test_boards() if b.side == 9]
+    bb.append(boards.Board(9))
+    geometry = boards._get_geometry(9)
+    made = boards._boards_from_points_array(
+        boards._points_array(bb, geometry), geometry)
+    tc.assertEqual(len(made), len(bb))
+    for b, b2 in zip(bb, made):
+        b = b.copy()
+        tc.assertEqual(b2, b)
+        tc.assertEqual(b2.is_empty(), b.is_empty())
+        tc.assertEqual(b2.zobrist_hash(), b.zobrist_hash())
+        for i in xrange(40):
+            empty = [point for point in b.board_points
+                     if b.get(*point) is None]
+            if not empty:
+                break
+            row, col = rnd.choice(empty)
+            colour = rnd.choice('bw')
+            tc.assertEqual(b2.play(row, col, colour), b.play(row, col, colour))
+            tc.assertEqual(b2, b)
+            tc.assertEqual(b2.zobrist_hash(), b.zobrist_hash())
+
+PASS_ALIVE_DIAGRAM = """\
+9  .  #  .  o  #  o  .  .  .
+8  #  #  #  .  #  o  .  .  .
+7  .  .  #  #  #  o  .  .  .
+6  #  #  #  o  o  o  .  .  .
+5  .  .  .  .  .  .  .  .  .
+4  .  .  .  .  .  .  .  .  .
+3  .  .  .  .  .  o  o  o  o
+2  .  .  .  .  .  o  .  o  .
+1  .  .  .  .  .  o  o  o  .
+   A  B  C  D  E  F  G  H  J
+"""
+
+def _vertices(points):
+    return sorted(format_vertex(point) for point in points)
+
+def test_find_pass_alive(tc):
+    b = ascii_boards.interpret_diagram(PASS_ALIVE_DIAGRAM, 9)
+    stones, territory = b.find_pass_alive('b')
+    tc.assertEqual(_vertices(stones),
+                   ['A6', 'A8', 'B6', 'B8', 'B9', 'C6', 'C7', 'C8',
+                    'D7', 'E7', 'E8', 'E9'])
+    tc.assertEqual(_vertices(territory), ['A7', 'A9', 'B7', 'C9', 'D8', 'D9'])
+    stones, territory = b.find_pass_alive('w')
+    tc.assertEqual(_vertices(stones),
+                   ['F1', 'F2', 'F3', 'G1', 'G3', 'H1', 'H2', 'H3', 'J3'])
+    tc.assertEqual(_vertices(territory), ['G2', 'J1', 'J2'])
+    tc.assertEqual(boards.Board(9).find_pass_alive('b'), ([], []))
+    tc.assertRaises(KeyError, b.find_pass_alive, None)
+
+def test_find_pass_alive_one_eye(tc):
+    b = ascii_boards.interpret_diagram("""\
+5  .  #  .  .  .
+4  #  #  .  .  .
+3  .  .  .  .  .
+2  .  .  .  #  #
+1  .  .  .  #  .
+   A  B  C  D  E
+""", 5)
+    tc.assertEqual(b.find_pass_alive('b'), ([], []))
+
+def test_pass_alive_stones_survive(tc):
+    # Whatever White does while Black passes, Black's pass-alive stones stay
+    # on the board.
+    rnd = random.Random(1357)
+    b = ascii_boards.interpret_diagram(PASS_ALIVE_DIAGRAM, 9)
+    stones, territory = b.find_pass_alive('b')
+    for i in xrange(50):
+        b2 = b.copy()
+        for j in xrange(100):
+            moves = b2.legal_moves('w')
+            if not moves:
+                break
+            row, col = rnd.choice(moves)
+            b2.play(row, col, 'w')
+        for row, col in stones:
+            tc.assertEqual(b2.get(row, col), 'b')
+
+def test_area_score_remove_dead(tc):
+    b = ascii_boards.interpret_diagram(PASS_ALIVE_DIAGRAM, 9)
+    tc.assertEqual(b.area_score(), -4)
+    tc.assertEqual(b.area_score(remove_dead=True), 0)
+    tc.assertEqual(b.get(8, 3), 'w')
+    boards_with_dead_stones = 0
+    for b in _make_area_score_test_boards():
+        dead = []
+        for colour in 'bw':
+            stones, territory = b.find_pass_alive(colour)
+            dead += [point for point in territory if b.get(*point) is not None]
+        if dead:
+            boards_with_dead_stones += 1
+        b2 = b.copy()
+        b2.apply_setup([], [], dead)
+        tc.assertEqual(b.area_score(remove_dead=True), b2.area_score())
+    tc.assertTrue(boards_with_dead_stones > 0)
+
 def test_apply_setup_range_checks(tc):
     b = boards.Board(9)
     tc.assertRaises(IndexError, b.apply_setup, [(1, 1), (9, 2)], [], [])
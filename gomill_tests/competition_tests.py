@@ -77,6 +77,37 @@ def test_player_command(tc):
                    [os.path.expanduser("~") + "/test", "foo"])
     tc.assertEqual(comp.players['t5'].cmd_args, ["~root"])
 
+def test_player_gtp_address(tc):
+    comp = competitions.Competition('test')
+    comp.set_base_directory("/base")
+    config = {
+        'players' : {
+            't1' : Player_config("test"),
+            't2' : Player_config(gtp_address="/tmp/engine.sock"),
+            't3' : Player_config(gtp_address="engine.sock"),
+            't4' : Player_config(gtp_address=("localhost", 6500)),
+            }
+        }
+    comp.initialise_from_control_file(config)
+    tc.assertIsNone(comp.players['t1'].gtp_address)
+    tc.assertEqual(comp.players['t2'].gtp_address, "/tmp/engine.sock")
+    tc.assertIsNone(comp.players['t2'].cmd_args)
+    tc.assertEqual(comp.players['t3'].gtp_address, "/base/engine.sock")
+    tc.assertEqual(comp.players['t4'].gtp_address, ("localhost", 6500))
+
+    tc.assertRaisesRegexp(
+        Exception, "'command' and 'gtp_address' both specified",
+        comp.game_jobs_player_from_config, 'pp',
+        Player_config("cmd", gtp_address="/tmp/engine.sock"))
+    tc.assertRaisesRegexp(
+        Exception, "'gtp_address': invalid port number",
+        comp.game_jobs_player_from_config, 'pp',
+        Player_config(gtp_address=("localhost", 0)))
+    tc.assertRaisesRegexp(
+        Exception, "'gtp_address': not a string or a pair",
+        comp.game_jobs_player_from_config, 'pp',
+        Player_config(gtp_address=6500))
+
 def test_player_is_reliable_scorer(tc):
     comp = competitions.Competition('test')
     config = {
@@ -91,6 +122,22 @@ def test_player_is_reliable_scorer(tc):
     tc.assertFalse(comp.players['t2'].is_reliable_scorer)
     tc.assertTrue(comp.players['t3'].is_reliable_scorer)
 
+def test_player_games_per_process(tc):
+    comp = competitions.Competition('test')
+    config = {
+        'players' : {
+            't1' : Player_config("test"),
+            't2' : Player_config("test", games_per_process=10),
+            }
+        }
+    comp.initialise_from_control_file(config)
+    tc.assertEqual(comp.players['t1'].games_per_process, 1)
+    tc.assertEqual(comp.players['t2'].games_per_process, 10)
+    tc.assertRaisesRegexp(
+        Exception, "'games_per_process': must be positive integer",
+        comp.game_jobs_player_from_config, 'pp',
+        Player_config("test", games_per_process=0))
+
 def test_player_cwd(tc):
     comp = competitions.Competition('test')
     comp.set_base_directory("/base")
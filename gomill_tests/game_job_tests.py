@@ -3,6 +3,8 @@
 from __future__ import with_statement
 
 import os
+import threading
+import time
 from textwrap import dedent
 
 from gomill import gtp_controller
@@ -129,6 +131,8 @@ def test_player_copy(tc):
     tc.assertEqual(p2.code, "clone")
     tc.assertEqual(p2.cmd_args, ['testb', 'id=one'])
     tc.assertIsNot(p1.cmd_args, p2.cmd_args)
+    p1.games_per_process = 3
+    tc.assertEqual(p1.copy("clone").games_per_process, 3)
 
 def test_game_job(tc):
     fx = Game_job_fixture(tc)
@@ -233,6 +237,33 @@ def test_game_job_exec_failure(tc):
     # No void sgf file unless at least one move was played
     tc.assertIsNone(fx.job._sgf_pathname_written)
 
+def test_game_job_players_start_concurrently(tc):
+    # Each engine's startup waits for the other's to begin
+    events = {'b' : threading.Event(), 'w' : threading.Event()}
+    overlapped = {}
+    def make_init(colour, other):
+        def init(channel):
+            events[colour].set()
+            overlapped[colour] = events[other].wait(5)
+        return init
+    fx = Game_job_fixture(tc)
+    fx.init_player('b', make_init('b', 'w'))
+    fx.init_player('w', make_init('w', 'b'))
+    result = fx.job.run()
+    tc.assertEqual(result.game_result.sgf_result, "B+10.5")
+    tc.assertEqual(overlapped, {'b' : True, 'w' : True})
+
+def test_game_job_exec_failure_both(tc):
+    fx = Game_job_fixture(tc)
+    fx.job.player_b.cmd_args.append('fail=startup')
+    fx.job.player_w.cmd_args.append('fail=startup')
+    with tc.assertRaises(JobFailed) as ar:
+        fx.job.run()
+    tc.assertEqual(str(ar.exception),
+                   "aborting game due to error:\n"
+                   "error starting subprocess for player one:\n"
+                   "exec forced to fail")
+
 def test_game_job_channel_error(tc):
     def fail_first_genmove(channel):
         channel.fail_command = 'genmove'
@@ -259,6 +290,52 @@ def test_game_job_channel_error(tc):
     )
     """))
 
+def test_game_job_timeouts(tc):
+    fx = Game_job_fixture(tc)
+    fx.job.gtp_response_timeout = 5.0
+    fx.job.gtp_game_timeout = 600.0
+    start_time = time.time()
+    fx.job.run()
+    channel = fx.get_channel('one')
+    tc.assertEqual(channel.requested_response_timeout, 5.0)
+    tc.assertEqual(channel.requested_exit_timeout, 5.0)
+    tc.assertTrue(start_time + 600 <= channel.requested_deadline
+                  <= time.time() + 600)
+
+def test_game_job_timeout_void(tc):
+    def hang_on_genmove(channel):
+        channel.hang_command = 'genmove'
+    fx = Game_job_fixture(tc)
+    fx.init_player('w', hang_on_genmove)
+    with tc.assertRaises(JobFailed) as ar:
+        fx.job.run()
+    tc.assertEqual(str(ar.exception),
+                   "aborting game due to error:\n"
+                   "timeout reading response to 'genmove w' from player two:\n"
+                   "forced timeout")
+    tc.assertEqual(fx.job._sgf_pathname_written, '/sgf/test.void/gjtest.sgf')
+
+def test_game_job_timeout_forfeit(tc):
+    def hang_on_genmove(channel):
+        channel.hang_command = 'genmove'
+    fx = Game_job_fixture(tc)
+    fx.init_player('w', hang_on_genmove)
+    fx.job.gtp_timeout_forfeits = True
+    result = fx.job.run()
+    tc.assertEqual(result.game_result.sgf_result, "B+F")
+    tc.assertEqual(
+        result.game_result.detail,
+        "forfeit by two: timeout reading response to 'genmove w' "
+        "from player two:\n"
+        "forced timeout")
+    tc.assertEqual(
+        result.warnings,
+        ["forfeit by two: timeout reading response to 'genmove w' "
+         "from player two:\n"
+         "forced timeout"])
+    tc.assertEqual(result.log_entries, [])
+    tc.assertEqual(fx.job._sgf_pathname_written, '/sgf/test.games/gjtest.sgf')
+
 def test_game_job_late_errors(tc):
     def fail_close(channel):
         channel.fail_close = True
@@ -334,6 +411,106 @@ def test_game_job_cwd_env(tc):
     tc.assertIn('PATH', channel.requested_env)
     tc.assertEqual(fx.job._sgf_pathname_written, '/sgf/test.games/gjtest.sgf')
 
+def test_game_job_socket_players(tc):
+    fx = Game_job_fixture(tc)
+    server_b = gtp_engine_fixtures.Gtp_server_fixture(
+        tc, gtp_engine_fixtures.get_test_player_engine())
+    server_w = gtp_engine_fixtures.Gtp_server_fixture(
+        tc, gtp_engine_fixtures.get_test_player_engine(),
+        address=("127.0.0.1", 0))
+    tc.addCleanup(game_jobs.close_pooled_players)
+    fx.job.player_b.gtp_address = server_b.address
+    fx.job.player_w.gtp_address = server_w.address
+    fx.job.player_w.startup_gtp_commands = [('komi', ['7.5'])]
+    result = fx.job.run()
+    # Win by 18 on the board minus 7.5 komi
+    tc.assertEqual(result.game_result.sgf_result, "B+10.5")
+    tc.assertIsNone(result.game_result.cpu_times['one'])
+    tc.assertRaises(KeyError, fx.get_channel, 'one')
+    # The connections are kept open for the next game
+    result = fx.job.run()
+    commands_b = [command for (command, args)
+                  in server_b.engine.commands_handled]
+    commands_w = [command for (command, args)
+                  in server_w.engine.commands_handled]
+    tc.assertEqual(commands_b.count('protocol_version'), 2)
+    tc.assertNotIn('quit', commands_b)
+    tc.assertNotIn('quit', commands_w)
+    # A player with different startup commands doesn't share connections
+    player = fx.job.player_w.copy('three')
+    tc.assertEqual(game_jobs._get_socket_pool_key(player),
+                   game_jobs._get_socket_pool_key(fx.job.player_w))
+    player.startup_gtp_commands = []
+    tc.assertNotEqual(game_jobs._get_socket_pool_key(player),
+                      game_jobs._get_socket_pool_key(fx.job.player_w))
+
+def test_game_job_games_per_process(tc):
+    fx = Game_job_fixture(tc)
+    tc.addCleanup(game_jobs.close_pooled_players)
+    fx.job.player_b.games_per_process = 2
+    result = fx.job.run()
+    channel1 = fx.get_channel('one')
+    tc.assertFalse(channel1.is_closed)
+    tc.assertTrue(fx.get_channel('two').is_closed)
+    tc.assertIsNone(result.game_result.cpu_times['one'])
+    tc.assertEqual(result.game_result.cpu_times['two'], 567.2)
+    result = fx.job.run()
+    tc.assertIs(fx.get_channel('one'), channel1)
+    # That was its second game
+    tc.assertTrue(channel1.is_closed)
+    result = fx.job.run()
+    channel2 = fx.get_channel('one')
+    tc.assertIsNot(channel2, channel1)
+    tc.assertFalse(channel2.is_closed)
+    game_jobs.close_pooled_players()
+    tc.assertTrue(channel2.is_closed)
+
+def test_game_job_games_per_process_forfeit(tc):
+    fx = Game_job_fixture(tc)
+    tc.addCleanup(game_jobs.close_pooled_players)
+    fx.job.player_w.games_per_process = 5
+    fx.add_handler('w', 'genmove', lambda args:"fail")
+    result = fx.job.run()
+    tc.assertTrue(result.game_result.is_forfeit)
+    tc.assertTrue(fx.get_channel('two').is_closed)
+
+def test_game_job_games_per_process_void(tc):
+    fx = Game_job_fixture(tc)
+    tc.addCleanup(game_jobs.close_pooled_players)
+    fx.job.player_w.games_per_process = 5
+    fx.force_error('w', 'komi')
+    tc.assertRaises(JobFailed, fx.job.run)
+    tc.assertTrue(fx.get_channel('two').is_closed)
+
+def test_game_job_engine_cache(tc):
+    fx = Game_job_fixture(tc)
+    sandbox = tc.sandbox()
+    executable = os.path.join(sandbox, "engine")
+    with open(executable, "w") as f:
+        f.write("#!/bin/sh\n")
+    os.chmod(executable, 0755)
+    fx.job.player_b.cmd_args[0] = executable
+    fx.add_handler('b', 'name', lambda args:"cached engine")
+    fx.job.engine_cache_pathname = os.path.join(sandbox, "test.engines")
+    def get_commands(code):
+        return [command for (command, args)
+                in fx.get_channel(code).engine.commands_handled]
+    result = fx.job.run()
+    tc.assertEqual(result.game_result.sgf_result, "B+10.5")
+    tc.assertIn('name', get_commands('one'))
+    tc.assertIn('known_command', get_commands('one'))
+    tc.assertTrue(os.path.exists(fx.job.engine_cache_pathname))
+    result = fx.job.run()
+    tc.assertEqual(result.engine_descriptions['one'].name, "cached engine")
+    tc.assertNotIn('name', get_commands('one'))
+    tc.assertNotIn('known_command', get_commands('one'))
+    # Player two's executable isn't found, so it isn't cached
+    tc.assertIn('name', get_commands('two'))
+    # Changing the executable invalidates the entry
+    os.utime(executable, (1000, 1000))
+    result = fx.job.run()
+    tc.assertIn('name', get_commands('one'))
+
 def test_game_job_worker_id(tc):
     fx = gtp_engine_fixtures.Mock_subprocess_fixture(tc)
     gj = Game_job_fixture(tc)
@@ -342,6 +519,57 @@ def test_game_job_worker_id(tc):
     tc.assertEqual(channel.requested_env['GOMILL_GAME_ID'], 'gameid')
     tc.assertEqual(channel.requested_env['GOMILL_SLOT'], '0')
 
+def test_game_job_prelaunch(tc):
+    fx = Game_job_fixture(tc)
+    fx.job.gtp_game_timeout = 600.0
+    fx.job.player_w.startup_gtp_commands = [('komi', ['7.5'])]
+    fx.job.prelaunch(0)
+    channel_b = fx.get_channel('one')
+    channel_w = fx.get_channel('two')
+    tc.assertEqual(channel_w.requested_env['GOMILL_SLOT'], '0')
+    tc.assertEqual([command for (command, args)
+                    in channel_w.engine.commands_handled],
+                   ['protocol_version', 'name', 'version', 'known_command',
+                    'komi'])
+    tc.assertIsNone(channel_b.requested_deadline)
+    start_time = time.time()
+    result = fx.job.run(0)
+    tc.assertEqual(result.game_result.sgf_result, "B+10.5")
+    tc.assertIs(fx.get_channel('one'), channel_b)
+    tc.assertTrue(channel_b.is_closed)
+    tc.assertTrue(start_time + 600 <= channel_b.requested_deadline
+                  <= time.time() + 600)
+    tc.assertIsNone(fx.job._prelaunched_setup)
+    # The job can be run again in the normal way
+    result = fx.job.run(0)
+    tc.assertIsNot(fx.get_channel('one'), channel_b)
+
+def test_game_job_prelaunch_error(tc):
+    fx = Game_job_fixture(tc)
+    fx.force_error('w', 'failplease')
+    fx.job.player_w.startup_gtp_commands = [('failplease', [])]
+    fx.job.prelaunch()
+    with tc.assertRaises(JobFailed) as ar:
+        fx.job.run()
+    tc.assertEqual(
+        str(ar.exception),
+        "aborting game due to error:\n"
+        "failure response from 'failplease' to player two:\n"
+        "handler forced to fail")
+    tc.assertTrue(fx.get_channel('two').is_closed)
+
+def test_game_job_prelaunch_pooled_player(tc):
+    fx = Game_job_fixture(tc)
+    tc.addCleanup(game_jobs.close_pooled_players)
+    fx.job.player_b.games_per_process = 2
+    fx.job.prelaunch()
+    # Players with reused engines are only started when the job is run
+    tc.assertRaises(KeyError, fx.get_channel, 'one')
+    fx.get_channel('two')
+    result = fx.job.run()
+    tc.assertEqual(result.game_result.sgf_result, "B+10.5")
+    tc.assertFalse(fx.get_channel('one').is_closed)
+
 def test_game_job_stderr_discarded(tc):
     fx = Game_job_fixture(tc)
     fx.job.player_b.discard_stderr = True
@@ -709,6 +937,29 @@ def test_check_player_env(tc):
     tc.assertEqual(channel.requested_env['GOMILL_GAME_ID'], 'startup-check')
     tc.assertIn('PATH', channel.requested_env)
 
+def test_check_player_socket(tc):
+    fx = Player_check_fixture(tc)
+    server = gtp_engine_fixtures.Gtp_server_fixture(
+        tc, gtp_engine_fixtures.get_test_player_engine())
+    fx.player.gtp_address = server.address
+    fx.player.cwd = "/nonexistent/directory"
+    tc.assertEqual(game_jobs.check_player(fx.check), [])
+    tc.assertRaises(KeyError, fx.get_channel, 'test')
+    tc.assertListEqual(
+        [command for (command, args) in server.engine.commands_handled],
+        ['protocol_version', 'boardsize', 'clear_board', 'komi', 'quit'])
+
+def test_check_player_socket_connection_failure(tc):
+    fx = Player_check_fixture(tc)
+    address = os.path.join(tc.sandbox(), "nonexistent.sock")
+    fx.player.gtp_address = address
+    with tc.assertRaises(game_jobs.CheckFailed) as ar:
+        game_jobs.check_player(fx.check)
+    tc.assertEqual(str(ar.exception),
+                   "error connecting to test:\n"
+                   "error connecting to %s:\n"
+                   "[Errno 2] No such file or directory" % address)
+
 def test_check_player_exec_failure(tc):
     fx = Player_check_fixture(tc)
     fx.player.cmd_args.append('fail=startup')
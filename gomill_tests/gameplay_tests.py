@@ -28,9 +28,11 @@ class Game_fixture(object):
         self.tc.assertIs(self.game.seen_resignation, False)
         self.tc.assertIs(self.game.seen_claim, False)
         self.tc.assertIs(self.game.seen_forfeit, False)
+        self.tc.assertIs(self.game.seen_adjudication, False)
         self.tc.assertIs(self.game.hit_move_limit, False)
         self.tc.assertIsNone(self.game.winner)
         self.tc.assertIsNone(self.game.forfeit_reason)
+        self.tc.assertIsNone(self.game.adjudication_reason)
 
     def check_over(self, expected_reason):
         self.tc.assertIs(self.game.is_over, True)
@@ -39,6 +41,7 @@ class Game_fixture(object):
             'seen_resignation',
             'seen_claim',
             'seen_forfeit',
+            'seen_adjudication',
             'hit_move_limit',
             ]:
             if reason == expected_reason:
@@ -47,12 +50,16 @@ class Game_fixture(object):
                 self.tc.assertIs(getattr(self.game, reason), False)
         if expected_reason in ('passed_out', 'hit_move_limit'):
             self.tc.assertIsNone(self.game.winner)
-        else:
+        elif expected_reason != 'seen_adjudication':
             self.tc.assertIsNotNone(self.game.winner)
         if expected_reason == 'seen_forfeit':
             self.tc.assertIsNotNone(self.game.forfeit_reason)
         else:
             self.tc.assertIsNone(self.game.forfeit_reason)
+        if expected_reason == 'seen_adjudication':
+            self.tc.assertIsNotNone(self.game.adjudication_reason)
+        else:
+            self.tc.assertIsNone(self.game.adjudication_reason)
 
     def check_legal_moves(self, moves):
         for colour, vertex in moves:
@@ -157,6 +164,51 @@ def test_game_ko_violation(tc):
         ('b', 'E5'),
         ])
 
+def test_game_ko_rule(tc):
+    fx = Game_fixture(tc)
+    tc.assertEqual(fx.game.ko_rule, 'simple')
+    fx.game.set_ko_rule('situational')
+    tc.assertEqual(fx.game.ko_rule, 'situational')
+    tc.assertRaisesRegexp(ValueError, "unknown ko rule: superko",
+                          fx.game.set_ko_rule, 'superko')
+    tc.assertEqual(fx.game.ko_rule, 'situational')
+
+# A self-capture at A1 recreates the position before black's move
+self_capture_setup_moves = [
+    ('b', 'C5'), ('w', 'A2'),
+    ('b', 'D6'), ('w', 'B1'),
+    ]
+
+def test_game_positional_superko(tc):
+    fx = Game_fixture(tc)
+    fx.check_legal_moves(self_capture_setup_moves + [('b', 'A1')])
+    tc.assertEqual(fx.game.move_count, 5)
+
+    fx = Game_fixture(tc)
+    fx.game.set_ko_rule('positional')
+    fx.check_legal_moves(self_capture_setup_moves)
+    fx.game.record_move('b', move_from_vertex('A1', 9))
+    fx.check_over('seen_forfeit')
+    tc.assertEqual(fx.game.forfeit_reason,
+                   "attempted move to A1, forbidden by positional superko")
+    tc.assertEqual(fx.game.winner, 'w')
+    tc.assertEqual(fx.game.move_count, 4)
+
+def test_game_situational_superko(tc):
+    fx = Game_fixture(tc)
+    fx.game.set_ko_rule('situational')
+    fx.check_legal_moves(self_capture_setup_moves + [('b', 'A1')])
+
+    fx = Game_fixture(tc)
+    fx.game.set_ko_rule('situational')
+    fx.check_legal_moves(self_capture_setup_moves + [
+        ('b', 'E5'), ('w', 'pass'),
+        ])
+    fx.game.record_move('b', move_from_vertex('A1', 9))
+    fx.check_over('seen_forfeit')
+    tc.assertEqual(fx.game.forfeit_reason,
+                   "attempted move to A1, forbidden by situational superko")
+
 def test_game_move_limit(tc):
     fx = Game_fixture(tc)
     game = fx.game
@@ -204,6 +256,21 @@ def test_game_record_forfeit(tc):
     tc.assertEqual(fx.game.winner, 'w')
     tc.assertEqual(fx.game.forfeit_reason, "no good reason")
 
+def test_game_record_adjudication(tc):
+    fx = Game_fixture(tc)
+    fx.game.record_move('b', (2, 3))
+    fx.check_not_over()
+    fx.game.record_adjudication("looks good", 'b')
+    fx.check_over('seen_adjudication')
+    tc.assertEqual(fx.game.winner, 'b')
+    tc.assertEqual(fx.game.adjudication_reason, "looks good")
+    tc.assertRaises(gameplay.GameStateError,
+                    fx.game.record_adjudication, "again")
+    fx2 = Game_fixture(tc)
+    fx2.game.record_adjudication("needs scoring")
+    fx2.check_over('seen_adjudication')
+    tc.assertIsNone(fx2.game.winner)
+
 DIAGRAM2 = """\
 9  .  .  .  .  .  .  .  .  #
 8  .  .  .  .  .  .  .  .  .
@@ -320,6 +387,26 @@ def test_game_score_from_position(tc):
     tc.assertEqual(gs2.margin, 0)
     tc.assertIsNone(gs2.get_detail())
 
+def test_game_score_from_position_remove_dead(tc):
+    board = ascii_boards.interpret_diagram("""\
+9  .  #  .  o  #  .  .  .  .
+8  #  #  #  .  #  .  .  .  .
+7  .  .  #  #  #  .  .  .  .
+6  #  #  #  .  .  .  .  .  .
+5  .  .  .  .  .  .  .  .  .
+4  .  .  .  .  .  .  .  .  .
+3  .  .  .  .  .  .  .  .  .
+2  .  .  .  .  .  .  .  .  .
+1  .  .  .  .  .  .  .  .  o
+   A  B  C  D  E  F  G  H  J
+""", 9)
+    gs1 = gameplay.Game_score.from_position(board, komi=7)
+    tc.assertEqual(gs1.winner, 'b')
+    tc.assertEqual(gs1.margin, 15-2-7)
+    gs2 = gameplay.Game_score.from_position(board, komi=7, remove_dead=True)
+    tc.assertEqual(gs2.winner, 'b')
+    tc.assertEqual(gs2.margin, 18-1-7)
+
 
 ### Result
 
@@ -395,6 +482,17 @@ def test_result_from_unscored_game(tc):
     tc.assertRaisesRegexp(
         ValueError, "^game is passed out$",
         gameplay.Result.from_unscored_game, game3)
+    game4 = gameplay.Game(boards.Board(19))
+    game4.record_adjudication("reason", 'w')
+    result = gameplay.Result.from_unscored_game(game4)
+    tc.assertEqual(result.sgf_result, "W+")
+    tc.assertEqual(result.detail, "adjudicated: reason")
+    tc.assertIs(result.is_adjudicated, True)
+    game5 = gameplay.Game(boards.Board(19))
+    game5.record_adjudication("reason")
+    tc.assertRaisesRegexp(
+        ValueError, "^adjudicated game needs scoring$",
+        gameplay.Result.from_unscored_game, game5)
 
 def test_result_from_game_score(tc):
     gs = gameplay.Game_score('b', 1)
@@ -913,6 +1011,120 @@ def test_game_runner_move_limit(tc):
         ('b', (1, 2), None),
         ])
 
+def test_game_runner_adjudication_pass_alive(tc):
+    fx = Game_runner_fixture(
+        tc, moves=[
+            ('b', 'C1'), ('w', 'E1'),
+            ('b', 'C2'), ('w', 'E2'),
+            ('b', 'C3'), ('w', 'E3'),
+            ('b', 'C4'), ('w', 'E4'),
+            ('b', 'C5'), ('w', 'E5'),
+            ('b', 'B1'), ('w', 'D2'),
+            ('b', 'B3'), ('w', 'D4'),
+            ('b', 'B5'), ('w', 'D5'),
+            ('b', 'A2'), ('w', 'D1'),
+            ],
+        komi=2)
+    fx.game_runner.set_adjudication(pass_alive_margin=10)
+    fx.run_game()
+    # After A2, Black's 21 points of pass-alive stones and territory win even
+    # if White gets the other four.
+    tc.assertEqual(fx.backend.log[-4:], [
+        "get_move <- b: move/A2",
+        "get_last_move_comment <- b",
+        "notify_move -> w A2",
+        "end_game",
+        ])
+    tc.assertIsNone(fx.game_runner.get_game_score())
+    result = fx.game_runner.result
+    tc.assertEqual(result.sgf_result, 'B+')
+    tc.assertEqual(result.detail, "adjudicated: lead of 15 in pass-alive area")
+    tc.assertIs(result.is_adjudicated, True)
+    tc.assertEqual(len(fx.game_runner.get_moves()), 17)
+
+def test_game_runner_adjudication_pass_alive_komi(tc):
+    # Komi larger than the margin doesn't decide the game by itself
+    fx = Game_runner_fixture(
+        tc, moves=[('b', 'C1'), ('w', 'D1'), ('b', 'C2'), ('w', 'D2')],
+        komi=7.5)
+    fx.game_runner.set_adjudication(pass_alive_margin=5)
+    fx.run_game()
+    result = fx.game_runner.result
+    tc.assertIs(result.is_adjudicated, False)
+    tc.assertEqual(len(fx.game_runner.get_moves()), 6)
+
+def test_game_runner_adjudication_pass_alive_handicap(tc):
+    class _Backend(Testing_backend):
+        def get_free_handicap(self, handicap):
+            return [move_from_vertex(s, self._size) for s in "B5 A4".split()]
+
+    # With handicap compensation, the handicap stones count against Black, so
+    # the game continues for longer.
+    for handicap_compensation, expected_detail, expected_moves in [
+            ('no', "adjudicated: lead of 17 in pass-alive area", 14),
+            ('full', "adjudicated: lead of 23 in pass-alive area", 16)]:
+        fx = Game_runner_fixture(
+            tc, backend_cls=_Backend, moves=[
+                ('w', 'E1'), ('b', 'C1'),
+                ('w', 'E2'), ('b', 'C2'),
+                ('w', 'E3'), ('b', 'C3'),
+                ('w', 'E4'), ('b', 'C4'),
+                ('w', 'E5'), ('b', 'C5'),
+                ('w', 'D2'), ('b', 'B1'),
+                ('w', 'D4'), ('b', 'B3'),
+                ('w', 'D5'), ('b', 'A2'),
+                ('w', 'D1'),
+                ],
+            komi=0)
+        fx.game_runner.set_adjudication(
+            pass_alive_margin=16.5,
+            handicap_compensation=handicap_compensation)
+        fx.game_runner.prepare()
+        fx.game_runner.set_handicap(2, is_free=True)
+        fx.game_runner.run()
+        tc.assertEqual(fx.game_runner.result.detail, expected_detail)
+        tc.assertEqual(len(fx.game_runner.get_moves()), expected_moves)
+
+def test_game_runner_adjudication_stable_score(tc):
+    fx = Game_runner_fixture(
+        tc, moves=[
+            ('b', 'C1'), ('w', 'D1'),
+            ('b', 'C2'), ('w', 'D2'),
+            ('b', 'C3'), ('w', 'D3'),
+            ('b', 'C4'), ('w', 'D4'),
+            ('b', 'C5'), ('w', 'D5'),
+            ('b', 'A1'), ('w', 'E1'),
+            ('b', 'A2'), ('w', 'E2'),
+            ])
+    fx.game_runner.set_adjudication(stable_score_moves=3)
+    fx.run_game()
+    tc.assertEqual(fx.backend.log[-5:], [
+        "get_move <- b: move/A2",
+        "get_last_move_comment <- b",
+        "notify_move -> w A2",
+        "end_game",
+        "score_game",
+        ])
+    tc.assertIs(fx.game_runner.get_game_score(), fx.backend.score_to_return)
+    result = fx.game_runner.result
+    tc.assertEqual(result.sgf_result, 'W+99')
+    tc.assertEqual(result.detail, "adjudicated: score unchanged for 3 moves")
+    tc.assertIs(result.is_adjudicated, True)
+    tc.assertEqual(len(fx.game_runner.get_moves()), 13)
+
+def test_game_runner_adjudication_settings(tc):
+    fx = Game_runner_fixture(tc, moves=[])
+    tc.assertRaises(ValueError, fx.game_runner.set_adjudication, None, 0)
+    tc.assertRaises(ValueError, fx.game_runner.set_adjudication, -1)
+    tc.assertRaises(ValueError, fx.game_runner.set_adjudication, 1, None,
+                    'maybe')
+    fx.game_runner.set_adjudication(pass_alive_margin=30,
+                                    stable_score_moves=5)
+    fx.run_game()
+    result = fx.game_runner.result
+    tc.assertEqual(result.sgf_result, 'W+99')
+    tc.assertIs(result.is_adjudicated, False)
+
 def test_game_runner_last_move_comment(tc):
     fx = Game_runner_fixture(
         tc,
@@ -6,8 +6,8 @@ This is also used by gtp_engine_fixtures (and so by gtp proxy tests).
 
 from gomill import gtp_controller
 from gomill.gtp_controller import (
-    GtpChannelError, GtpProtocolError, GtpTransportError, GtpChannelClosed,
-    BadGtpResponse)
+    GtpChannelError, GtpProtocolError, GtpTransportError, GtpTimeout,
+    GtpChannelClosed, BadGtpResponse)
 
 from gomill_tests import test_support
 from gomill_tests.test_framework import SupporterError
@@ -24,14 +24,34 @@ class Preprogrammed_gtp_channel(gtp_controller.Subprocess_gtp_channel):
     Pass hangs_before_eof True to simulate an engine that doesn't close its
     response pipe when the preprogrammed response data runs out.
 
+    By default the response stream is read a line at a time; pass chunk_size
+    to read it in chunks of that many bytes instead.
+
     The command stream is available from get_command_stream().
 
     """
-    def __init__(self, response, hangs_before_eof=False):
+    def __init__(self, response, hangs_before_eof=False, chunk_size=None):
         gtp_controller.Linebased_gtp_channel.__init__(self)
         self.command_pipe = test_support.Mock_writing_pipe()
         self.response_pipe = test_support.Mock_reading_pipe(response)
         self.response_pipe.hangs_before_eof = hangs_before_eof
+        self.chunk_size = chunk_size
+
+    # We use the Subprocess_gtp_channel implementation for sending commands and
+    # closing, but read from the mock pipe directly (without time limits).
+
+    def get_response_impl(self):
+        return gtp_controller.Linebased_gtp_channel.get_response_impl(self)
+
+    def get_response_data(self):
+        # Reading a line at a time means the mock pipe's simulated breakage
+        # and hanging behave as they would for a real pipe.
+        if self.chunk_size is not None:
+            return self.response_pipe.read(self.chunk_size)
+        return self.response_pipe.readline()
+
+    def get_response_byte(self):
+        return self.response_pipe.read(1)
 
     def close(self):
         self.command_pipe.close()
@@ -61,10 +81,10 @@ class Testing_gtp_channel(gtp_controller.Linebased_gtp_channel):
       engine    -- the engine it was instantiated with
       is_closed -- bool (closed() has been called without a forced error)
 
-    This raises an error if sent two commands without requesting a response in
-    between, or if asked for a response when no command was sent since the last
-    response. (GTP permits stacking up commands, but Gtp_controller should never
-    do it, so we want to report it). Similarly we reject empty command lines.
+    This raises an error if asked for a response when there's no command
+    whose response hasn't been read. Similarly we reject empty command lines.
+    Several commands may be sent before reading the responses (as
+    Gtp_controller.do_commands() does).
 
     Unlike Internal_gtp_channel, this runs the command at the point when it is
     sent.
@@ -80,6 +100,9 @@ class Testing_gtp_channel(gtp_controller.Linebased_gtp_channel):
                              starts with this string)
       fail_next_response  -- bool (get_response_line raises GtpTransportError)
       force_next_response -- string (get_response_line uses this string)
+      hang_command        -- string (if command line starts with this string,
+                             the engine doesn't run it, and get_response_line
+                             raises GtpTimeout instead of returning a response)
       fail_close          -- bool (close raises GtpTransportError)
 
     """
@@ -95,12 +118,12 @@ class Testing_gtp_channel(gtp_controller.Linebased_gtp_channel):
         self.force_next_response = None
         self.fail_close = False
         self.fail_command = None
+        self.hang_command = None
+        self.is_hung = False
 
     def send_command_line(self, command):
         if self.is_closed:
             raise SupporterError("channel is closed")
-        if self.stored_response != "":
-            raise SupporterError("two commands in a row")
         if self.session_is_ended:
             if self.engine_exit_breaks_commands:
                 raise GtpChannelClosed("engine has closed the command channel")
@@ -111,15 +134,23 @@ class Testing_gtp_channel(gtp_controller.Linebased_gtp_channel):
         if self.fail_command and command.startswith(self.fail_command):
             self.fail_command = None
             raise GtpTransportError("forced failure for send_command_line")
-        self.stored_response, self.session_is_ended = \
-            self.engine.handle_line(command)
-        if self.stored_response is None:
+        if self.is_hung:
+            return
+        if self.hang_command and command.startswith(self.hang_command):
+            self.hang_command = None
+            self.is_hung = True
+            return
+        response, self.session_is_ended = self.engine.handle_line(command)
+        if response is None:
             raise SupporterError("empty command line")
+        self.stored_response += response
 
     def get_response_line(self):
         if self.is_closed:
             raise SupporterError("channel is closed")
         if self.stored_response == "":
+            if self.is_hung:
+                raise GtpTimeout("forced timeout")
             if self.session_is_ended:
                 return ""
             raise SupporterError("response request without command")
@@ -3,11 +3,15 @@
 from __future__ import with_statement
 
 import os
+import signal
+import sys
+import threading
+import time
 
 from gomill import gtp_controller
 from gomill.gtp_controller import (
-    GtpChannelError, GtpProtocolError, GtpTransportError, GtpChannelClosed,
-    BadGtpResponse, Gtp_controller)
+    GtpChannelError, GtpProtocolError, GtpTransportError, GtpTimeout,
+    GtpChannelClosed, BadGtpResponse, Gtp_controller)
 
 from gomill_tests import gomill_test_support
 from gomill_tests import gtp_controller_test_support
@@ -88,6 +92,26 @@ def test_linebased_channel_response_cleaning(tc):
     tc.assertEqual(channel.get_response(), (False, "8ab\xc3\xa7de"))
     tc.assertEqual(channel.get_response(), (True, "aaa  \n  bbb ccc\nddd"))
 
+def test_linebased_channel_chunked_responses(tc):
+    # The response data may arrive in arbitrary pieces
+    response_stream = (
+        "\r\n  \n= 1\n\n"
+        "? 2a\r\n2b\x01\n\t\n\x7f2c\n\r\n"
+        "\n\n\n=\t3a\n\n \n"
+        "=\n\n"
+        "= 5a\n5b")
+    for chunk_size in (1, 2, 3, 5, 1000):
+        channel = Preprogrammed_gtp_channel(response_stream,
+                                            chunk_size=chunk_size)
+        tc.assertEqual(channel.get_response(), (False, "1"))
+        tc.assertEqual(channel.get_response(), (True, "2a\n2b\n \n2c"))
+        tc.assertEqual(channel.get_response(), (False, "3a"))
+        tc.assertEqual(channel.get_response(), (False, ""))
+        tc.assertEqual(channel.get_response(), (False, "5a\n5b"))
+        tc.assertRaisesRegexp(
+            GtpChannelClosed, "engine has closed the response channel",
+            channel.get_response)
+
 def test_linebased_channel_invalid_responses(tc):
     channel = Preprogrammed_gtp_channel(
         # good response first, to get past the "isn't speaking GTP" checking
@@ -240,9 +264,13 @@ def test_testing_gtp_channel_sequencing(tc):
         SupporterError, "response request without command",
         channel.get_response)
     channel.send_command("test", [])
+    channel.send_command("multiline", [])
+    tc.assertEqual(channel.get_response(), (False, "test response"))
+    tc.assertEqual(channel.get_response(),
+                   (False, "first line  \n  second line\nthird line"))
     tc.assertRaisesRegexp(
-        SupporterError, "two commands in a row",
-        channel.send_command, "test", [])
+        SupporterError, "response request without command",
+        channel.get_response)
 
 def test_testing_gtp_force_error(tc):
     engine = gtp_engine_fixtures.get_test_engine()
@@ -369,6 +397,65 @@ def test_controller_response_protocol_error(tc):
     tc.assertTrue(controller.channel_is_bad)
     tc.assertListEqual(controller.retrieve_error_messages(), [])
 
+def test_do_commands(tc):
+    channel = gtp_engine_fixtures.get_test_channel()
+    controller = Gtp_controller(channel, 'player test')
+    tc.assertEqual(controller.do_commands([]), [])
+    tc.assertEqual(
+        controller.do_commands([("test",), ("test", "ab", "cd"), ["multiline"]]),
+        ["test response", "args: ab cd",
+         "first line  \n  second line\nthird line"])
+    tc.assertEqual(channel.engine.commands_handled,
+                   [('test', []), ('test', ['ab', 'cd']), ('multiline', [])])
+
+def test_do_commands_failure_response(tc):
+    channel = gtp_engine_fixtures.get_test_channel()
+    controller = Gtp_controller(channel, 'player test')
+    with tc.assertRaises(BadGtpResponse) as ar:
+        controller.do_commands([("test",), ("error",), ("test", "x"),
+                                ("error",)])
+    tc.assertEqual(str(ar.exception),
+                   "failure response from 'error' to player test:\n"
+                   "normal error")
+    tc.assertEqual(ar.exception.gtp_command, "error")
+    tc.assertEqual(ar.exception.gtp_arguments, [])
+    tc.assertEqual(len(channel.engine.commands_handled), 4)
+    tc.assertFalse(controller.channel_is_bad)
+    # All the responses were read, so the channel is still in step
+    tc.assertEqual(controller.do_command("test", "y"), "args: y")
+
+def test_do_commands_bad_argument(tc):
+    channel = gtp_engine_fixtures.get_test_channel()
+    controller = Gtp_controller(channel, 'player test')
+    tc.assertRaisesRegexp(
+        ValueError, "^bad argument$",
+        controller.do_commands, [("test",), ("test", "a b")])
+    tc.assertEqual(channel.engine.commands_handled, [])
+    tc.assertFalse(controller.channel_is_bad)
+
+def test_do_commands_transport_errors(tc):
+    channel = gtp_engine_fixtures.get_test_channel()
+    controller = Gtp_controller(channel, 'player test')
+    channel.fail_command = "multiline"
+    with tc.assertRaises(GtpTransportError) as ar:
+        controller.do_commands([("test",), ("multiline",), ("test",)])
+    tc.assertEqual(
+        str(ar.exception),
+        "transport error sending 'multiline' to player test:\n"
+        "forced failure for send_command_line")
+    tc.assertTrue(controller.channel_is_bad)
+
+    channel = gtp_engine_fixtures.get_test_channel()
+    controller = Gtp_controller(channel, 'player test')
+    channel.force_next_response = "= ok\n\n# error\n\n"
+    with tc.assertRaises(GtpProtocolError) as ar:
+        controller.do_commands([("test",), ("test", "x")])
+    tc.assertEqual(
+        str(ar.exception),
+        "GTP protocol error reading response to 'test x' from player test:\n"
+        "no success/failure indication from engine: first line is `# error`")
+    tc.assertTrue(controller.channel_is_bad)
+
 def test_controller_close(tc):
     channel = gtp_engine_fixtures.get_test_channel()
     controller = Gtp_controller(channel, 'player test')
@@ -754,9 +841,226 @@ def test_subprocess_channel_with_controller(tc):
     rusage = channel.resource_usage
     tc.assertTrue(hasattr(rusage, 'ru_utime'))
 
+# Fake engine which answers one command (slowly if there's an argument), then
+# hangs; if the argument is 'stubborn' it also ignores SIGTERM.
+_SLOW_ENGINE = """
+import signal, sys, time
+words = sys.stdin.readline().split()
+if words[1:] == ['stubborn']:
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+if words[1:]:
+    time.sleep(1)
+sys.stdout.write('= ok\\n\\n')
+sys.stdout.flush()
+time.sleep(30)
+"""
+
+def test_subprocess_channel_response_timeout(tc):
+    channel = gtp_controller.Subprocess_gtp_channel(
+        [sys.executable, "-c", _SLOW_ENGINE])
+    controller = Gtp_controller(channel, 'subprocess test')
+    channel.set_response_timeout(2)
+    tc.assertEqual(controller.do_command("test"), "ok")
+    channel.set_response_timeout(0.1)
+    with tc.assertRaises(GtpTimeout) as ar:
+        controller.do_command("test")
+    tc.assertEqual(
+        str(ar.exception),
+        "timeout reading response to 'test' from subprocess test:\n"
+        "no response within 0.1 seconds")
+    tc.assertTrue(controller.channel_is_bad)
+    channel.set_exit_timeout(0.1)
+    controller.close()
+    tc.assertTrue(os.WIFSIGNALED(channel.exit_status))
+    tc.assertEqual(os.WTERMSIG(channel.exit_status), signal.SIGTERM)
+
+def test_subprocess_channel_deadline(tc):
+    channel = gtp_controller.Subprocess_gtp_channel(
+        [sys.executable, "-c", _SLOW_ENGINE])
+    controller = Gtp_controller(channel, 'subprocess test')
+    channel.set_response_timeout(10)
+    channel.set_deadline(time.time() + 0.3)
+    with tc.assertRaises(GtpTimeout) as ar:
+        controller.do_command("test", "stubborn")
+    tc.assertEqual(
+        str(ar.exception),
+        "timeout reading response to first command (test stubborn) "
+        "from subprocess test:\n"
+        "deadline passed")
+    channel.set_exit_timeout(0.1)
+    controller.close()
+    tc.assertTrue(os.WIFSIGNALED(channel.exit_status))
+    tc.assertEqual(os.WTERMSIG(channel.exit_status), signal.SIGKILL)
+
+def _wait_until_connection_unusable(channel):
+    # The server closes the connection just after sending the response to
+    # 'quit', so give it a moment.
+    for i in xrange(200):
+        if not channel.is_connection_usable():
+            return
+        time.sleep(0.01)
+
+def test_socket_channel(tc):
+    fx = gtp_engine_fixtures.Gtp_server_fixture(
+        tc, gtp_engine_fixtures.get_test_engine())
+    channel = gtp_controller.Socket_gtp_channel(fx.address)
+    channel.send_command("test", [])
+    channel.send_command("test", ["abc", "def"])
+    channel.send_command("error", [])
+    tc.assertEqual(channel.get_response(), (False, "test response"))
+    tc.assertEqual(channel.get_response(), (False, "args: abc def"))
+    tc.assertEqual(channel.get_response(), (True, "normal error"))
+    channel.close()
+    tc.assertIsNone(channel.resource_usage)
+    # The server accepts another session
+    channel2 = gtp_controller.Socket_gtp_channel(fx.address)
+    channel2.send_command("quit", [])
+    tc.assertEqual(channel2.get_response(), (False, ""))
+    channel2.close()
+    tc.assertListEqual(
+        [command for (command, args) in fx.engine.commands_handled],
+        ['test', 'test', 'error', 'quit'])
+
+def test_socket_channel_tcp(tc):
+    fx = gtp_engine_fixtures.Gtp_server_fixture(
+        tc, gtp_engine_fixtures.get_test_engine(), address=("127.0.0.1", 0))
+    channel = gtp_controller.Socket_gtp_channel(fx.address)
+    controller = Gtp_controller(channel, 'socket test')
+    tc.assertEqual(controller.do_command("test"), "test response")
+    controller.safe_close()
+    tc.assertEqual(controller.retrieve_error_messages(), [])
+
+def test_socket_channel_connect_error(tc):
+    address = os.path.join(tc.sandbox(), "nonexistent.sock")
+    with tc.assertRaises(GtpChannelError) as ar:
+        gtp_controller.Socket_gtp_channel(
+            address, connect_attempts=2, retry_interval=0.01)
+    tc.assertEqual(
+        str(ar.exception),
+        "error connecting to %s:\n[Errno 2] No such file or directory" %
+        address)
+
+def test_socket_channel_reconnect(tc):
+    fx = gtp_engine_fixtures.Gtp_server_fixture(
+        tc, gtp_engine_fixtures.get_test_engine())
+    channel = gtp_controller.Socket_gtp_channel(fx.address)
+    controller = Gtp_controller(channel, 'socket test')
+    tc.assertTrue(channel.is_connection_usable())
+    controller.do_command("quit")
+    _wait_until_connection_unusable(channel)
+    tc.assertFalse(channel.is_connection_usable())
+    channel.reconnect()
+    tc.assertTrue(channel.is_connection_usable())
+    tc.assertEqual(controller.do_command("test"), "test response")
+    controller.close()
+
+def test_socket_channel_response_timeout(tc):
+    engine = gtp_engine_fixtures.get_test_engine()
+    released = threading.Event()
+    def handle_wait(args):
+        released.wait(5)
+    engine.add_command("wait", handle_wait)
+    fx = gtp_engine_fixtures.Gtp_server_fixture(tc, engine)
+    tc.addCleanup(released.set)
+    channel = gtp_controller.Socket_gtp_channel(
+        fx.address, response_timeout=0.1)
+    controller = Gtp_controller(channel, 'socket test')
+    tc.assertEqual(controller.do_command("test"), "test response")
+    with tc.assertRaises(GtpTimeout) as ar:
+        controller.do_command("wait")
+    tc.assertEqual(
+        str(ar.exception),
+        "timeout reading response to 'wait' from socket test:\n"
+        "no response within 0.1 seconds")
+    controller.close()
+
+def test_channel_pool(tc):
+    fx1 = gtp_engine_fixtures.Gtp_server_fixture(
+        tc, gtp_engine_fixtures.get_test_engine())
+    fx2 = gtp_engine_fixtures.Gtp_server_fixture(
+        tc, gtp_engine_fixtures.get_test_engine(), address=("127.0.0.1", 0))
+    pool = gtp_controller.Gtp_channel_pool()
+    tc.assertIsNone(pool.take_channel('k1'))
+    channel1 = gtp_controller.Socket_gtp_channel(fx1.address)
+    pool.release_channel('k1', channel1)
+    tc.assertIsNone(pool.take_channel('k2'))
+    tc.assertIs(pool.take_channel('k1'), channel1)
+    tc.assertIsNone(pool.take_channel('k1'))
+    channel2 = gtp_controller.Socket_gtp_channel(fx2.address)
+    pool.release_channel('k2', channel2)
+
+    # A pooled connection which has gone away is discarded
+    controller = Gtp_controller(channel1, 'socket test')
+    controller.do_command("quit")
+    pool.release_channel('k1', controller.detach_channel())
+    _wait_until_connection_unusable(channel1)
+    tc.assertIsNone(pool.take_channel('k1'))
+    tc.assertIsNone(channel1.socket)
+
+    channel3 = gtp_controller.Socket_gtp_channel(fx1.address)
+    controller = Gtp_controller(channel3, 'socket test')
+    tc.assertEqual(controller.do_command("test"), "test response")
+    pool.release_channel('k1', controller.detach_channel())
+
+    pool.close_all()
+    tc.assertIsNone(pool.take_channel('k1'))
+    tc.assertIsNone(pool.take_channel('k2'))
+    tc.assertListEqual(
+        [command for (command, args) in fx1.engine.commands_handled],
+        ['quit', 'test', 'quit'])
+    tc.assertListEqual(
+        [command for (command, args) in fx2.engine.commands_handled],
+        ['quit'])
+
+def test_channel_pool_max_uses(tc):
+    msf = gtp_engine_fixtures.Mock_subprocess_fixture(tc)
+    pool = gtp_controller.Gtp_channel_pool()
+    channel = gtp_controller.Subprocess_gtp_channel(['test', 'id=one'])
+    pool.release_channel('k', channel, max_uses=2)
+    tc.assertIs(pool.take_channel('k'), channel)
+    pool.release_channel('k', channel, max_uses=2)
+    tc.assertIsNone(pool.take_channel('k'))
+    tc.assertTrue(channel.is_closed)
+    tc.assertEqual(channel.engine.commands_handled, [('quit', [])])
+
 
 ### Game_controller
 
+def test_engine_capability_cache(tc):
+    cache = gtp_controller.Engine_capability_cache()
+    tc.assertIsNone(cache.get('key1'))
+    description = gtp_controller.Engine_description("name", "v1", None)
+    cache.update('key1', gtp_controller.Engine_capabilities(
+        {'foo' : True}, description))
+    cache.update('key1', gtp_controller.Engine_capabilities({'bar' : False}))
+    capabilities = cache.get('key1')
+    tc.assertEqual(capabilities.known_commands, {'foo' : True, 'bar' : False})
+    tc.assertIs(capabilities.engine_description, description)
+    # get() returns a copy
+    capabilities.known_commands['baz'] = True
+    tc.assertNotIn('baz', cache.get('key1').known_commands)
+    tc.assertIsNone(cache.get('key2'))
+
+    pathname = os.path.join(tc.sandbox(), "test.engines")
+    cache.save(pathname)
+    os.utime(pathname, (1000, 1000))
+    cache.save(pathname)
+    # Not written again, as nothing changed
+    tc.assertEqual(os.stat(pathname).st_mtime, 1000)
+    cache2 = gtp_controller.Engine_capability_cache()
+    cache2.update('key2', gtp_controller.Engine_capabilities({'foo' : True}))
+    cache2.load(pathname)
+    tc.assertEqual(cache2.get('key1').known_commands,
+                   {'foo' : True, 'bar' : False})
+    tc.assertEqual(cache2.get('key1').engine_description.name, "name")
+    tc.assertEqual(cache2.get('key2').known_commands, {'foo' : True})
+    # Missing or broken files are ignored
+    cache2.load(os.path.join(tc.sandbox(), "nonexistent"))
+    with open(pathname, "w") as f:
+        f.write("garbage")
+    cache2.load(pathname)
+    tc.assertEqual(cache2.get('key2').known_commands, {'foo' : True})
+
 def test_game_controller(tc):
     channel1 = gtp_engine_fixtures.get_test_channel()
     controller1 = Gtp_controller(channel1, 'player one')
@@ -787,6 +1091,8 @@ def test_game_controller(tc):
     tc.assertEqual(gc.send_command('b', 'test'), "test response")
     tc.assertEqual(gc.send_command('w', 'test', 'abc', 'def'),
                    "args: abc def")
+    tc.assertEqual(gc.send_commands('w', [('test',), ('test', 'abc')]),
+                   ["test response", "args: abc"])
 
     tc.assertEqual(gc.send_command('b', 'b_only'), "yes")
     with tc.assertRaises(BadGtpResponse) as ar:
@@ -833,6 +1139,8 @@ def test_game_controller(tc):
         ('known_command', ['gomill-describe_engine']),
         ('known_command', ['b_only']),
         ('test', ['abc', 'def']),
+        ('test', []),
+        ('test', ['abc']),
         ('b_only', []),
         ('quit', []),
         ])
@@ -882,6 +1190,35 @@ def test_game_controller_engine_descriptions(tc):
     tc.assertIsNone(gc.engine_descriptions['w'].raw_version)
     tc.assertIsNone(gc.engine_descriptions['w'].description)
 
+def test_game_controller_capabilities(tc):
+    channel1 = gtp_engine_fixtures.get_test_channel()
+    controller1 = Gtp_controller(channel1, 'player one')
+    channel1.engine.add_command('name', lambda args:"some-name")
+    channel1.engine.add_command('gomill-cpu_time', lambda args:"0")
+    gc = gtp_controller.Game_controller('one', 'two')
+    gc.set_player_controller('b', controller1)
+    tc.assertIs(gc.known_command('b', 'gomill-cpu_time'), True)
+    capabilities = gc.get_engine_capabilities('b')
+    tc.assertEqual(capabilities.engine_description.raw_name, "some-name")
+    tc.assertEqual(capabilities.known_commands,
+                   {'gomill-describe_engine' : False,
+                    'gomill-cpu_time' : True})
+
+    channel2 = gtp_engine_fixtures.get_test_channel()
+    controller2 = Gtp_controller(channel2, 'player one')
+    gc2 = gtp_controller.Game_controller('one', 'two')
+    gc2.set_player_controller('b', controller2, capabilities=capabilities)
+    tc.assertIs(gc2.engine_descriptions['b'],
+                capabilities.engine_description)
+    tc.assertIs(gc2.known_command('b', 'gomill-cpu_time'), True)
+    tc.assertIs(gc2.known_command('b', 'gomill-explain_last_move'), False)
+    # Only the protocol version check and the new query were sent
+    tc.assertEqual(channel2.engine.commands_handled,
+                   [('protocol_version', []),
+                    ('known_command', ['gomill-explain_last_move'])])
+    tc.assertIn('gomill-explain_last_move',
+                gc2.get_engine_capabilities('b').known_commands)
+
 def test_game_controller_protocol_version(tc):
     channel1 = gtp_engine_fixtures.get_test_channel()
     controller1 = Gtp_controller(channel1, 'player one')
@@ -1113,3 +1450,94 @@ def test_game_controller_set_player_subprocess_error(tc):
     tc.assertRaises(KeyError, gc.get_controller, 'b')
     tc.assertEqual(gc.get_resource_usage_cpu_times(), {'b' : None, 'w' : None})
 
+
+def test_game_controller_set_player_subprocess_pooled(tc):
+    msf = gtp_engine_fixtures.Mock_subprocess_fixture(tc)
+    engine = gtp_engine_fixtures.get_test_engine()
+    cpu_time = [10.0]
+    engine.add_command("gomill-cpu_time", lambda args:str(cpu_time[0]))
+    msf.register_engine('cpu', engine)
+    pool = gtp_controller.Gtp_channel_pool()
+
+    gc = gtp_controller.Game_controller('one', 'two')
+    gc.set_player_subprocess('b', ['testb', 'id=one', 'engine=cpu'],
+                             pool=pool, max_uses=2, response_timeout=5)
+    gc.set_player_subprocess('w', ['testw', 'id=two'])
+    channel1 = msf.get_channel('one')
+    tc.assertEqual(channel1.requested_response_timeout, 5)
+    cpu_time[0] = 12.5
+    tc.assertEqual(gc.get_gtp_cpu_times(), ({'b' : 2.5}, set()))
+    gc.close_players()
+    tc.assertFalse(channel1.is_closed)
+    tc.assertTrue(msf.get_channel('two').is_closed)
+    tc.assertEqual(gc.get_resource_usage_cpu_times(),
+                   {'b': None, 'w': 567.2})
+
+    # The subprocess is reused for the next game
+    gc2 = gtp_controller.Game_controller('one', 'two')
+    gc2.set_player_subprocess('b', ['testb', 'id=one', 'engine=cpu'],
+                              pool=pool, max_uses=2, response_timeout=7)
+    gc2.set_player_subprocess('w', ['testw', 'id=two'])
+    tc.assertIs(gc2.get_controller('b').channel, channel1)
+    tc.assertEqual(channel1.requested_response_timeout, 7)
+    cpu_time[0] = 20.0
+    tc.assertEqual(gc2.get_gtp_cpu_times(), ({'b' : 7.5}, set()))
+    # This is its second game, so it's retired
+    gc2.close_players()
+    tc.assertTrue(channel1.is_closed)
+    tc.assertEqual(engine.commands_handled[-1], ('quit', []))
+
+    gc3 = gtp_controller.Game_controller('one', 'two')
+    gc3.set_player_subprocess('b', ['testb', 'id=three', 'engine=cpu'],
+                              pool=pool, pool_key=('testb', 'id=one'))
+    channel3 = msf.get_channel('three')
+    tc.assertIsNot(channel3, channel1)
+    gc3.close_players(return_to_pools=False)
+    tc.assertTrue(channel3.is_closed)
+    tc.assertIsNone(pool.take_channel(('testb', 'id=one')))
+
+def test_game_controller_set_player_socket(tc):
+    engine1 = gtp_engine_fixtures.get_test_engine()
+    engine1.add_command("name", lambda args:'blackplayer')
+    fx1 = gtp_engine_fixtures.Gtp_server_fixture(tc, engine1)
+    fx2 = gtp_engine_fixtures.Gtp_server_fixture(
+        tc, gtp_engine_fixtures.get_test_engine(), address=("127.0.0.1", 0))
+    pool = gtp_controller.Gtp_channel_pool()
+    gc = gtp_controller.Game_controller('one', 'two')
+    gc.set_player_socket('b', fx1.address, pool=pool,
+                         check_protocol_version=False)
+    gc.set_player_socket('w', fx2.address)
+    tc.assertEqual(gc.get_controller('b').name, "player one")
+    tc.assertEqual(gc.get_controller('w').name, "player two")
+    tc.assertEqual(gc.engine_descriptions['b'].raw_name, "blackplayer")
+    tc.assertIsNone(gc.engine_descriptions['w'].raw_name)
+    tc.assertEqual(gc.send_command('b', "test"), "test response")
+    channel1 = gc.get_controller('b').channel
+    gc.close_players()
+    tc.assertIsNone(gc.describe_late_errors())
+    tc.assertEqual(gc.get_resource_usage_cpu_times(), {'b': None, 'w': None})
+    tc.assertNotIn('quit',
+                   [command for (command, args) in engine1.commands_handled])
+    tc.assertEqual(fx2.engine.commands_handled[-1][0], 'quit')
+
+    # The pooled channel is reused for the next game
+    gc2 = gtp_controller.Game_controller('one', 'two')
+    gc2.set_player_socket('b', fx1.address, pool=pool, response_timeout=3)
+    tc.assertIs(gc2.get_controller('b').channel, channel1)
+    tc.assertEqual(channel1.response_timeout, 3)
+    tc.assertEqual(gc2.send_command('b', "test"), "test response")
+    gc2.close_players()
+    pool.close_all()
+    tc.assertEqual(engine1.commands_handled[-1][0], 'quit')
+
+def test_game_controller_set_player_socket_error(tc):
+    address = os.path.join(tc.sandbox(), "nonexistent.sock")
+    gc = gtp_controller.Game_controller('one', 'two')
+    with tc.assertRaises(GtpChannelError) as ar:
+        gc.set_player_socket('b', address)
+    tc.assertEqual(
+        str(ar.exception),
+        "error connecting to player one:\n"
+        "error connecting to %s:\n"
+        "[Errno 2] No such file or directory" % address)
+    tc.assertRaises(KeyError, gc.get_controller, 'b')
@@ -1,6 +1,8 @@
 """Engines (and channels) provided for the use of controller-side testing."""
 
 import os
+import socket
+import threading
 
 from gomill import gtp_controller
 from gomill import gtp_engine
@@ -311,6 +313,13 @@ class Mock_subprocess_gtp_channel(
         requested_stderr
         requested_cwd
         requested_env
+        requested_response_timeout
+        requested_deadline
+        requested_exit_timeout
+
+    Like a Subprocess_gtp_channel, this provides the set_response_timeout(),
+    set_deadline(), set_exit_timeout() (which update the requested_...
+    attributes) and is_connection_usable() methods.
 
     After close(), provides mocked-up exit_status and resource_usage, like a
     Subprocess_gtp_channel. The cpu time used is a function of command[0]
@@ -321,11 +330,15 @@ class Mock_subprocess_gtp_channel(
     callback_registry = {}
     channels = {}
 
-    def __init__(self, command, stderr=None, cwd=None, env=None):
+    def __init__(self, command, stderr=None, cwd=None, env=None,
+                 response_timeout=None, deadline=None, exit_timeout=None):
         self.requested_command = command
         self.requested_stderr = stderr
         self.requested_cwd = cwd
         self.requested_env = env
+        self.requested_response_timeout = response_timeout
+        self.requested_deadline = deadline
+        self.requested_exit_timeout = exit_timeout
         self.id = None
         engine = None
         callbacks = []
@@ -363,6 +376,19 @@ class Mock_subprocess_gtp_channel(
         for callback in callbacks:
             callback(self)
 
+    def set_response_timeout(self, timeout):
+        self.requested_response_timeout = timeout
+
+    def set_deadline(self, deadline):
+        self.requested_deadline = deadline
+
+    def set_exit_timeout(self, timeout):
+        self.requested_exit_timeout = timeout
+
+    def is_connection_usable(self):
+        return not (self.is_closed or self.session_is_ended or self.is_hung or
+                    self.stored_response)
+
     def close(self):
         # Nothing looks at exit_status, but we might as well make it plausible.
         try:
@@ -426,3 +452,49 @@ class Mock_subprocess_fixture(object):
     def get_channel(self, id):
         """Retrieve a channel via its 'id' command-line argument."""
         return Mock_subprocess_gtp_channel.channels[id]
+
+
+## Engine server
+
+class Gtp_server_fixture(object):
+    """Fixture running gtp_engine.serve_gtp_sessions() in a background thread.
+
+    Instantiate with the testcase, the engine to serve, and optionally an
+    address (by default it listens on a Unix-domain socket in the test's
+    sandbox).
+
+    attributes:
+      engine  -- the Gtp_engine_protocol
+      address -- address to connect to (as for Socket_gtp_channel)
+
+    The server is shut down at test cleanup time.
+
+    """
+    def __init__(self, tc, engine, address=None):
+        if address is None:
+            address = os.path.join(tc.sandbox(), "engine.sock")
+        self.engine = engine
+        self.listener = gtp_engine.make_listening_socket(address)
+        if isinstance(address, basestring):
+            self.address = address
+        else:
+            self.address = self.listener.getsockname()[:2]
+        self.thread = threading.Thread(target=self._run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        tc.addCleanup(self._stop)
+
+    def _run(self):
+        try:
+            gtp_engine.serve_gtp_sessions(self.engine, self.listener)
+        except socket.error:
+            pass
+
+    def _stop(self):
+        # Shutting down the listening socket wakes up accept()
+        try:
+            self.listener.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.thread.join(1)
+        self.listener.close()
@@ -2,6 +2,13 @@
 
 from __future__ import with_statement
 
+import os
+import socket
+import sys
+import threading
+import time
+from cStringIO import StringIO
+
 from gomill import gtp_engine
 
 from gomill_tests import gomill_test_support
@@ -54,3 +61,233 @@ def test_run_gtp_session_broken_pipe(tc):
     command_pipe.close()
     response_pipe.close()
 
+
+def test_serve_gtp_sessions(tc):
+    engine = gtp_engine.Gtp_engine_protocol()
+    engine.add_protocol_commands()
+    address = os.path.join(tc.sandbox(), "engine.sock")
+    listener = gtp_engine.make_listening_socket(address)
+    thread = threading.Thread(target=gtp_engine.serve_gtp_sessions,
+                              args=(engine, listener, 2))
+    thread.setDaemon(True)
+    thread.start()
+
+    def run_session(stream):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(address)
+        client.sendall(stream)
+        client.shutdown(socket.SHUT_WR)
+        f = client.makefile("rb")
+        result = f.read()
+        f.close()
+        client.close()
+        return result
+
+    # Session ended by 'quit'
+    tc.assertMultiLineEqual(run_session("protocol_version\nquit\nxyzzy\n"),
+                            "= 2\n\n=\n\n")
+    # Session ended by the controller closing the connection
+    tc.assertMultiLineEqual(run_session("xyzzy\n"),
+                            "? unknown command\n\n")
+    thread.join(5)
+    tc.assertFalse(thread.isAlive())
+    listener.close()
+
+def test_ponder_handler(tc):
+    log = []
+    started = threading.Event()
+    def ponder(token):
+        log.append('start')
+        started.set()
+        while not token.is_cancelled():
+            time.sleep(0.001)
+        log.append('stop')
+    def handle_test(args):
+        log.append('test')
+        return "test response"
+
+    engine = gtp_engine.Gtp_engine_protocol()
+    engine.add_protocol_commands()
+    engine.add_command('test', handle_test)
+    engine.set_ponder_handler(ponder)
+    check_engine = gtp_engine_test_support.check_engine
+    check_engine(tc, engine, 'test', [], "test response")
+    started.wait(5)
+    check_engine(tc, engine, 'test', [], "test response")
+    # The handler was stopped before the second command ran
+    tc.assertEqual(log[:4], ['test', 'start', 'stop', 'test'])
+    check_engine(tc, engine, 'quit', [], "", expect_end=True)
+    # Pondering isn't restarted after the session ends
+    tc.assertEqual(log[-1], 'stop')
+    tc.assertIsNone(engine._ponder_thread)
+
+def test_ponder_handler_error(tc):
+    def ponder(token):
+        raise ValueError("ponder failed")
+    engine = gtp_engine.Gtp_engine_protocol()
+    engine.add_protocol_commands()
+    engine.set_ponder_handler(ponder)
+    stream = "protocol_version\nprotocol_version\n"
+    command_pipe = test_support.Mock_reading_pipe(stream)
+    response_pipe = test_support.Mock_writing_pipe()
+    stderr = StringIO()
+    tc.addCleanup(setattr, sys, 'stderr', sys.stderr)
+    sys.stderr = stderr
+    gtp_engine.run_gtp_session(engine, command_pipe, response_pipe)
+    tc.assertMultiLineEqual(response_pipe.getvalue(), "= 2\n\n= 2\n\n")
+    tc.assertIn("error from ponder handler:", stderr.getvalue())
+    tc.assertIn("ValueError: ponder failed", stderr.getvalue())
+    tc.assertIsNone(engine._ponder_thread)
+    command_pipe.close()
+    response_pipe.close()
+
+def test_serve_concurrent_gtp_sessions(tc):
+    engines = []
+    def make_engine():
+        names = ["first", "second", "third"]
+        name = names[len(engines)]
+        if name == "third":
+            raise ValueError("can't make engine")
+        engine = gtp_engine.Gtp_engine_protocol()
+        engine.add_protocol_commands()
+        engine.add_command('name', lambda args: name)
+        engines.append(engine)
+        return engine
+    address = os.path.join(tc.sandbox(), "engine.sock")
+    listener = gtp_engine.make_listening_socket(address)
+    thread = threading.Thread(target=gtp_engine.serve_concurrent_gtp_sessions,
+                              args=(make_engine, listener, 3))
+    thread.setDaemon(True)
+    stderr = StringIO()
+    tc.addCleanup(setattr, sys, 'stderr', sys.stderr)
+    sys.stderr = stderr
+    thread.start()
+
+    def connect():
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(address)
+        return client, client.makefile("rb")
+    def command(client, f, line):
+        client.sendall(line + "\n")
+        return f.readline() + f.readline()
+
+    # Both sessions are open at once, each with its own engine
+    client1, f1 = connect()
+    tc.assertEqual(command(client1, f1, "name"), "= first\n\n")
+    client2, f2 = connect()
+    tc.assertEqual(command(client2, f2, "name"), "= second\n\n")
+    tc.assertEqual(command(client1, f1, "protocol_version"), "= 2\n\n")
+    tc.assertEqual(command(client2, f2, "quit"), "=\n\n")
+    tc.assertEqual(f2.read(), "")
+    tc.assertEqual(command(client1, f1, "name"), "= first\n\n")
+    # A failing engine factory closes the connection
+    client3, f3 = connect()
+    tc.assertEqual(f3.read(), "")
+    tc.assertTrue(thread.isAlive())
+    client1.shutdown(socket.SHUT_WR)
+    tc.assertEqual(f1.read(), "")
+    thread.join(5)
+    tc.assertFalse(thread.isAlive())
+    tc.assertIn("ValueError: can't make engine", stderr.getvalue())
+    for client, f in [(client1, f1), (client2, f2), (client3, f3)]:
+        f.close()
+        client.close()
+    listener.close()
+
+def test_serve_concurrent_gtp_sessions_close(tc):
+    closed = []
+    class Session(object):
+        def __init__(self, name):
+            self.name = name
+            self.engine = gtp_engine.Gtp_engine_protocol()
+            self.engine.add_protocol_commands()
+        def close(self):
+            closed.append(self.name)
+            if self.name == "second":
+                raise ValueError("can't close session")
+    sessions = []
+    def make_session():
+        session = Session(["first", "second"][len(sessions)])
+        sessions.append(session)
+        return session
+    address = os.path.join(tc.sandbox(), "engine.sock")
+    listener = gtp_engine.make_listening_socket(address)
+    thread = threading.Thread(target=gtp_engine.serve_concurrent_gtp_sessions,
+                              args=(make_session, listener, 2))
+    thread.setDaemon(True)
+    stderr = StringIO()
+    tc.addCleanup(setattr, sys, 'stderr', sys.stderr)
+    sys.stderr = stderr
+    thread.start()
+
+    client1 = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client1.connect(address)
+    f1 = client1.makefile("rb")
+    client1.sendall("quit\n")
+    tc.assertEqual(f1.read(), "=\n\n")
+    # The controller disconnects without sending quit
+    client2 = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client2.connect(address)
+    f2 = client2.makefile("rb")
+    client2.sendall("protocol_version\n")
+    tc.assertEqual(f2.readline() + f2.readline(), "= 2\n\n")
+    f2.close()
+    client2.close()
+    thread.join(5)
+    tc.assertFalse(thread.isAlive())
+    tc.assertEqual(closed, ["first", "second"])
+    tc.assertIn("error closing session:", stderr.getvalue())
+    tc.assertIn("ValueError: can't close session", stderr.getvalue())
+    f1.close()
+    client1.close()
+    listener.close()
+
+def test_command_statistics(tc):
+    stats = gtp_engine.Command_statistics()
+    tc.assertEqual(stats.format_report(), "no commands timed")
+    stats.record('genmove', 0.5)
+    stats.record('genmove', 12.0)
+    stats.record('play', 0.0001)
+    stats.record('genmove', 0.001)
+    timing = stats.timings['genmove']
+    tc.assertEqual(timing.count, 3)
+    tc.assertAlmostEqual(timing.total_time, 12.501)
+    tc.assertEqual(timing.max_time, 12.0)
+    tc.assertEqual(timing.histogram, [0, 1, 0, 1, 0, 1])
+    tc.assertEqual(stats.timings['play'].histogram, [1, 0, 0, 0, 0, 0])
+    tc.assertMultiLineEqual(stats.format_report(), "\n".join([
+        "command   calls total   mean   max      "
+        "<1ms <10ms <100ms <1s <10s >=10s",
+        "genmove      3  12.501  4.167  12.000      "
+        "0     1      0   1    0     1",
+        "play         1   0.000  0.000   0.000      "
+        "1     0      0   0    0     0",
+        ]))
+
+def test_engine_command_statistics(tc):
+    engine = gtp_engine.Gtp_engine_protocol()
+    engine.add_protocol_commands()
+    report_dest = StringIO()
+    engine.enable_command_statistics(report_dest)
+    check_engine = gtp_engine_test_support.check_engine
+    check_engine(tc, engine, 'protocol_version', [], "2")
+    check_engine(tc, engine, 'protocol_version', [], "2")
+    check_engine(tc, engine, 'xyzzy', [], "unknown command",
+                 expect_failure=True)
+    tc.assertEqual(engine.command_statistics.timings.keys(),
+                   ['protocol_version'])
+    tc.assertEqual(engine.command_statistics.timings['protocol_version'].count,
+                   2)
+    is_error, response, end_session = engine.run_command('gomill-stats', [])
+    tc.assertFalse(is_error)
+    tc.assertTrue(response.startswith("\ncommand "))
+    tc.assertIn("\nprotocol_version ", response)
+    check_engine(tc, engine, 'gomill-stats', ['xyzzy'], "invalid arguments",
+                 expect_failure=True)
+    check_engine(tc, engine, 'gomill-stats', ['reset'], "")
+    tc.assertEqual(report_dest.getvalue(), "")
+    check_engine(tc, engine, 'quit', [], "", expect_end=True)
+    report = report_dest.getvalue()
+    tc.assertIn("\ngomill-stats ", report)
+    tc.assertIn("\nquit ", report)
+    tc.assertNotIn("protocol_version", report)
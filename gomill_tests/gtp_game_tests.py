@@ -283,6 +283,15 @@ def test_unscored_game(tc):
     tc.assertEqual(game_score.player_scores, {'b' : None, 'w' : None})
     tc.assertEqual(game_score.get_detail(), "no score reported")
 
+def test_internal_scorer_remove_dead(tc):
+    # There are no dead stones in this game, so the score is unchanged.
+    fx = Gtp_game_fixture(tc)
+    fx.game.use_internal_scorer(remove_dead=True)
+    fx.game.prepare()
+    fx.game.run()
+    tc.assertEqual(fx.game.result.sgf_result, "B+18")
+    tc.assertRaises(ValueError, fx.game.use_internal_scorer, 'maybe')
+
 def test_jigo(tc):
     fx = Gtp_game_fixture(tc, komi=18.0)
     fx.game.use_internal_scorer()
@@ -992,6 +1001,20 @@ def test_game_result_cpu_time_pickle_compatibility(tc):
     result2 = pickle.loads(pickle.dumps(result))
     tc.assertEqual(result2.cpu_times, {'one' : 33.5, 'two' : None})
 
+def test_game_result_adjudication_pickle_compatibility(tc):
+    fx = Gtp_game_fixture(tc)
+    fx.game.prepare()
+    fx.game.run()
+    result = fx.game.result
+    result.is_adjudicated = True
+    result2 = pickle.loads(pickle.dumps(result))
+    tc.assertIs(result2.is_adjudicated, True)
+    tc.assertEqual(result2.detail, result.detail)
+    # State pickled by older versions doesn't include is_adjudicated
+    result3 = gtp_games.Game_result.__new__(gtp_games.Game_result)
+    result3.__setstate__(result.__getstate__()[:-1])
+    tc.assertIs(result3.is_adjudicated, False)
+
 
 def test_cautious_mode_setting(tc):
     fx = Gtp_game_fixture(tc)
@@ -2,7 +2,12 @@
 
 from __future__ import with_statement
 
+import os
+import socket
+import threading
+
 from gomill import gtp_controller
+from gomill import gtp_engine
 from gomill import gtp_proxy
 from gomill.gtp_engine import GtpError, GtpFatalError
 from gomill.gtp_controller import (
@@ -240,3 +245,506 @@ def test_set_back_end_subprocess_nonexistent_program(tc):
     tc.assertIsInstance(ar.exception.cause, GtpChannelError)
     # check it's safe to close when the controller was never set
     proxy.close()
+
+def test_state_tracker(tc):
+    tracker = gtp_proxy.State_tracker(untrackable_commands=['xyzzy'])
+    key0 = tracker.get_state_key()
+    tracker.note_response('boardsize', ['9'], "")
+    key1 = tracker.get_state_key()
+    tc.assertNotEqual(key1, key0)
+    tracker.note_response('komi', ['7.5'], "")
+    tracker.note_response('clear_board', [], "")
+    key2 = tracker.get_state_key()
+    tracker.note_response('play', ['black', 'd4'], "")
+    key3 = tracker.get_state_key()
+    tracker.note_response('reg_genmove', ['w'], "E5")
+    tc.assertEqual(tracker.get_state_key(), key3)
+    tracker.note_response('genmove', ['w'], "E5")
+    key4 = tracker.get_state_key()
+    tc.assertEqual(len(set([key0, key1, key2, key3, key4])), 5)
+    tracker.note_response('undo', [], "")
+    tc.assertEqual(tracker.get_state_key(), key3)
+    tracker.note_response('genmove', ['w'], "resign")
+    tc.assertEqual(tracker.get_state_key(), key3)
+    tracker.note_response('play', ['w', 'E5'], "")
+    tc.assertEqual(tracker.get_state_key(), key4)
+    tracker.note_response('clear_board', [], "")
+    tc.assertEqual(tracker.get_state_key(), key2)
+    tracker.note_response('komi', ['6.5'], "")
+    tc.assertNotEqual(tracker.get_state_key(), key2)
+    tracker.note_response('komi', ['7.50'], "")
+    tc.assertEqual(tracker.get_state_key(), key2)
+
+    tracker.note_response('fixed_handicap', ['2'], "d4 q16")
+    key5 = tracker.get_state_key()
+    tracker.note_response('clear_board', [], "")
+    tracker.note_response('set_free_handicap', ['D4', 'Q16'], "")
+    tc.assertEqual(tracker.get_state_key(), key5)
+
+    for command in ('loadsgf', 'xyzzy'):
+        tracker.note_response(command, ['x'], "")
+        tc.assertIsNone(tracker.get_state_key())
+        tracker.note_response('play', ['b', 'C3'], "")
+        tc.assertIsNone(tracker.get_state_key())
+        tracker.note_response('clear_board', [], "")
+        tc.assertIsNone(tracker.get_state_key())
+        tracker.note_response('boardsize', ['9'], "")
+        tracker.note_response('komi', ['7.5'], "")
+        tc.assertEqual(tracker.get_state_key(), key2)
+    tracker.note_response('undo', [], "")
+    tc.assertIsNone(tracker.get_state_key())
+    tracker.note_response('boardsize', ['9'], "")
+    tc.assertIsNotNone(tracker.get_state_key())
+
+def test_state_tracker_untrackable_size(tc):
+    # An untrackable command may change the board size and komi
+    tracker = gtp_proxy.State_tracker()
+    tracker.note_response('boardsize', ['19'], "")
+    tracker.note_response('komi', ['7.5'], "")
+    tracker.note_response('clear_board', [], "")
+    tracker.note_response('loadsgf', ['9x9.sgf'], "")
+    tracker.note_response('clear_board', [], "")
+    tc.assertIsNone(tracker.get_state_key())
+    tc.assertIsNone(tracker.get_replay_state())
+    tc.assertIsNone(tracker.board_size)
+    tc.assertIsNone(tracker.komi)
+    tc.assertEqual(tracker.get_reset_state(), (None, {}, []))
+    tracker.note_response('boardsize', ['9'], "")
+    tc.assertFalse(tracker.is_known())
+    tracker.note_response('komi', ['6.5'], "")
+    tc.assertTrue(tracker.is_known())
+    tc.assertEqual(tracker.get_state_key(), ('9', '6.5', ''))
+
+    tracker.note_response('loadsgf', ['9x9.sgf'], "")
+    tracker.note_response('komi', ['5.5'], "")
+    tracker.note_response('clear_board', [], "")
+    tc.assertFalse(tracker.is_known())
+    tracker.note_response('boardsize', ['19'], "")
+    tc.assertEqual(tracker.get_state_key(), ('19', '5.5', ''))
+
+def test_response_cache(tc):
+    cache = gtp_proxy.Response_cache(3)
+    for i in range(3):
+        cache.put(i, "r%d" % i)
+    tc.assertEqual(cache.get(0), "r0")
+    cache.put(3, "r3")
+    tc.assertEqual(len(cache), 3)
+    # 1 was the least recently used
+    tc.assertIsNone(cache.get(1))
+    tc.assertEqual(cache.get(2), "r2")
+    # Repeated access doesn't confuse eviction
+    for i in range(20):
+        cache.get(3)
+    cache.put(4, "r4")
+    cache.put(5, "r5")
+    tc.assertEqual(sorted(cache._entries), [3, 4, 5])
+    tc.assertLessEqual(len(cache._access_log), 4 * 3)
+    tc.assertEqual((cache.hits, cache.misses), (22, 1))
+
+    pathname = os.path.join(tc.sandbox(), "responses")
+    cache.save(pathname)
+    cache2 = gtp_proxy.Response_cache(2)
+    cache2.put(6, "r6")
+    cache2.load(pathname)
+    # loaded entries are older than existing ones
+    tc.assertEqual(sorted(cache2._entries), [5, 6])
+    tc.assertEqual(cache2.get(5), "r5")
+    cache3 = gtp_proxy.Response_cache(2)
+    cache3.load(os.path.join(tc.sandbox(), "nonexistent"))
+    tc.assertEqual(len(cache3), 0)
+    tc.assertRaises(ValueError, gtp_proxy.Response_cache, 0)
+
+def test_proxy_response_cache(tc):
+    evaluations = []
+    def handle_evaluate(args):
+        evaluations.append(args)
+        return "evaluation %d" % len(evaluations)
+    channel = gtp_engine_fixtures.get_test_player_channel()
+    channel.engine.add_command('evaluate', handle_evaluate)
+    proxy = gtp_proxy.Gtp_proxy()
+    proxy.set_back_end_controller(
+        gtp_controller.Gtp_controller(channel, 'testbackend'))
+    pathname = os.path.join(tc.sandbox(), "responses")
+    proxy.enable_response_cache(['evaluate', 'fail'], pathname=pathname)
+    def check(command, args, expected, **kwargs):
+        gtp_engine_test_support.check_engine(
+            tc, proxy.engine, command, args, expected, **kwargs)
+
+    check('boardsize', ['9'], "")
+    check('clear_board', [], "")
+    check('evaluate', ['b'], "evaluation 1")
+    check('evaluate', ['b'], "evaluation 1")
+    check('evaluate', ['w'], "evaluation 2")
+    check('genmove', ['b'], "E1")
+    check('evaluate', ['b'], "evaluation 3")
+    check('gomill-passthrough', ['evaluate', 'b'], "evaluation 3")
+    check('clear_board', [], "")
+    check('evaluate', ['b'], "evaluation 1")
+    check('play', ['b', 'E1'], "")
+    check('evaluate', ['b'], "evaluation 3")
+    # Failure responses aren't cached
+    check('fail', [], "test player forced to fail", expect_failure=True)
+    check('fail', [], "test player forced to fail", expect_failure=True)
+    tc.assertEqual(
+        [command for (command, args) in channel.engine.commands_handled],
+        ['list_commands', 'boardsize', 'clear_board', 'evaluate', 'evaluate',
+         'genmove', 'evaluate', 'clear_board', 'play', 'fail', 'fail'])
+    tc.assertEqual((proxy.response_cache.hits, proxy.response_cache.misses),
+                   (4, 5))
+    proxy.close()
+
+    # The cache is saved, and a new proxy can use it
+    channel2 = gtp_engine_fixtures.get_test_player_channel()
+    proxy2 = gtp_proxy.Gtp_proxy()
+    proxy2.set_back_end_controller(
+        gtp_controller.Gtp_controller(channel2, 'testbackend'))
+    proxy2.enable_response_cache(['evaluate'], pathname=pathname)
+    gtp_engine_test_support.check_engine(
+        tc, proxy2.engine, 'boardsize', ['9'], "")
+    tc.assertEqual(proxy2.pass_command('evaluate', ['w']), "evaluation 2")
+    tc.assertEqual(proxy2.pass_command('clear_board', []), "")
+    proxy2.close()
+
+def test_proxy_response_cache_untrackable(tc):
+    evaluations = []
+    def handle_evaluate(args):
+        evaluations.append(args)
+        return "evaluation %d" % len(evaluations)
+    channel = gtp_engine_fixtures.get_test_player_channel()
+    channel.engine.add_command('evaluate', handle_evaluate)
+    channel.engine.add_command('loadsgf', lambda args: "")
+    proxy = gtp_proxy.Gtp_proxy()
+    proxy.set_back_end_controller(
+        gtp_controller.Gtp_controller(channel, 'testbackend'))
+    proxy.enable_response_cache(['evaluate'])
+    def check(command, args, expected, **kwargs):
+        gtp_engine_test_support.check_engine(
+            tc, proxy.engine, command, args, expected, **kwargs)
+
+    check('boardsize', ['19'], "")
+    check('komi', ['7.5'], "")
+    check('clear_board', [], "")
+    check('evaluate', ['b'], "evaluation 1")
+    # The sgf file may have changed the board size and komi
+    check('loadsgf', ['9x9.sgf'], "")
+    check('clear_board', [], "")
+    check('evaluate', ['b'], "evaluation 2")
+    check('evaluate', ['b'], "evaluation 3")
+    check('boardsize', ['19'], "")
+    check('evaluate', ['b'], "evaluation 4")
+    check('komi', ['7.5'], "")
+    check('evaluate', ['b'], "evaluation 1")
+    proxy.close()
+
+def make_back_end_pool(tc, count, extra_commands={}):
+    pool = gtp_proxy.Back_end_pool()
+    channels = []
+    for i in range(count):
+        channel = gtp_engine_fixtures.get_test_player_channel()
+        channel.engine.add_commands(extra_commands)
+        pool.add_back_end_controller(
+            gtp_controller.Gtp_controller(channel, 'back end %d' % (i+1)))
+        channels.append(channel)
+    return pool, channels
+
+def test_back_end_pool_sync(tc):
+    pool, (channel,) = make_back_end_pool(
+        tc, 1, {'undo' : lambda args: "",
+                'set_free_handicap' : lambda args: ""})
+    commands_handled = channel.engine.commands_handled
+    tracker = gtp_proxy.State_tracker()
+    tracker.note_response('boardsize', ['9'], "")
+    tracker.note_response('komi', ['7.5'], "")
+    tracker.note_response('clear_board', [], "")
+    tracker.note_response('play', ['b', 'D4'], "")
+    tracker.note_response('genmove', ['w'], "E5")
+    back_end = pool.acquire(tracker.get_replay_state())
+    pool.sync(back_end, tracker.get_replay_state())
+    tc.assertEqual(commands_handled[1:], [
+        ('boardsize', ['9']), ('komi', ['7.5']), ('clear_board', []),
+        ('play', ['b', 'D4']), ('play', ['w', 'E5'])])
+    del commands_handled[:]
+    pool.sync(back_end, tracker.get_replay_state())
+    tc.assertEqual(commands_handled, [])
+
+    tracker.note_response('play', ['b', 'C3'], "")
+    pool.sync(back_end, tracker.get_replay_state())
+    tc.assertEqual(commands_handled, [('play', ['b', 'C3'])])
+    del commands_handled[:]
+
+    del commands_handled[:]
+    tracker.note_response('undo', [], "")
+    tracker.note_response('undo', [], "")
+    tracker.note_response('komi', ['6.5'], "")
+    pool.sync(back_end, tracker.get_replay_state())
+    tc.assertEqual(commands_handled, [
+        ('known_command', ['undo']), ('komi', ['6.5']), ('undo', []),
+        ('undo', [])])
+
+    tracker.note_response('clear_board', [], "")
+    tracker.note_response('set_free_handicap', ['D4', 'Q16'], "")
+    pool.sync(back_end, tracker.get_replay_state())
+    # Taking back handicap stones needs a replay
+    tracker.note_response('clear_board', [], "")
+    tracker.note_response('play', ['b', 'C3'], "")
+    del commands_handled[:]
+    pool.sync(back_end, tracker.get_replay_state())
+    tc.assertEqual(commands_handled, [
+        ('clear_board', []), ('play', ['b', 'C3'])])
+
+    # A rejected command leaves the back end's state unknown
+    del commands_handled[:]
+    channel.engine.force_error('play')
+    tracker.note_response('play', ['w', 'E5'], "")
+    with tc.assertRaises(BackEndError) as ar:
+        pool.sync(back_end, tracker.get_replay_state())
+    tc.assertEqual(str(ar.exception),
+                   "error bringing back end up to date:\n"
+                   "failure response from 'play w E5' to back end 1:\n"
+                   "handler forced to fail")
+    tc.assertIsNone(back_end.replay_state)
+    pool.release(back_end)
+    pool.close()
+    tc.assertTrue(channel.is_closed)
+
+def test_load_balancing_proxy(tc):
+    pool, channels = make_back_end_pool(tc, 2)
+    commands_handled = [channel.engine.commands_handled
+                        for channel in channels]
+    proxy1 = gtp_proxy.Load_balancing_gtp_proxy()
+    proxy1.set_back_end_pool(pool)
+    proxy2 = gtp_proxy.Load_balancing_gtp_proxy()
+    proxy2.set_back_end_pool(pool)
+    def check(proxy, command, args, expected, **kwargs):
+        gtp_engine_test_support.check_engine(
+            tc, proxy.engine, command, args, expected, **kwargs)
+    tc.assertIn('genmove', proxy1.engine.list_commands())
+
+    check(proxy1, 'boardsize', ['9'], "")
+    check(proxy1, 'clear_board', [], "")
+    check(proxy1, 'genmove', ['b'], "E1")
+    # proxy2 gets the other (idle, unused) back end
+    check(proxy2, 'boardsize', ['9'], "")
+    check(proxy2, 'clear_board', [], "")
+    check(proxy2, 'play', ['b', 'C3'], "")
+    tc.assertEqual(commands_handled[0][1:], [
+        ('boardsize', ['9']), ('clear_board', []), ('genmove', ['b'])])
+    tc.assertEqual(commands_handled[1][1:], [
+        ('boardsize', ['9']), ('clear_board', []), ('play', ['b', 'C3'])])
+    for l in commands_handled:
+        del l[:]
+
+    # With the second back end busy, proxy2 is moved to the first one,
+    # and the game so far is replayed there
+    other = pool.acquire(proxy2.state_tracker.get_replay_state())
+    tc.assertIs(other.controller.channel, channels[1])
+    check(proxy2, 'genmove', ['w'], "G2")
+    tc.assertEqual(commands_handled[0], [
+        ('known_command', ['undo']), ('clear_board', []),
+        ('play', ['b', 'C3']), ('genmove', ['w'])])
+    # proxy1 waits for the back end it last used
+    pool.release(other)
+    check(proxy1, 'play', ['w', 'G2'], "")
+    tc.assertEqual(commands_handled[1], [
+        ('clear_board', []), ('play', ['b', 'E1']), ('play', ['w', 'G2'])])
+    check(proxy1, 'fail', [], "test player forced to fail",
+          expect_failure=True)
+
+    check(proxy1, 'quit', [], "", expect_end=True)
+    proxy1.close()
+    proxy2.close()
+    tc.assertFalse(channels[0].is_closed)
+    pool.close()
+    tc.assertTrue(channels[0].is_closed)
+    tc.assertTrue(channels[1].is_closed)
+
+def test_load_balancing_proxy_untrackable(tc):
+    pool, channels = make_back_end_pool(
+        tc, 2, {'loadsgf' : lambda args: ""})
+    proxy1 = gtp_proxy.Load_balancing_gtp_proxy()
+    proxy1.set_back_end_pool(pool)
+    proxy2 = gtp_proxy.Load_balancing_gtp_proxy()
+    proxy2.set_back_end_pool(pool)
+    def check(proxy, command, args, expected, **kwargs):
+        gtp_engine_test_support.check_engine(
+            tc, proxy.engine, command, args, expected, **kwargs)
+    check(proxy1, 'boardsize', ['9'], "")
+    check(proxy1, 'loadsgf', ['game.sgf'], "")
+    # proxy1 keeps its back end, so proxy2 must use the other one
+    back_end = proxy1._pinned_back_end
+    tc.assertIs(back_end.controller.channel, channels[0])
+    tc.assertTrue(back_end.is_busy)
+    check(proxy2, 'boardsize', ['9'], "")
+    check(proxy1, 'play', ['b', 'C3'], "")
+    tc.assertEqual(
+        [command for command, args in channels[0].engine.commands_handled],
+        ['list_commands', 'boardsize', 'loadsgf', 'play'])
+    tc.assertEqual(
+        [command for command, args in channels[1].engine.commands_handled],
+        ['list_commands', 'boardsize'])
+    # clear_board isn't enough to make the state known again
+    check(proxy1, 'clear_board', [], "")
+    tc.assertIs(proxy1._pinned_back_end, back_end)
+    check(proxy1, 'boardsize', ['9'], "")
+    tc.assertIs(proxy1._pinned_back_end, back_end)
+    check(proxy1, 'komi', ['7.5'], "")
+    tc.assertIsNone(proxy1._pinned_back_end)
+    tc.assertFalse(back_end.is_busy)
+    check(proxy1, 'loadsgf', ['game.sgf'], "")
+    back_end = proxy1._pinned_back_end
+    proxy1.close()
+    tc.assertFalse(back_end.is_busy)
+    tc.assertIsNone(back_end.replay_state)
+    pool.close()
+
+def test_load_balancing_proxy_channel_error(tc):
+    pool, channels = make_back_end_pool(tc, 2)
+    proxy = gtp_proxy.Load_balancing_gtp_proxy()
+    proxy.set_back_end_pool(pool)
+    channels[0].fail_command = 'genmove'
+    gtp_engine_test_support.check_engine(
+        tc, proxy.engine, 'boardsize', ['9'], "")
+    gtp_engine_test_support.check_engine(
+        tc, proxy.engine, 'genmove', ['b'],
+        "transport error sending 'genmove b' to back end 1:\n"
+        "forced failure for send_command_line",
+        expect_failure=True, expect_end=True)
+    # The broken back end is no longer used
+    tc.assertEqual(proxy.pass_command('genmove', ['b']), "E1")
+    tc.assertEqual(channels[1].engine.commands_handled[1:],
+                   [('boardsize', ['9']), ('clear_board', []),
+                    ('genmove', ['b'])])
+    channels[1].fail_command = 'xyzzy'
+    with tc.assertRaises(BackEndError):
+        proxy.pass_command('xyzzy', [])
+    tc.assertRaises(BackEndError, pool.acquire)
+    pool.close()
+
+def test_load_balancing_proxy_clear_board_sets_size(tc):
+    pool, channels = make_back_end_pool(tc, 2)
+    proxy9 = gtp_proxy.Load_balancing_gtp_proxy()
+    proxy9.set_back_end_pool(pool)
+    proxy19 = gtp_proxy.Load_balancing_gtp_proxy()
+    proxy19.set_back_end_pool(pool)
+    def check(proxy, command, args, expected, **kwargs):
+        gtp_engine_test_support.check_engine(
+            tc, proxy.engine, command, args, expected, **kwargs)
+    check(proxy9, 'boardsize', ['9'], "")
+    check(proxy9, 'clear_board', [], "")
+    check(proxy19, 'boardsize', ['19'], "")
+    for channel in channels:
+        del channel.engine.commands_handled[:]
+    # With the second back end busy, proxy19's clear_board goes to the
+    # back end which is at 9x9
+    other = pool.acquire(proxy19.state_tracker.get_replay_state())
+    tc.assertIs(other.controller.channel, channels[1])
+    check(proxy19, 'clear_board', [], "")
+    pool.release(other)
+    tc.assertEqual(channels[0].engine.commands_handled, [
+        ('boardsize', ['19']), ('clear_board', [])])
+    tc.assertEqual(pool.back_ends[0].replay_state[0], '19')
+    pool.close()
+
+def test_load_balancing_proxy_clear_board_after_untrackable(tc):
+    pool, channels = make_back_end_pool(
+        tc, 2, {'loadsgf' : lambda args: ""})
+    proxy_sgf = gtp_proxy.Load_balancing_gtp_proxy()
+    proxy_sgf.set_back_end_pool(pool)
+    proxy19 = gtp_proxy.Load_balancing_gtp_proxy()
+    proxy19.set_back_end_pool(pool)
+    def check(proxy, command, args, expected, **kwargs):
+        gtp_engine_test_support.check_engine(
+            tc, proxy.engine, command, args, expected, **kwargs)
+    check(proxy_sgf, 'boardsize', ['19'], "")
+    check(proxy_sgf, 'clear_board', [], "")
+    tc.assertIsNone(proxy_sgf._pinned_back_end)
+    check(proxy_sgf, 'loadsgf', ['9x9.sgf'], "")
+    back_end = proxy_sgf._pinned_back_end
+    tc.assertIs(back_end.controller.channel, channels[0])
+    # The back end may now be at 9x9, so clear_board doesn't release it
+    check(proxy_sgf, 'clear_board', [], "")
+    tc.assertIs(proxy_sgf._pinned_back_end, back_end)
+    tc.assertIsNone(back_end.replay_state)
+    check(proxy19, 'boardsize', ['19'], "")
+    proxy_sgf.close()
+    tc.assertFalse(back_end.is_busy)
+    tc.assertIsNone(back_end.replay_state)
+    for channel in channels:
+        del channel.engine.commands_handled[:]
+    # With the second back end busy, proxy19's clear_board goes to the
+    # back end which was used for loadsgf
+    other = pool.acquire(proxy19.state_tracker.get_replay_state())
+    tc.assertIs(other.controller.channel, channels[1])
+    check(proxy19, 'clear_board', [], "")
+    pool.release(other)
+    tc.assertEqual(channels[0].engine.commands_handled, [
+        ('boardsize', ['19']), ('clear_board', [])])
+    tc.assertEqual(back_end.replay_state[0], '19')
+    pool.close()
+
+def test_load_balancing_proxy_disconnect(tc):
+    # A session which disconnects while keeping a back end releases it
+    pool, channels = make_back_end_pool(
+        tc, 1, {'loadsgf' : lambda args: ""})
+    def make_proxy():
+        proxy = gtp_proxy.Load_balancing_gtp_proxy()
+        proxy.set_back_end_pool(pool)
+        return proxy
+    address = os.path.join(tc.sandbox(), "engine.sock")
+    listener = gtp_engine.make_listening_socket(address)
+    thread = threading.Thread(target=gtp_engine.serve_concurrent_gtp_sessions,
+                              args=(make_proxy, listener, 2))
+    thread.setDaemon(True)
+    thread.start()
+    def connect():
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(address)
+        client.settimeout(5)
+        return client, client.makefile("rb")
+    def command(client, f, line):
+        client.sendall(line + "\n")
+        return f.readline() + f.readline()
+
+    client1, f1 = connect()
+    tc.assertEqual(command(client1, f1, "boardsize 9"), "=\n\n")
+    tc.assertEqual(command(client1, f1, "loadsgf game.sgf"), "=\n\n")
+    f1.close()
+    client1.close()
+    client2, f2 = connect()
+    tc.assertEqual(command(client2, f2, "boardsize 9"), "=\n\n")
+    tc.assertEqual(command(client2, f2, "quit"), "=\n\n")
+    thread.join(5)
+    tc.assertFalse(thread.isAlive())
+    tc.assertFalse(pool.back_ends[0].is_busy)
+    f2.close()
+    client2.close()
+    listener.close()
+    pool.close()
+
+def test_load_balancing_proxy_lost_back_end(tc):
+    pool, channels = make_back_end_pool(
+        tc, 2, {'loadsgf' : lambda args: ""})
+    proxy = gtp_proxy.Load_balancing_gtp_proxy()
+    proxy.set_back_end_pool(pool)
+    def check(command, args, expected, **kwargs):
+        gtp_engine_test_support.check_engine(
+            tc, proxy.engine, command, args, expected, **kwargs)
+    check('boardsize', ['9'], "")
+    check('loadsgf', ['game.sgf'], "")
+    channels[0].fail_command = 'play'
+    check('play', ['b', 'C3'],
+          "transport error sending 'play b C3' to back end 1:\n"
+          "forced failure for send_command_line",
+          expect_failure=True, expect_end=True)
+    # The game state was only on the failed back end
+    check('play', ['b', 'C3'],
+          "game state lost with its back end; send boardsize or clear_board",
+          expect_failure=True, expect_end=True)
+    tc.assertEqual(channels[1].engine.commands_handled,
+                   [('list_commands', [])])
+    check('boardsize', ['9'], "")
+    check('komi', ['7.5'], "")
+    check('play', ['b', 'C3'], "")
+    tc.assertEqual(channels[1].engine.commands_handled[1:], [
+        ('boardsize', ['9']), ('komi', ['7.5']), ('play', ['b', 'C3'])])
+    pool.close()
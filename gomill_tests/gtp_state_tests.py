@@ -1,5 +1,6 @@
 """Tests for gtp_state.py."""
 
+import time
 from textwrap import dedent
 
 from gomill import boards
@@ -185,6 +186,31 @@ def test_play(tc):
     1  .  .  .  .  .  .  .  .  .
        A  B  C  D  E  F  G  H  J"""))
 
+def test_position_hashes(tc):
+    fx = Gtp_state_fixture(tc)
+    b = boards.Board(9)
+    hashes = [b.zobrist_hash()]
+    fx.check_command('play', ['B', "E5"], "")
+    b.play(4, 4, 'b')
+    hashes.append(b.zobrist_hash())
+    fx.check_command('play', ['W', "pass"], "")
+    hashes.append(b.zobrist_hash())
+    fx.player.set_next_move("A3")
+    fx.check_command('genmove', ['B'], "A3")
+    b.play(2, 0, 'b')
+    hashes.append(b.zobrist_hash())
+    tc.assertEqual(fx.gtp_state.position_hashes, hashes)
+    fx.check_command('genmove', ['W'], "pass")
+    hashes.append(b.zobrist_hash())
+    tc.assertEqual(fx.gtp_state.position_hashes, hashes)
+    tc.assertIs(fx.player.last_game_state.position_hashes,
+                fx.gtp_state.position_hashes)
+    fx.check_command('undo', [], "")
+    fx.check_command('undo', [], "")
+    tc.assertEqual(fx.gtp_state.position_hashes, hashes[:3])
+    fx.check_command('clear_board', [], "")
+    tc.assertEqual(fx.gtp_state.position_hashes, hashes[:1])
+
 def test_komi(tc):
     fx = Gtp_state_fixture(tc)
     fx.check_command('genmove', ['B'], "pass")
@@ -277,6 +303,38 @@ def test_undo(tc):
     fx.check_command('gomill-explain_last_move', [], "")
     fx.check_command('undo', [], "cannot undo", expect_failure=True)
 
+def test_undo_ko_and_captures(tc):
+    fx = Gtp_state_fixture(tc)
+    for colour, vertex in [
+        ('B', 'C5'), ('W', 'F5'),
+        ('B', 'D6'), ('W', 'E4'),
+        ('B', 'D4'), ('W', 'E6'),
+        ('B', 'E5'), ('W', 'D5'),
+        ('B', 'A1'),
+        ]:
+        fx.check_command('play', [colour, vertex], "")
+    fx.check_command('undo', [], "")
+    fx.check_command('genmove', ['B'], "pass")
+    tc.assertEqual(fx.player.last_game_state.ko_point, (4, 4))
+    fx.check_command('undo', [], "")
+    fx.check_command('undo', [], "")
+    fx.check_command('showboard', [], dedent("""
+    9  .  .  .  .  .  .  .  .  .
+    8  .  .  .  .  .  .  .  .  .
+    7  .  .  .  .  .  .  .  .  .
+    6  .  .  .  #  o  .  .  .  .
+    5  .  .  #  .  #  o  .  .  .
+    4  .  .  .  #  o  .  .  .  .
+    3  .  .  .  .  .  .  .  .  .
+    2  .  .  .  .  .  .  .  .  .
+    1  .  .  .  .  .  .  .  .  .
+       A  B  C  D  E  F  G  H  J"""))
+    fx.check_command('genmove', ['W'], "pass")
+    tc.assertIsNone(fx.player.last_game_state.ko_point)
+    tc.assertEqual(len(fx.gtp_state.position_hashes), 9)
+    tc.assertEqual(fx.gtp_state.position_hashes[-1],
+                   fx.gtp_state.board.zobrist_hash())
+
 def test_fixed_handicap(tc):
     fx = Gtp_state_fixture(tc)
     fx.check_command('fixed_handicap', ['3'], "C3 G7 C7")
@@ -579,3 +637,67 @@ def test_get_last_move_and_cookie(tc):
     tc.assertEqual(gtp_states.get_last_move_and_cookie(history_moves, 'w'),
                    (False, None, None))
 
+
+def test_ponder(tc):
+    fx = Gtp_state_fixture(tc)
+    pondered = []
+    def ponderer(game_state, colour, token):
+        pondered.append((colour, len(game_state.move_history),
+                         game_state.ponder_result))
+        if game_state.ponder_result is None:
+            return {(3, 3) : "work for D4"}
+        return dict(game_state.ponder_result, resumed=True)
+    fx.gtp_state.set_ponderer(ponderer)
+    token = gtp_engine.Cancellation_token()
+
+    # Nothing to ponder before the engine has generated a move
+    fx.gtp_state.ponder(token)
+    tc.assertEqual(pondered, [])
+
+    fx.player.set_next_move("A3")
+    fx.check_command('genmove', ['B'], "A3")
+    fx.gtp_state.ponder(token)
+    fx.gtp_state.ponder(token)
+    tc.assertEqual(pondered, [('w', 1, None),
+                              ('w', 1, {(3, 3) : "work for D4"})])
+    fx.check_command('play', ['W', 'D4'], "")
+    # Not the opponent's turn any more
+    fx.gtp_state.ponder(token)
+    tc.assertEqual(len(pondered), 2)
+    fx.player.set_next_move("C3")
+    fx.check_command('genmove', ['B'], "C3")
+    tc.assertEqual(fx.player.last_game_state.ponder_result,
+                   {(3, 3) : "work for D4", 'resumed' : True})
+
+    # The ponder result is discarded if the position changes
+    fx.gtp_state.ponder(token)
+    fx.check_command('undo', [], "")
+    fx.check_command('play', ['B', 'C5'], "")
+    fx.check_command('play', ['W', 'E5'], "")
+    fx.player.set_next_move("C4")
+    fx.check_command('genmove', ['B'], "C4")
+    tc.assertIsNone(fx.player.last_game_state.ponder_result)
+
+    # reg_genmove doesn't use or discard the ponder result
+    fx.gtp_state.ponder(token)
+    fx.check_command('play', ['W', 'F6'], "")
+    fx.check_command('reg_genmove', ['B'], "pass")
+    tc.assertIsNone(fx.player.last_game_state.ponder_result)
+    fx.check_command('genmove', ['B'], "pass")
+    tc.assertEqual(fx.player.last_game_state.ponder_result,
+                   {(3, 3) : "work for D4"})
+
+def test_ponder_via_engine(tc):
+    fx = Gtp_state_fixture(tc)
+    def ponderer(game_state, colour, token):
+        while not token.is_cancelled():
+            time.sleep(0.001)
+        return "pondered %s" % format_vertex(game_state.move_history[-1].move)
+    fx.gtp_state.set_ponderer(ponderer)
+    fx.engine.set_ponder_handler(fx.gtp_state.ponder)
+    fx.player.set_next_move("A3")
+    fx.check_command('genmove', ['B'], "A3")
+    fx.check_command('play', ['W', 'D4'], "")
+    fx.check_command('genmove', ['B'], "pass")
+    tc.assertEqual(fx.player.last_game_state.ponder_result, "pondered A3")
+    fx.check_command('quit', [], "", expect_end=True)
@@ -0,0 +1,213 @@
+"""Tests for gtp_transcripts.py"""
+
+from __future__ import with_statement
+
+import time
+from textwrap import dedent
+
+from gomill import gtp_controller
+from gomill import gtp_games
+from gomill import gtp_transcripts
+from gomill.gtp_controller import GtpChannelError, GtpChannelClosed
+
+from gomill_tests import gomill_test_support
+from gomill_tests import gtp_controller_test_support
+from gomill_tests import gtp_engine_fixtures
+from gomill_tests.gtp_engine_test_support import check_engine
+
+def make_tests(suite):
+    suite.addTests(gomill_test_support.make_simple_tests(globals()))
+
+
+def make_transcript():
+    transcript = gtp_transcripts.Gtp_transcript()
+    transcript.add_exchange('protocol_version', [], False, "2", 0.001)
+    transcript.add_exchange('genmove', ['b'], False, "D4", 0.25)
+    transcript.add_exchange('xyzzy', ['a', 'b'], True, "unknown command",
+                            0.0)
+    transcript.add_exchange('multiline', [], False,
+                            "first line\nsecond line", 0.5)
+    transcript.add_exchange('quit', [], False, "", 0.002)
+    return transcript
+
+def test_recording(tc):
+    channel = gtp_engine_fixtures.get_test_channel()
+    transcript = gtp_transcripts.Gtp_transcript()
+    channel.enable_recording(transcript)
+    channel.send_command("test", [])
+    channel.send_command("test", ["abc", "def"])
+    tc.assertEqual(channel.get_response(), (False, "test response"))
+    tc.assertEqual(channel.get_response(), (False, "args: abc def"))
+    channel.send_command("error", [])
+    tc.assertEqual(channel.get_response(), (True, "normal error"))
+    channel.send_command("multiline", [])
+    channel.get_response()
+    channel.disable_recording()
+    channel.send_command("test", [])
+    channel.get_response()
+    tc.assertEqual(
+        [exchange[:4] for exchange in transcript.exchanges],
+        [('test', [], False, "test response"),
+         ('test', ['abc', 'def'], False, "args: abc def"),
+         ('error', [], True, "normal error"),
+         ('multiline', [], False, "first line  \n  second line\nthird line"),
+         ])
+    for exchange in transcript.exchanges:
+        tc.assertGreaterEqual(exchange[4], 0.0)
+
+def test_recording_pipelined(tc):
+    class Slow_channel(gtp_controller_test_support.Testing_gtp_channel):
+        def get_response_impl(self):
+            time.sleep(0.05)
+            return gtp_controller_test_support.Testing_gtp_channel.\
+                get_response_impl(self)
+    channel = Slow_channel(gtp_engine_fixtures.get_test_engine())
+    controller = gtp_controller.Gtp_controller(channel, 'player test')
+    transcript = gtp_transcripts.Gtp_transcript()
+    channel.enable_recording(transcript)
+    controller.do_commands([('test',), ('test',), ('test',)])
+    tc.assertEqual([exchange[0] for exchange in transcript.exchanges],
+                   ['test', 'test', 'test'])
+    # Each exchange is timed from the previous response, not from when its
+    # command was sent.
+    for exchange in transcript.exchanges:
+        tc.assertGreaterEqual(exchange[4], 0.04)
+        tc.assertLess(exchange[4], 0.09)
+
+def test_serialise(tc):
+    transcript = make_transcript()
+    s = transcript.serialise()
+    tc.assertMultiLineEqual(s, dedent("""\
+    >> protocol_version
+    << 0.001000 = 2
+    >> genmove b
+    << 0.250000 = D4
+    >> xyzzy a b
+    << 0.000000 ? unknown command
+    >> multiline
+    << 0.500000 = first line
+    .. second line
+    >> quit
+    << 0.002000 =
+    """))
+    transcript2 = gtp_transcripts.Gtp_transcript.from_string(s)
+    tc.assertEqual(transcript2.exchanges, transcript.exchanges)
+    tc.assertAlmostEqual(transcript2.get_total_elapsed(), 0.753)
+
+def test_from_string(tc):
+    transcript = gtp_transcripts.Gtp_transcript.from_string(dedent("""\
+    # comment
+
+    >> boardsize 9
+    << 0.5 =
+    >> name
+    << 1 =
+    .. one
+    .. two
+    """))
+    tc.assertEqual(transcript.exchanges, [
+        ('boardsize', ['9'], False, "", 0.5),
+        ('name', [], False, "\none\ntwo", 1.0),
+        ])
+
+def test_from_string_errors(tc):
+    def check(s, msg):
+        tc.assertRaisesRegexp(ValueError, "^" + msg,
+                              gtp_transcripts.Gtp_transcript.from_string, s)
+    check(">> foo\n>> bar\n", "line 2: missing response")
+    check("<< 0.1 = x\n", "line 1: response without command")
+    check(">> foo\n<< 0.1 x\n", "line 2: bad response indicator")
+    check(">> foo\n<< abc = x\n", "line 2: bad time")
+    check(">> foo\n<< -1 = x\n", "line 2: bad time")
+    check(">> foo\n<< 0.1\n", "line 2: ill-formed response line")
+    check(".. x\n", "line 1: continuation without response")
+    check("foo\n", "line 1: unexpected line")
+    check(">> foo\n", "missing response at end of transcript")
+
+def test_replay_channel(tc):
+    channel = gtp_transcripts.Replay_gtp_channel(make_transcript())
+    channel.send_command("protocol_version", [])
+    channel.send_command("genmove", ["b"])
+    tc.assertEqual(channel.get_response(), (False, "2"))
+    tc.assertEqual(channel.get_response(), (False, "D4"))
+    channel.send_command("xyzzy", ["a", "b"])
+    tc.assertEqual(channel.get_response(), (True, "unknown command"))
+    tc.assertRaisesRegexp(
+        GtpChannelError,
+        "transcript mismatch: exchange 4: "
+        "expected 'multiline', received 'multiline x'",
+        channel.send_command, "multiline", ["x"])
+    channel.send_command("multiline", [])
+    tc.assertEqual(channel.get_response(),
+                   (False, "first line\nsecond line"))
+    channel.send_command("quit", [])
+    tc.assertEqual(channel.get_response(), (False, ""))
+    tc.assertRaises(GtpChannelClosed, channel.send_command, "quit", [])
+    tc.assertRaises(GtpChannelClosed, channel.get_response)
+
+def test_replay_channel_speed(tc):
+    transcript = gtp_transcripts.Gtp_transcript()
+    transcript.add_exchange('genmove', ['b'], False, "D4", 0.4)
+    transcript.add_exchange('genmove', ['w'], False, "E5", 0.4)
+    tc.assertRaises(ValueError,
+                    gtp_transcripts.Replay_gtp_channel, transcript, 0)
+    channel = gtp_transcripts.Replay_gtp_channel(transcript, speed=4.0)
+    start = time.time()
+    channel.send_command("genmove", ["b"])
+    channel.send_command("genmove", ["w"])
+    channel.get_response()
+    channel.get_response()
+    # The commands were pipelined, so the delays overlap
+    elapsed = time.time() - start
+    tc.assertGreaterEqual(elapsed, 0.09)
+    tc.assertLess(elapsed, 0.18)
+
+def test_replay_engine(tc):
+    engine = gtp_transcripts.make_replay_engine(make_transcript())
+    tc.assertItemsEqual(engine.list_commands(),
+                        ['protocol_version', 'genmove', 'xyzzy',
+                         'multiline', 'quit'])
+    check_engine(tc, engine, 'protocol_version', [], "2")
+    check_engine(tc, engine, 'genmove', ['b'], "D4")
+    check_engine(tc, engine, 'xyzzy', ['a', 'b'], "unknown command",
+                 expect_failure=True)
+    check_engine(tc, engine, 'quit', [],
+                 "transcript mismatch: exchange 4: "
+                 "expected 'multiline', received 'quit'",
+                 expect_failure=True, expect_end=True)
+
+def test_replay_engine_end(tc):
+    engine = gtp_transcripts.make_replay_engine(make_transcript())
+    for command, args, is_failure, response, elapsed in \
+            make_transcript().exchanges[:-1]:
+        check_engine(tc, engine, command, args, response,
+                     expect_failure=is_failure)
+    check_engine(tc, engine, 'quit', [], "", expect_end=True)
+
+def test_replay_game(tc):
+    def play_game(channel_b, channel_w):
+        game_controller = gtp_controller.Game_controller('one', 'two')
+        game_controller.set_player_controller(
+            'b', gtp_controller.Gtp_controller(channel_b, 'player one'))
+        game_controller.set_player_controller(
+            'w', gtp_controller.Gtp_controller(channel_w, 'player two'))
+        game = gtp_games.Gtp_game(game_controller, board_size=9)
+        game.prepare()
+        game.run()
+        game_controller.close_players()
+        return game
+    channel_b = gtp_engine_fixtures.get_test_player_channel()
+    channel_w = gtp_engine_fixtures.get_test_player_channel()
+    transcript_b = gtp_transcripts.Gtp_transcript()
+    transcript_w = gtp_transcripts.Gtp_transcript()
+    channel_b.enable_recording(transcript_b)
+    channel_w.enable_recording(transcript_w)
+    game = play_game(channel_b, channel_w)
+    tc.assertEqual(transcript_b.exchanges[-1][:2], ('quit', []))
+    tc.assertEqual(transcript_w.exchanges[-1][:2], ('quit', []))
+
+    replayed_game = play_game(
+        gtp_transcripts.Replay_gtp_channel(transcript_b),
+        gtp_transcripts.Replay_gtp_channel(transcript_w))
+    tc.assertEqual(replayed_game.result.describe(), game.result.describe())
+    tc.assertEqual(replayed_game.get_moves(), game.get_moves())
@@ -0,0 +1,129 @@
+"""Tests for job_manager.py"""
+
+from __future__ import with_statement
+
+import threading
+
+from gomill import job_manager
+
+from gomill_tests import gomill_test_support
+
+def make_tests(suite):
+    suite.addTests(gomill_test_support.make_simple_tests(globals()))
+
+
+class Test_job(object):
+    """Job which waits until a number of jobs are running at once."""
+    def __init__(self, n, barrier):
+        self.n = n
+        self.barrier = barrier
+
+    def run(self, worker_id):
+        self.barrier.wait()
+        if self.n == 3:
+            raise job_manager.JobFailed("job 3 failed")
+        if self.n == 4:
+            raise ValueError("job 4 broke")
+        return (self.n, worker_id)
+
+class Test_barrier(object):
+    """Block until 'count' threads are waiting (or a timeout passes)."""
+    def __init__(self, count):
+        self.count = count
+        self.condition = threading.Condition()
+        self.all_arrived = False
+
+    def wait(self):
+        with self.condition:
+            self.count -= 1
+            if self.count <= 0:
+                self.all_arrived = True
+                self.condition.notifyAll()
+            else:
+                self.condition.wait(5)
+
+class Test_job_source(object):
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.responses = []
+        self.errors = []
+
+    def get_job(self):
+        if not self.jobs:
+            return job_manager.NoJobAvailable
+        return self.jobs.pop(0)
+
+    def process_response(self, response):
+        self.responses.append(response)
+
+    def process_error_response(self, job, msg):
+        self.errors.append((job.n, msg))
+
+
+def test_threaded_job_manager(tc):
+    barrier = Test_barrier(5)
+    source = Test_job_source([Test_job(n, barrier) for n in range(5)])
+    job_manager.run_jobs(source, max_workers=5, use_threads=True)
+    # Every job was waiting for all five to start, so they ran concurrently
+    tc.assertIs(barrier.all_arrived, True)
+    tc.assertEqual(sorted(n for (n, worker_id) in source.responses),
+                   [0, 1, 2])
+    tc.assertEqual(
+        sorted(worker_id for (n, worker_id) in source.responses),
+        sorted(set(worker_id for (n, worker_id) in source.responses)))
+    tc.assertEqual(len(source.errors), 2)
+    errors = dict(source.errors)
+    tc.assertEqual(errors[3], "job 3 failed")
+    tc.assertIn("ValueError: job 4 broke", errors[4])
+
+def test_threaded_job_manager_needs_max_workers(tc):
+    source = Test_job_source([])
+    tc.assertRaises(ValueError, job_manager.run_jobs, source, use_threads=True)
+
+def test_threaded_job_manager_job_source_error(tc):
+    class Bad_job_source(Test_job_source):
+        def process_response(self, response):
+            raise StandardError("bad response")
+    source = Bad_job_source([Test_job(0, Test_barrier(1))])
+    with tc.assertRaises(job_manager.JobSourceError) as ar:
+        job_manager.run_jobs(source, max_workers=2, use_threads=True)
+    tc.assertIn("error from process_response()", str(ar.exception))
+
+class Prelaunch_test_job(object):
+    """Job which records calls to prelaunch() and run()."""
+    def __init__(self, n, log):
+        self.n = n
+        self.log = log
+
+    def prelaunch(self, worker_id):
+        self.log.append(('prelaunch', self.n))
+        if self.n == 2:
+            raise job_manager.JobFailed("job 2 failed to prelaunch")
+
+    def run(self, worker_id):
+        self.log.append(('run', self.n))
+        return (self.n, worker_id)
+
+def test_in_process_job_manager_prelaunch(tc):
+    log = []
+    source = Test_job_source([Prelaunch_test_job(n, log) for n in range(4)])
+    job_manager.run_jobs(source, allow_mp=False, prelaunch=True)
+    tc.assertEqual(source.responses, [(0, None), (1, None), (3, None)])
+    tc.assertEqual(source.errors, [(2, "job 2 failed to prelaunch")])
+    # The first job isn't prelaunched, nor is the job after a failure
+    tc.assertEqual(sorted(n for (event, n) in log if event == 'prelaunch'),
+                   [1, 2])
+    tc.assertEqual([n for (event, n) in log if event == 'run'], [0, 1, 3])
+    tc.assertLess(log.index(('prelaunch', 1)), log.index(('run', 1)))
+
+def test_threaded_job_manager_prelaunch(tc):
+    log = []
+    source = Test_job_source([Prelaunch_test_job(n, log) for n in range(6)])
+    job_manager.run_jobs(source, max_workers=1, use_threads=True,
+                         prelaunch=True)
+    tc.assertEqual(source.responses, [(0, 0), (1, 0), (3, 0), (4, 0), (5, 0)])
+    tc.assertEqual(source.errors, [(2, "job 2 failed to prelaunch")])
+    tc.assertEqual(sorted(n for (event, n) in log if event == 'prelaunch'),
+                   [1, 2, 4, 5])
+    for n in (1, 4, 5):
+        tc.assertLess(log.index(('prelaunch', n)), log.index(('run', n)))
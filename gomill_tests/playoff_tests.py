@@ -163,6 +163,26 @@ def test_bad_matchup_config_bad_setting(tc):
     tc.assertMultiLineEqual(str(ar.exception), dedent("""\
     matchup 1: 'board_size': invalid integer"""))
 
+def test_bad_matchup_config_negative_margin(tc):
+    comp = playoffs.Playoff('test')
+    config = default_config()
+    config['matchups'].append(Matchup_config(
+        't1', 't2', adjudication_pass_alive_margin=-1))
+    with tc.assertRaises(ControlFileError) as ar:
+        comp.initialise_from_control_file(config)
+    tc.assertMultiLineEqual(str(ar.exception), dedent("""\
+    matchup 1: 'adjudication_pass_alive_margin': must not be negative"""))
+
+def test_bad_matchup_config_bad_timeout(tc):
+    comp = playoffs.Playoff('test')
+    config = default_config()
+    config['matchups'].append(Matchup_config(
+        't1', 't2', gtp_response_timeout=0))
+    with tc.assertRaises(ControlFileError) as ar:
+        comp.initialise_from_control_file(config)
+    tc.assertMultiLineEqual(str(ar.exception), dedent("""\
+    matchup 1: 'gtp_response_timeout': must be positive"""))
+
 def test_bad_matchup_config_unknown_player(tc):
     comp = playoffs.Playoff('test')
     config = default_config()
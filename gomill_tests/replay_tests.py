@@ -0,0 +1,197 @@
+"""Tests for replays.py"""
+
+import random
+
+from gomill.common import move_from_vertex
+from gomill import ascii_boards
+from gomill import boards
+from gomill import replays
+
+from gomill_tests import gomill_test_support
+
+def make_tests(suite):
+    suite.addTests(gomill_test_support.make_simple_tests(globals()))
+
+
+def _interpret_moves(moves, side=9):
+    result = []
+    for s in moves:
+        colour, vertex = s.split()
+        result.append((colour, move_from_vertex(vertex, side)))
+    return result
+
+def _replay_with_numpy(games):
+    # Use the batch implementation even for a few games
+    saved = replays._MIN_BATCH_SIZE
+    replays._MIN_BATCH_SIZE = 1
+    try:
+        return replays.replay_games(games)
+    finally:
+        replays._MIN_BATCH_SIZE = saved
+
+def _replay_without_numpy(games):
+    saved = boards._initialise_numpy, boards.numpy
+    boards._initialise_numpy = lambda: None
+    boards.numpy = None
+    try:
+        return replays.replay_games(games)
+    finally:
+        boards._initialise_numpy, boards.numpy = saved
+
+def _check_replays(tc, games, expected):
+    """Check replay_games() with and without NumPy.
+
+    expected -- list of tuples (diagram, is_legal, moves_played, captures)
+
+    """
+    for results in (_replay_with_numpy(games),
+                    _replay_without_numpy(games)):
+        tc.assertEqual(len(results), len(expected))
+        for result, (diagram, is_legal, moves_played, captures) in zip(
+                results, expected):
+            tc.assertBoardEqual(result.board, diagram)
+            tc.assertIs(result.is_legal, is_legal)
+            tc.assertEqual(result.moves_played, moves_played)
+            tc.assertEqual(result.captures, captures)
+
+
+CAPTURE_DIAGRAM = """\
+9  .  .  .  .  .  .  .  .  .
+8  .  .  .  .  .  .  .  .  .
+7  .  .  .  .  .  .  .  .  .
+6  .  .  .  .  .  .  .  .  .
+5  .  .  .  .  .  .  .  .  .
+4  .  .  .  .  .  .  .  .  .
+3  #  .  .  .  .  .  .  .  .
+2  .  #  .  .  .  .  .  .  .
+1  #  .  #  .  .  .  .  .  .
+   A  B  C  D  E  F  G  H  J
+"""
+
+SELFCAPTURE_DIAGRAM = """\
+9  .  .  .  .  .  .  .  .  .
+8  .  .  .  .  .  .  .  .  .
+7  .  .  .  .  .  .  .  .  .
+6  .  .  .  .  .  .  .  .  .
+5  .  .  .  .  .  .  .  .  .
+4  .  .  .  .  .  .  .  .  .
+3  .  .  .  .  .  .  .  .  .
+2  #  .  .  .  .  .  .  .  .
+1  .  #  .  .  .  .  .  .  .
+   A  B  C  D  E  F  G  H  J
+"""
+
+def test_replay_captures(tc):
+    capture_moves = _interpret_moves([
+        "b A3", "w A2", "b B2", "w B1", "b C1", "w pass", "b A1",
+        ])
+    selfcapture_moves = _interpret_moves([
+        "b A2", "w pass", "b B1", "w A1",
+        ])
+    _check_replays(tc, [
+        (boards.Board(9), capture_moves),
+        (boards.Board(9), selfcapture_moves),
+        ], [
+        (CAPTURE_DIAGRAM, True, 7, {'b' : 2, 'w' : 0}),
+        (SELFCAPTURE_DIAGRAM, True, 4, {'b' : 1, 'w' : 0}),
+        ])
+
+KO_DIAGRAM = """\
+9  .  .  .  .  .  .  .  .  .
+8  .  .  .  .  .  .  .  .  .
+7  .  .  .  .  .  .  .  .  .
+6  .  .  .  #  o  .  .  .  .
+5  .  .  #  o  .  o  .  .  .
+4  .  .  .  #  o  .  .  .  .
+3  .  .  .  .  .  .  .  .  .
+2  .  .  .  .  .  .  .  .  .
+1  .  .  .  .  .  .  .  .  .
+   A  B  C  D  E  F  G  H  J
+"""
+
+def test_replay_ko(tc):
+    ko_setup_moves = [
+        "b C5", "w F5",
+        "b D6", "w E4",
+        "b D4", "w E6",
+        "b E5", "w D5",
+        ]
+    _check_replays(tc, [
+        (boards.Board(9), _interpret_moves(ko_setup_moves + ["b E5"])),
+        (boards.Board(9), _interpret_moves(ko_setup_moves + ["b pass"])),
+        (boards.Board(9), _interpret_moves(ko_setup_moves + ["w E5"])),
+        (boards.Board(9), _interpret_moves(ko_setup_moves + ["w pass",
+                                                             "b E5"])),
+        ], [
+        (KO_DIAGRAM, False, 8, {'b' : 0, 'w' : 1}),
+        (KO_DIAGRAM, True, 9, {'b' : 0, 'w' : 1}),
+        (KO_DIAGRAM.replace("#  o  .  o", "#  o  o  o"),
+         True, 9, {'b' : 0, 'w' : 1}),
+        (KO_DIAGRAM.replace("#  o  .  o", "#  .  #  o"),
+         True, 10, {'b' : 1, 'w' : 1}),
+        ])
+
+OCCUPIED_POINT_DIAGRAM = """\
+9  .  .  .  .  .  .  .  .  .
+8  .  .  .  .  .  .  .  .  .
+7  .  .  .  .  .  .  .  .  .
+6  .  .  .  .  .  .  .  .  .
+5  .  .  .  .  .  .  .  .  .
+4  .  .  .  .  .  .  .  .  .
+3  .  .  .  .  .  .  .  .  .
+2  .  o  .  .  .  .  .  .  .
+1  #  .  .  .  .  .  .  .  .
+   A  B  C  D  E  F  G  H  J
+"""
+
+def test_replay_occupied_point(tc):
+    board = boards.Board(9)
+    board.apply_setup([(0, 0)], [], [])
+    _check_replays(tc, [
+        (board, _interpret_moves(["w B2", "b pass", "w A1", "b C3"])),
+        (boards.Board(9), []),
+        ], [
+        (OCCUPIED_POINT_DIAGRAM, False, 2, {'b' : 0, 'w' : 0}),
+        (ascii_boards.render_board(boards.Board(9)) + "\n",
+         True, 0, {'b' : 0, 'w' : 0}),
+        ])
+    tc.assertEqual(board.list_occupied_points(), [('b', (0, 0))])
+
+def test_replay_off_board(tc):
+    games = [(boards.Board(9), [('b', (2, 3)), ('w', (9, 3))])]
+    tc.assertRaises(IndexError, _replay_with_numpy, games)
+    tc.assertRaises(IndexError, _replay_without_numpy, games)
+
+def test_replay_random_games(tc):
+    # Compare the results with and without NumPy for a mixture of board sizes,
+    # including captures, illegal moves, and setup stones.
+    rnd = random.Random(2468)
+    games = []
+    for i in xrange(60):
+        side = rnd.choice((5, 7, 9, 13))
+        board = boards.Board(side)
+        if rnd.random() < 0.3:
+            board.apply_setup(rnd.sample(board.board_points, 3), [], [])
+        shadow = board.copy()
+        plays = []
+        for move_number in xrange(rnd.randrange(200)):
+            colour = 'bw'[move_number % 2]
+            if rnd.random() < 0.05:
+                plays.append((colour, None))
+                continue
+            row, col = point = rnd.choice(shadow.board_points)
+            plays.append((colour, point))
+            if shadow.get(row, col) is not None:
+                break
+            shadow.play(row, col, colour)
+        games.append((board, plays))
+    with_numpy = _replay_with_numpy(games)
+    without_numpy = _replay_without_numpy(games)
+    tc.assertEqual(len(with_numpy), len(games))
+    for r1, r2, (board, plays) in zip(with_numpy, without_numpy, games):
+        tc.assertEqual(r1.board, r2.board)
+        tc.assertEqual(r1.is_legal, r2.is_legal)
+        tc.assertEqual(r1.moves_played, r2.moves_played)
+        tc.assertEqual(r1.captures, r2.captures)
+        if r1.is_legal:
+            tc.assertEqual(r1.moves_played, len(plays))
@@ -248,6 +248,16 @@ def test_stderr_settings_nolog(tc):
     tc.assertIs(job.player_b.discard_stderr, False)
     tc.assertIs(job.player_w.discard_stderr, True)
 
+def test_engine_cache_setting(tc):
+    fx = Ringmaster_fixture(tc, playoff_ctl)
+    job = fx.get_job()
+    tc.assertIsNone(job.engine_cache_pathname)
+    fx2 = Ringmaster_fixture(tc, playoff_ctl, [
+        "cache_engine_capabilities = True",
+        ])
+    job = fx2.get_job()
+    tc.assertEqual(job.engine_cache_pathname, "/nonexistent/ctl/test.engines")
+
 
 def test_get_tournament_results(tc):
     fx = Ringmaster_fixture(tc, playoff_ctl)
@@ -12,13 +12,16 @@ test_modules = [
     'sgf_properties_tests',
     'sgf_tests',
     'sgf_moves_tests',
+    'replay_tests',
     'gameplay_tests',
     'gtp_engine_tests',
     'gtp_state_tests',
     'gtp_controller_tests',
     'gtp_proxy_tests',
     'gtp_game_tests',
+    'gtp_transcript_tests',
     'game_job_tests',
+    'job_manager_tests',
     'setting_tests',
     'competition_scheduler_tests',
     'competition_tests',
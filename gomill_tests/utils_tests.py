@@ -4,6 +4,7 @@ from __future__ import with_statement
 
 import errno
 import os
+import threading
 
 from gomill_tests import gomill_test_support
 
@@ -77,3 +78,22 @@ def test_ensure_dir(tc):
         utils.ensure_dir(os.path.join(tc.sandbox(), "nonex", "sub"))
     tc.assertEqual(ar.exception.errno, errno.ENOENT)
 
+
+def test_call_concurrently(tc):
+    tc.assertEqual(utils.call_concurrently([]), [])
+    # Each function waits for the other to start, so they must run at once
+    events = [threading.Event(), threading.Event()]
+    def fn(i):
+        events[i].set()
+        return events[1-i].wait(5)
+    tc.assertEqual(utils.call_concurrently([lambda: fn(0), lambda: fn(1)]),
+                   [True, True])
+    def fail(msg):
+        raise ValueError(msg)
+    log = []
+    with tc.assertRaises(ValueError) as ar:
+        utils.call_concurrently([lambda: log.append(1),
+                                 lambda: fail("first"),
+                                 lambda: fail("second")])
+    tc.assertEqual(str(ar.exception), "first")
+    tc.assertEqual(log, [1])